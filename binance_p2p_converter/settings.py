@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 import os
 import sys
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -133,6 +134,28 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Binance P2P responses are cached in separate cache. Use file based or
+# database cache to share responses between gunicorn workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'binance_p2p': {
+        'BACKEND': os.getenv(
+            'BINANCE_P2P_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('BINANCE_P2P_CACHE_LOCATION', 'binance_p2p'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.getenv('BINANCE_P2P_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -173,3 +196,160 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Binance P2P api client.
+# Every worker process keeps one pooled keep-alive session to binance.
+BINANCE_P2P_POOL_CONNECTIONS = int(
+    os.getenv('BINANCE_P2P_POOL_CONNECTIONS', 4))
+BINANCE_P2P_POOL_MAXSIZE = int(os.getenv('BINANCE_P2P_POOL_MAXSIZE', 10))
+BINANCE_P2P_MAX_RETRIES = int(os.getenv('BINANCE_P2P_MAX_RETRIES', 2))
+BINANCE_P2P_BACKOFF_FACTOR = float(
+    os.getenv('BINANCE_P2P_BACKOFF_FACTOR', 0.3))
+BINANCE_P2P_BACKOFF_MAX = float(os.getenv('BINANCE_P2P_BACKOFF_MAX', 2))
+# (connect, read) timeouts of every binance endpoint, in seconds.
+BINANCE_P2P_TIMEOUTS = {
+    'search': (3.05, float(os.getenv('BINANCE_P2P_SEARCH_TIMEOUT', 5))),
+}
+# Requests to endpoint are rejected after consecutive failures, until
+# recovery timeout (seconds) passes and probe request succeeds.
+BINANCE_P2P_BREAKER_FAILURE_THRESHOLD = int(
+    os.getenv('BINANCE_P2P_BREAKER_FAILURE_THRESHOLD', 5))
+BINANCE_P2P_BREAKER_RECOVERY_TIMEOUT = float(
+    os.getenv('BINANCE_P2P_BREAKER_RECOVERY_TIMEOUT', 30))
+# Base url can point to local stub server (manage.py binance_stub).
+# Transport 'record' saves responses to fixtures dir, 'replay' serves
+# them without requests, 'live' only sends requests.
+BINANCE_P2P_BASE_URL = os.getenv(
+    'BINANCE_P2P_BASE_URL', 'https://p2p.binance.com')
+BINANCE_P2P_TRANSPORT = os.getenv('BINANCE_P2P_TRANSPORT', 'live')
+BINANCE_P2P_FIXTURES_DIR = os.getenv(
+    'BINANCE_P2P_FIXTURES_DIR', BASE_DIR / 'fixtures' / 'binance_p2p')
+# Outgoing requests of all workers are limited by token bucket with
+# rate (requests per second, 0 to disable) and burst. Bucket is kept in
+# local file, in quote cache or in memory of every process. Reserve is
+# share of burst kept for interactive requests, so they are sent before
+# discovery and background ones. Requests wait for tokens up to time
+# (seconds) of their priority and fail after it.
+BINANCE_P2P_RATE_LIMIT = float(os.getenv('BINANCE_P2P_RATE_LIMIT', 10))
+BINANCE_P2P_RATE_LIMIT_BURST = float(
+    os.getenv('BINANCE_P2P_RATE_LIMIT_BURST', 10))
+BINANCE_P2P_RATE_LIMIT_BACKEND = os.getenv(
+    'BINANCE_P2P_RATE_LIMIT_BACKEND', 'file')
+BINANCE_P2P_RATE_LIMIT_PATH = os.getenv(
+    'BINANCE_P2P_RATE_LIMIT_PATH',
+    os.path.join(tempfile.gettempdir(), 'binance_p2p_rate_limit'))
+BINANCE_P2P_RATE_LIMIT_RESERVE = float(
+    os.getenv('BINANCE_P2P_RATE_LIMIT_RESERVE', 0.5))
+BINANCE_P2P_RATE_LIMIT_WAIT = {
+    'interactive': 3,
+    'discovery': 5,
+    'background': 15,
+}
+
+# Fetch independent conversion legs in parallel, all upstream requests
+# of one conversion must finish within deadline (seconds).
+BINANCE_P2P_CONCURRENT_FETCH = os.getenv(
+    'BINANCE_P2P_CONCURRENT_FETCH', 'False') == 'True'
+BINANCE_P2P_FETCH_DEADLINE = float(
+    os.getenv('BINANCE_P2P_FETCH_DEADLINE', 10))
+BINANCE_P2P_FETCH_WORKERS = int(os.getenv('BINANCE_P2P_FETCH_WORKERS', 8))
+# Offers of conversion are fetched page by page, up to max pages with
+# some pages requested concurrently in own thread pool, until they cover
+# amount or price leaves tolerance band (share of best price).
+BINANCE_P2P_MAX_PAGES = int(os.getenv('BINANCE_P2P_MAX_PAGES', 5))
+BINANCE_P2P_PAGE_CONCURRENCY = int(
+    os.getenv('BINANCE_P2P_PAGE_CONCURRENCY', 2))
+BINANCE_P2P_PAGE_WORKERS = int(os.getenv('BINANCE_P2P_PAGE_WORKERS', 8))
+BINANCE_P2P_PRICE_TOLERANCE = float(
+    os.getenv('BINANCE_P2P_PRICE_TOLERANCE', 0.05))
+
+# Cached Binance P2P responses, TTL in seconds. Amounts in cache key are
+# rounded down to given number of significant digits (None to disable).
+BINANCE_P2P_CACHE_ALIAS = 'binance_p2p'
+BINANCE_P2P_CACHE_TTL = int(os.getenv('BINANCE_P2P_CACHE_TTL', 30))
+# Expired responses are served for this many seconds more, while
+# refreshed in background.
+BINANCE_P2P_CACHE_STALE_TTL = int(
+    os.getenv('BINANCE_P2P_CACHE_STALE_TTL', 60))
+# Amounts are requested rounded down to this many significant digits,
+# so nearby amounts share cached response.
+BINANCE_P2P_CACHE_AMOUNT_PRECISION = 2
+# Best prices of parsed and background refreshed order books are kept
+# in quote cache for TTL (seconds), approximate price of second currency
+# of conversion is requested only if there is no fresh one.
+BINANCE_P2P_REFERENCE_PRICE_TTL = int(
+    os.getenv('BINANCE_P2P_REFERENCE_PRICE_TTL', 60))
+
+# Select offers of conversion from amount index of every (fiat, payment
+# method, trade type), built from one deep fetch without amount, so new
+# amounts need no requests. Index is rebuilt after TTL (seconds).
+BINANCE_P2P_AMOUNT_INDEX = os.getenv(
+    'BINANCE_P2P_AMOUNT_INDEX', 'False') == 'True'
+BINANCE_P2P_AMOUNT_INDEX_PAGES = int(
+    os.getenv('BINANCE_P2P_AMOUNT_INDEX_PAGES', 10))
+BINANCE_P2P_AMOUNT_INDEX_TTL = int(
+    os.getenv('BINANCE_P2P_AMOUNT_INDEX_TTL', BINANCE_P2P_CACHE_TTL))
+
+# Serve conversion and payment methods with async views, use it when
+# project is served through ASGI application.
+CONVERTER_ASYNC_VIEWS = os.getenv('CONVERTER_ASYNC_VIEWS', 'False') == 'True'
+
+# Currencies are kept in memory of every worker, reloaded after TTL
+# (seconds) to pick up changes made in other processes.
+BINANCE_P2P_CURRENCY_REGISTRY_TTL = int(
+    os.getenv('BINANCE_P2P_CURRENCY_REGISTRY_TTL', 300))
+BINANCE_P2P_BACKGROUND_WORKERS = int(
+    os.getenv('BINANCE_P2P_BACKGROUND_WORKERS', 2))
+
+# Stored payment methods younger than TTL (seconds) are served without
+# request to binance, stale ones are served and refreshed in background.
+PAYMENT_METHODS_TTL = int(os.getenv('PAYMENT_METHODS_TTL', 60 * 60 * 24))
+
+# Cross rates of all currencies with payment methods are rebuilt from
+# best prices after interval (seconds), on request or by warm_cache
+# --cross-rates, and served until max age.
+BINANCE_P2P_CROSS_RATES_INTERVAL = int(
+    os.getenv('BINANCE_P2P_CROSS_RATES_INTERVAL', 60))
+BINANCE_P2P_CROSS_RATES_MAX_AGE = int(
+    os.getenv('BINANCE_P2P_CROSS_RATES_MAX_AGE', 10 * 60))
+
+# P2P assets conversion can go through, selected in converter form,
+# conversions through all of them are compared in best of mode, in own
+# thread pool.
+BINANCE_P2P_ASSETS = os.getenv(
+    'BINANCE_P2P_ASSETS', 'USDT BTC BUSD FDUSD ETH').split()
+BINANCE_P2P_ASSET_WORKERS = int(
+    os.getenv('BINANCE_P2P_ASSET_WORKERS', len(BINANCE_P2P_ASSETS)))
+
+# Best routes of conversion go through these P2P assets and, if set,
+# intermediate fiat currencies, with at most max hops trades.
+BINANCE_P2P_ROUTE_ASSETS = os.getenv(
+    'BINANCE_P2P_ROUTE_ASSETS', ' '.join(BINANCE_P2P_ASSETS)).split()
+BINANCE_P2P_ROUTE_VIA = os.getenv('BINANCE_P2P_ROUTE_VIA', '').split()
+BINANCE_P2P_ROUTE_MAX_HOPS = int(os.getenv('BINANCE_P2P_ROUTE_MAX_HOPS', 4))
+
+# Order books refreshed by warm_cache command, in format
+# FIAT[:METHOD[:TRADE_TYPE[:merchant[:AMOUNT,...]]]].
+# Warm cache requires cache backend shared between processes.
+BINANCE_P2P_WARM_TARGETS = os.getenv('BINANCE_P2P_WARM_TARGETS', '').split()
+BINANCE_P2P_WARM_INTERVAL = float(
+    os.getenv('BINANCE_P2P_WARM_INTERVAL', 20))
+BINANCE_P2P_WARM_WORKERS = int(os.getenv('BINANCE_P2P_WARM_WORKERS', 4))
+BINANCE_P2P_WARM_RATE = float(os.getenv('BINANCE_P2P_WARM_RATE', 2))
+BINANCE_P2P_WARM_POPULAR = int(os.getenv('BINANCE_P2P_WARM_POPULAR', 0))
+
+# Popular pairs and order books, tracked with time-decayed counts
+# (half life in seconds). Every worker publishes its top keys to quote
+# cache, so warm_cache and operators see popularity of all workers.
+POPULARITY_CAPACITY = 100
+POPULARITY_HALF_LIFE = float(os.getenv('POPULARITY_HALF_LIFE', 60 * 60))
+POPULARITY_PUBLISH_INTERVAL = 10
+POPULARITY_SNAPSHOT_TIMEOUT = 60 * 60
+
+# Last successful responses are kept in SQLite file and served, when
+# binance is unavailable, if they are not older than max age (seconds).
+# Older responses and responses above max rows are pruned.
+BINANCE_P2P_LKG_PATH = os.getenv(
+    'BINANCE_P2P_LKG_PATH', BASE_DIR / 'quotes.sqlite3')
+BINANCE_P2P_LKG_MAX_AGE = int(os.getenv('BINANCE_P2P_LKG_MAX_AGE', 60 * 60))
+BINANCE_P2P_LKG_MAX_ROWS = int(os.getenv('BINANCE_P2P_LKG_MAX_ROWS', 10000))
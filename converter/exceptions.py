@@ -14,3 +14,15 @@ class ApiUnavailableError(Exception):
     """Api unavailable."""
 
     pass
+
+
+class CircuitOpenError(ApiUnavailableError):
+    """Api requests are rejected by open circuit breaker."""
+
+    pass
+
+
+class RateLimitedError(ApiUnavailableError):
+    """Request was not allowed by rate limit within its deadline."""
+
+    pass
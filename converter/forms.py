@@ -1,22 +1,50 @@
 """Currency converter forms."""
 import logging
+from typing import List, Tuple
 
 from django import forms
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from dynamic_forms import DynamicField, DynamicFormMixin
 
-from .models import Currency, PaymentMethod
+from .models import DEFAULT_ASSET, Currency, PaymentMethod
+from .utils.currency_registry import currency_registry
 
 logger = logging.getLogger(__name__)
 
+# Asset choice comparing conversions through all assets.
+BEST_ASSET = 'BEST'
+
+
+def get_asset_choices() -> List[Tuple[str, str]]:
+    """Get assets conversion can go through, and best of them choice."""
+    return [*((asset, asset) for asset in settings.BINANCE_P2P_ASSETS),
+            (BEST_ASSET, 'Best of all')]
+
+
+class CurrencyChoiceField(forms.ModelChoiceField):
+    """Currency choice field, resolving selected currency from registry."""
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return currency_registry.get_by_pk(value)
+        except Currency.DoesNotExist:
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+
 
 class ConverterForm(DynamicFormMixin, forms.Form):
     """Currency converter form."""
 
-    from_currency = forms.ModelChoiceField(
+    from_currency = CurrencyChoiceField(
         queryset=Currency.objects.all()
     )
-    to_currency = forms.ModelChoiceField(
+    to_currency = CurrencyChoiceField(
         queryset=Currency.objects.all()
     )
     from_payment_methods = DynamicField(
@@ -37,6 +65,11 @@ class ConverterForm(DynamicFormMixin, forms.Form):
     to_amount = forms.FloatField(required=False)
 
     is_merchant = forms.BooleanField(required=False, initial=True)
+    asset = forms.ChoiceField(
+        required=False, choices=get_asset_choices, initial=DEFAULT_ASSET)
+
+    def clean_asset(self):
+        return self.cleaned_data.get('asset') or DEFAULT_ASSET
 
     def clean(self):
         cleaned_data = super().clean()
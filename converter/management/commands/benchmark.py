@@ -0,0 +1,306 @@
+import datetime
+import gc
+import json
+import logging
+import platform
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from converter.models import Currency, PaymentMethod, TradeType
+from converter.utils import amount_index
+from converter.utils.currency_registry import currency_registry
+from converter.utils.json_parser import (get_offers_from_json,
+                                         get_payment_methods_from_json)
+from converter.utils.offers_utils import get_best_offers_lists
+from converter.utils.quote_cache import get_cache
+from converter.utils.synthetic_book import (generate_offers,
+                                            make_search_response)
+
+logger = logging.getLogger(__name__)
+
+FROM_FIAT_CODE = 'XBA'
+TO_FIAT_CODE = 'XBB'
+PAYMENT_METHOD = 'TinkoffNew'
+FROM_AMOUNT = 2000
+BENCHMARKS = (
+    'get_offers_from_json',
+    'get_payment_methods_from_json',
+    'get_best_offers_lists',
+    'get_offers_view',
+)
+DEFAULT_ROWS = (10, 100, 1000, 10000)
+# Quotes cache is replaced by private one, cleared before every run.
+BENCHMARK_CACHE_ALIAS = 'benchmark'
+
+
+class BenchmarkResult(NamedTuple):
+    """Measurements of benchmark over book of given number of rows.
+
+    Allocated blocks and bytes are still held after one run, result
+    included, peak memory is highest traced memory during run.
+    """
+
+    benchmark: str
+    rows: int
+    iterations: int
+    seconds_per_op: float
+    ops_per_second: float
+    rows_per_second: float
+    peak_memory: int
+    allocated_blocks: int
+    allocated_bytes: int
+
+
+def measure(benchmark: str, rows: int, function: Callable,
+            min_time: float, setup: Callable = None) -> BenchmarkResult:
+    """Run function until min_time passes, then trace one more run.
+
+    Setup is called before every run and not measured.
+    """
+    setup = setup or (lambda: None)
+    setup()
+    function()
+    iterations = 0
+    elapsed = 0.0
+    while True:
+        setup()
+        started_at = time.perf_counter()
+        function()
+        elapsed += time.perf_counter() - started_at
+        iterations += 1
+        if elapsed >= min_time:
+            break
+
+    setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    differences = [
+        statistic for statistic in after.compare_to(before, 'filename')
+        if statistic.size_diff > 0]
+
+    seconds_per_op = elapsed / iterations
+    return BenchmarkResult(
+        benchmark=benchmark,
+        rows=rows,
+        iterations=iterations,
+        seconds_per_op=seconds_per_op,
+        ops_per_second=1 / seconds_per_op,
+        rows_per_second=rows / seconds_per_op,
+        peak_memory=peak - baseline,
+        allocated_blocks=sum(
+            statistic.count_diff for statistic in differences),
+        allocated_bytes=sum(
+            statistic.size_diff for statistic in differences),
+    )
+
+
+def get_response_text(fiat_code: str, trade_type: str, rows: int,
+                      page_rows: int = None, page: int = 1) -> str:
+    """Get search response text with synthetic book of rows offers.
+
+    With page_rows response has only offers of that page.
+    """
+    offers = generate_offers(fiat_code, trade_type, rows)
+    if page_rows is None:
+        return json.dumps(make_search_response(list(offers)))
+    return json.dumps(make_search_response(
+        list(offers[(page - 1) * page_rows:page * page_rows]),
+        total=len(offers)))
+
+
+def reset_quote_state() -> None:
+    """Forget cached responses, reference prices and amount indexes."""
+    get_cache().clear()
+    amount_index.reset_indexes()
+
+
+def get_regressions(results: List[BenchmarkResult], baseline: dict,
+                    threshold: float) -> List[str]:
+    """Compare results with baseline run, describe regressions."""
+    baseline_results = {
+        (result['benchmark'], result['rows']): result
+        for result in baseline['results']}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get(
+            (result.benchmark, result.rows))
+        if baseline_result is None:
+            continue
+        for metric in ('seconds_per_op', 'peak_memory'):
+            value = getattr(result, metric)
+            baseline_value = baseline_result[metric]
+            if baseline_value and value > baseline_value * (1 + threshold):
+                regressions.append(
+                    f'{result.benchmark} ({result.rows} rows): {metric} '
+                    f'{value:.6g} > {baseline_value:.6g} '
+                    f'(+{value / baseline_value - 1:.0%})')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Benchmark parsing, offer selection and conversion view '
+            'over synthetic order books without requests to binance')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--benchmark', action='append', dest='benchmarks',
+            choices=BENCHMARKS, default=None,
+            help='Benchmark to run, all by default.')
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+            help='Sizes of order books.')
+        parser.add_argument(
+            '--min-time', type=float, default=0.5,
+            help='Seconds to repeat every benchmark for.')
+        parser.add_argument(
+            '--output', help='Save results to JSON file.')
+        parser.add_argument(
+            '--baseline',
+            help='Compare results with JSON file of previous run.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help=('Allowed slowdown or memory growth over baseline, '
+                  'as fraction.'))
+        parser.add_argument(
+            '--log-level', default='WARNING',
+            choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+            help='Lowest level of log messages during benchmarks.')
+
+    def handle(self, *args, **options):
+        benchmarks = options['benchmarks'] or BENCHMARKS
+        results = []
+        logging.disable(logging.getLevelName(options['log_level']) - 1)
+        try:
+            with transaction.atomic(), override_settings(
+                    CACHES={**settings.CACHES, BENCHMARK_CACHE_ALIAS: {
+                        'BACKEND':
+                        'django.core.cache.backends.locmem.LocMemCache',
+                        'LOCATION': BENCHMARK_CACHE_ALIAS,
+                    }},
+                    BINANCE_P2P_CACHE_ALIAS=BENCHMARK_CACHE_ALIAS):
+                self.setup_data()
+                for rows in options['rows']:
+                    functions = self.get_functions(rows)
+                    for benchmark in benchmarks:
+                        result = measure(benchmark, rows,
+                                         functions[benchmark],
+                                         options['min_time'],
+                                         setup=reset_quote_state)
+                        self.report(result)
+                        results.append(result)
+                transaction.set_rollback(True)
+        finally:
+            logging.disable(logging.NOTSET)
+            currency_registry.invalidate()
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'created_at': datetime.datetime.now(
+                        datetime.timezone.utc).isoformat(),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'results': [result._asdict() for result in results],
+                }, file, indent=2)
+            self.stdout.write(f'Results saved to {options["output"]}')
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            regressions = get_regressions(
+                results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError(
+                    'Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write('No regressions against baseline.')
+
+    def setup_data(self) -> None:
+        """Create currencies and payment methods, rolled back after run."""
+        self.from_currency = Currency.objects.create(
+            code=FROM_FIAT_CODE, name='Benchmark From')
+        self.to_currency = Currency.objects.create(
+            code=TO_FIAT_CODE, name='Benchmark To')
+        self.from_payment_method = PaymentMethod.objects.create(
+            short_name=PAYMENT_METHOD, currency=self.from_currency)
+        self.to_payment_method = PaymentMethod.objects.create(
+            short_name=PAYMENT_METHOD, currency=self.to_currency)
+        currency_registry.invalidate()
+        self.client = Client(SERVER_NAME='localhost')
+
+    def get_functions(self, rows: int) -> Dict[str, Callable]:
+        """Get benchmarked functions over books of rows offers.
+
+        Binance requests are replaced by responses with requested page
+        of book, prepared once.
+        """
+        book_rows = rows
+        responses: Dict[tuple, str] = {}
+
+        def get_p2p_offers_data(fiat_code, trade_type, rows, page=1,
+                                **kwargs):
+            key = (fiat_code, trade_type, rows, page)
+            if key not in responses:
+                responses[key] = get_response_text(
+                    fiat_code, trade_type, book_rows, rows, page)
+            return responses[key]
+
+        offers_text = get_response_text(FROM_FIAT_CODE, TradeType.BUY, rows)
+
+        def best_offers_lists():
+            with patch('converter.utils.offers_utils.get_p2p_offers_data',
+                       get_p2p_offers_data):
+                return get_best_offers_lists(
+                    self.from_currency, self.to_currency,
+                    self.from_payment_method, self.to_payment_method,
+                    False, FROM_AMOUNT, False, concurrent=False)
+
+        def offers_view():
+            with patch('converter.utils.offers_utils.get_p2p_offers_data',
+                       get_p2p_offers_data):
+                response = self.client.post(
+                    reverse('converter:get_offers'), {
+                        'from_currency': self.from_currency.pk,
+                        'to_currency': self.to_currency.pk,
+                        'from_payment_methods': self.from_payment_method.pk,
+                        'to_payment_methods': self.to_payment_method.pk,
+                        'from_amount': FROM_AMOUNT,
+                    })
+            if response.status_code != 200:
+                raise CommandError(
+                    f'conversion failed with {response.status_code}')
+            return response
+
+        return {
+            'get_offers_from_json': lambda: get_offers_from_json(
+                offers_text, TradeType.BUY),
+            'get_payment_methods_from_json': lambda: (
+                get_payment_methods_from_json(offers_text)),
+            'get_best_offers_lists': best_offers_lists,
+            'get_offers_view': offers_view,
+        }
+
+    def report(self, result: BenchmarkResult) -> None:
+        self.stdout.write(
+            f'{result.benchmark:<30} {result.rows:>6} rows '
+            f'{result.ops_per_second:>10.1f} ops/s '
+            f'{result.rows_per_second:>12.0f} rows/s '
+            f'peak {result.peak_memory / 1024:>9.1f} KiB '
+            f'{result.allocated_blocks:>7} blocks')
@@ -0,0 +1,55 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from converter.utils.stub_server import StubOptions, StubServer
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Serve synthetic order books on Binance P2P search path. '
+            'Point BINANCE_P2P_BASE_URL to it to work offline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--depth', type=int, default=StubOptions.depth,
+            help='Offers in every generated book.')
+        parser.add_argument(
+            '--latency', type=float, default=StubOptions.latency,
+            help='Delay of every response, in seconds.')
+        parser.add_argument(
+            '--jitter', type=float, default=StubOptions.jitter,
+            help='Random extra delay up to given seconds.')
+        parser.add_argument(
+            '--error-rate', type=float, default=StubOptions.error_rate,
+            help='Share of requests failed with error status.')
+        parser.add_argument(
+            '--error-status', type=int, default=StubOptions.error_status)
+        parser.add_argument(
+            '--seed', type=int, default=StubOptions.seed,
+            help='Seed of generated books and injected errors.')
+
+    def handle(self, *args, **options):
+        server = StubServer(
+            (options['host'], options['port']),
+            StubOptions(
+                depth=options['depth'],
+                latency=options['latency'],
+                jitter=options['jitter'],
+                error_rate=options['error_rate'],
+                error_status=options['error_status'],
+                seed=options['seed'],
+            ))
+        self.stdout.write(
+            f'Binance P2P stub listening on {server.url}, '
+            f'set BINANCE_P2P_BASE_URL={server.url} to use it.')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            logger.info(f'served {server.get_stats()}')
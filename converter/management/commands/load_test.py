@@ -0,0 +1,300 @@
+import json
+import logging
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import permutations
+from typing import Dict, List, NamedTuple
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from converter.models import Currency, PaymentMethod
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 95, 99)
+FAILED_CONVERSION_MARKER = 'alert-danger'
+PAYMENT_METHOD_OPTION_MARKER = 'value="'
+
+
+class LoadRequest(NamedTuple):
+    """User request, sent offset seconds after start of test."""
+
+    kind: str
+    offset: float
+    params: dict
+
+
+class RequestResult(NamedTuple):
+    """Outcome of user request.
+
+    Latency is counted from scheduled time, so it includes time request
+    waited for free worker. Status is None if request was not answered,
+    failed request was answered with error message to user.
+    """
+
+    kind: str
+    latency: float
+    status: int
+    is_failed: bool
+
+    @property
+    def is_error(self) -> bool:
+        return self.status is None or self.status >= 400
+
+
+def get_percentile(sorted_values: List[float], percentile: float) -> float:
+    """Get nearest-rank percentile of sorted values."""
+    if not sorted_values:
+        return None
+    rank = math.ceil(percentile / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def get_pair_weights(n: int) -> List[float]:
+    """Get Zipf weights, few pairs get most of requests like in prod."""
+    return [1 / rank for rank in range(1, n + 1)]
+
+
+class Command(BaseCommand):
+    help = ('Send open-loop load of conversion and payment methods '
+            'requests to running server, backed by binance stub')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://127.0.0.1:8000',
+            help='Url of tested server.')
+        parser.add_argument(
+            '--stub-url',
+            help=('Url of binance_stub used by server, to count '
+                  'upstream calls.'))
+        parser.add_argument(
+            '--pair', action='append', dest='pairs', default=None,
+            help=('Currency pair FROM:TO, all pairs of currencies with '
+                  'payment methods by default.'))
+        parser.add_argument(
+            '--rate', type=float, default=10,
+            help='Mean arrival rate of user requests per second.')
+        parser.add_argument(
+            '--duration', type=float, default=60,
+            help='Seconds to send requests for.')
+        parser.add_argument(
+            '--concurrency', type=int, default=16,
+            help='Max number of requests in flight.')
+        parser.add_argument(
+            '--payment-methods-share', type=float, default=0.3,
+            help='Share of HTMX payment methods requests.')
+        parser.add_argument('--min-amount', type=float, default=100)
+        parser.add_argument('--max-amount', type=float, default=100000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--timeout', type=float, default=30,
+            help='Timeout of every request, in seconds.')
+        parser.add_argument('--output', help='Save report to JSON file.')
+
+    def handle(self, *args, **options):
+        self.base_url = options['url'].rstrip('/')
+        self.timeout = options['timeout']
+        self._local = threading.local()
+        currencies = self.get_currencies(options['pairs'])
+        self.discover_payment_methods(currencies)
+        payment_methods = {
+            currency.pk: list(PaymentMethod.objects.filter(
+                currency=currency).values_list('pk', flat=True))
+            for currency in currencies}
+        pairs = [
+            (from_currency, to_currency)
+            for from_currency, to_currency in (
+                self.parse_pairs(options['pairs'])
+                if options['pairs'] else permutations(currencies, 2))
+            if payment_methods[from_currency.pk]
+            and payment_methods[to_currency.pk]]
+        if not pairs:
+            raise CommandError('No currency pairs with payment methods.')
+
+        load = self.get_load(pairs, payment_methods, options)
+        stub_url = options['stub_url'] and options['stub_url'].rstrip('/')
+        if stub_url:
+            requests.delete(f'{stub_url}/stats', timeout=self.timeout)
+        self.stdout.write(
+            f'Sending {len(load)} requests over {options["duration"]}s '
+            f'to {self.base_url}')
+        started_at = time.monotonic()
+        with ThreadPoolExecutor(
+                max_workers=options['concurrency']) as executor:
+            futures = []
+            for request in load:
+                time.sleep(max(
+                    started_at + request.offset - time.monotonic(), 0))
+                futures.append(executor.submit(
+                    self.send, request, started_at + request.offset))
+            results = [future.result() for future in futures]
+        elapsed = time.monotonic() - started_at
+        upstream_calls = None
+        if stub_url:
+            upstream_calls = requests.get(
+                f'{stub_url}/stats', timeout=self.timeout).json().get(
+                    'requests', 0)
+
+        report = self.get_report(results, elapsed, upstream_calls)
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f'Report saved to {options["output"]}')
+
+    def parse_pairs(self, pairs: List[str]) -> List[tuple]:
+        parsed = []
+        for pair in pairs:
+            try:
+                from_code, to_code = pair.upper().split(':')
+                parsed.append((Currency.objects.get(code=from_code),
+                               Currency.objects.get(code=to_code)))
+            except (ValueError, Currency.DoesNotExist):
+                raise CommandError(f'Invalid currency pair: {pair}')
+        return parsed
+
+    def get_currencies(self, pairs: List[str]) -> List[Currency]:
+        """Get tested currencies."""
+        if pairs:
+            return list({
+                currency.pk: currency
+                for pair in self.parse_pairs(pairs)
+                for currency in pair}.values())
+        return list(Currency.objects.filter(
+            payment_methods__isnull=False).distinct())
+
+    def get_session(self) -> requests.Session:
+        """Get session of worker thread with CSRF cookie."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.get(f'{self.base_url}{reverse("converter:index")}',
+                        timeout=self.timeout)
+            self._local.session = session
+        return session
+
+    def discover_payment_methods(self, currencies: List[Currency]) -> None:
+        """Make server request and store payment methods of currencies."""
+        for currency in currencies:
+            self.get_session().get(
+                f'{self.base_url}{reverse("converter:payment_methods")}',
+                params={'from_currency': currency.pk},
+                headers={'HX-Request': 'true'},
+                timeout=self.timeout)
+
+    def get_load(self, pairs: List[tuple], payment_methods: Dict[int, list],
+                 options: dict) -> List[LoadRequest]:
+        """Get requests with Poisson arrivals and skewed pairs."""
+        rng = random.Random(options['seed'])
+        weights = get_pair_weights(len(pairs))
+        log_min_amount = math.log(options['min_amount'])
+        log_max_amount = math.log(options['max_amount'])
+        load = []
+        offset = rng.expovariate(options['rate'])
+        while offset < options['duration']:
+            from_currency, to_currency = rng.choices(pairs, weights)[0]
+            if rng.random() < options['payment_methods_share']:
+                field, currency = rng.choice((
+                    ('from_currency', from_currency),
+                    ('to_currency', to_currency)))
+                load.append(LoadRequest(
+                    'payment_methods', offset, {field: currency.pk}))
+            else:
+                load.append(LoadRequest('get_offers', offset, {
+                    'from_currency': from_currency.pk,
+                    'to_currency': to_currency.pk,
+                    'from_payment_methods': rng.choice(
+                        payment_methods[from_currency.pk]),
+                    'to_payment_methods': rng.choice(
+                        payment_methods[to_currency.pk]),
+                    'from_amount': round(math.exp(rng.uniform(
+                        log_min_amount, log_max_amount)), 2),
+                    'is_merchant': rng.choice(('on', '')),
+                }))
+            offset += rng.expovariate(options['rate'])
+        return load
+
+    def send(self, request: LoadRequest,
+             scheduled_at: float) -> RequestResult:
+        """Send request, check that it was successful."""
+        url = f'{self.base_url}{reverse(f"converter:{request.kind}")}'
+        try:
+            session = self.get_session()
+            if request.kind == 'payment_methods':
+                response = session.get(
+                    url, params=request.params,
+                    headers={'HX-Request': 'true'}, timeout=self.timeout)
+                is_failed = PAYMENT_METHOD_OPTION_MARKER not in response.text
+            else:
+                response = session.post(
+                    url,
+                    data={**request.params, 'csrfmiddlewaretoken':
+                          session.cookies.get('csrftoken')},
+                    headers={'Referer': url}, timeout=self.timeout)
+                is_failed = FAILED_CONVERSION_MARKER in response.text
+        except requests.RequestException as e:
+            logger.debug(f'{request.kind} request failed: {e}')
+            return RequestResult(
+                request.kind, time.monotonic() - scheduled_at, None, True)
+        return RequestResult(
+            request.kind, time.monotonic() - scheduled_at,
+            response.status_code, is_failed)
+
+    def get_report(self, results: List[RequestResult], elapsed: float,
+                   upstream_calls: int = None) -> dict:
+        report = {
+            'requests': len(results),
+            'elapsed': elapsed,
+            'throughput': len(results) / elapsed if elapsed else 0,
+            'upstream_calls': upstream_calls,
+            'upstream_calls_per_request': (
+                upstream_calls / len(results)
+                if upstream_calls is not None and results else None),
+            'endpoints': {},
+        }
+        for kind in sorted({result.kind for result in results}):
+            kind_results = [
+                result for result in results if result.kind == kind]
+            latencies = sorted(result.latency for result in kind_results)
+            errors = sum(result.is_error for result in kind_results)
+            failed = sum(result.is_failed for result in kind_results)
+            report['endpoints'][kind] = {
+                'requests': len(kind_results),
+                'errors': errors,
+                'error_rate': errors / len(kind_results),
+                'failed': failed,
+                'failure_rate': failed / len(kind_results),
+                'statuses': {
+                    str(status): sum(
+                        result.status == status for result in kind_results)
+                    for status in {result.status for result in kind_results}},
+                'latency': {
+                    **{f'p{percentile}': get_percentile(
+                        latencies, percentile)
+                       for percentile in PERCENTILES},
+                    'max': latencies[-1],
+                },
+            }
+        return report
+
+    def print_report(self, report: dict) -> None:
+        self.stdout.write(
+            f'{report["requests"]} requests in {report["elapsed"]:.1f}s, '
+            f'{report["throughput"]:.1f} req/s')
+        for kind, stats in report['endpoints'].items():
+            latency = ' '.join(
+                f'{name} {value * 1000:.0f}ms'
+                for name, value in stats['latency'].items())
+            self.stdout.write(
+                f'{kind:<16} {stats["requests"]:>6} requests '
+                f'{stats["error_rate"]:>6.1%} errors '
+                f'{stats["failure_rate"]:>6.1%} failed  {latency}')
+        if report['upstream_calls'] is not None:
+            self.stdout.write(
+                f'upstream calls: {report["upstream_calls"]}, '
+                f'{report["upstream_calls_per_request"]:.2f} per request')
@@ -0,0 +1,184 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, NamedTuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from converter.exceptions import ApiUnavailableError
+from converter.models import TradeType
+from converter.utils.binance_api import get_p2p_offers_data
+from converter.utils.cross_rates import build_cross_rates
+from converter.utils.offers_utils import get_book_request
+from converter.utils.popularity import amount_popularity, book_popularity
+from converter.utils.quote_cache import get_cache, quantize_amount
+from converter.utils.rate_limiter import Priority, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class WarmTarget(NamedTuple):
+    """Order book to keep warm in quote cache.
+
+    Amount None is price request of conversion, other amounts are full
+    requests of their amount buckets.
+    """
+
+    fiat_code: str
+    payment_method: str = None
+    trade_type: str = TradeType.BUY
+    is_merchant: bool = False
+    amounts: tuple = (None,)
+
+
+def parse_target(value: str) -> WarmTarget:
+    """Parse 'FIAT[:METHOD[:TRADE_TYPE[:merchant[:AMOUNT,...]]]]'."""
+    parts = value.split(':')
+    if not parts[0] or len(parts) > 5:
+        raise CommandError(f'Invalid warm target: {value}')
+    parts += [''] * (5 - len(parts))
+    fiat_code, payment_method, trade_type, publisher, amounts = parts
+    trade_type = trade_type.upper() or TradeType.BUY
+    if trade_type not in (TradeType.BUY, TradeType.SELL):
+        raise CommandError(f'Invalid trade type in warm target: {value}')
+    try:
+        amounts = tuple(
+            float(amount) for amount in amounts.split(',') if amount)
+    except ValueError:
+        raise CommandError(f'Invalid amount in warm target: {value}')
+    return WarmTarget(
+        fiat_code=fiat_code.upper(),
+        payment_method=payment_method or None,
+        trade_type=trade_type,
+        is_merchant=publisher == 'merchant',
+        amounts=amounts or (None,),
+    )
+
+
+def get_popular_targets(n: int, exclude: List[WarmTarget] = ()
+                        ) -> List[WarmTarget]:
+    """Get n most popular order books of all web workers.
+
+    Price request of every book is warmed, with its popular amount
+    buckets.
+    """
+    if not n:
+        return []
+    excluded = {target[:4] for target in exclude}
+    amounts: Dict[tuple, list] = {}
+    for key, _ in amount_popularity.get_shared_top(n):
+        amounts.setdefault(key[:4], []).append(key[4])
+    targets = [
+        WarmTarget(*book, amounts=(None, *amounts.get(book, ())))
+        for book, _ in book_popularity.get_shared_top(n)]
+    return [target for target in targets if target[:4] not in excluded]
+
+
+class Command(BaseCommand):
+    help = 'Periodically refresh order books in quote cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', action='append', dest='targets', default=None,
+            help=('Order book to warm, '
+                  'FIAT[:METHOD[:TRADE_TYPE[:merchant[:AMOUNT,...]]]]. '
+                  'Defaults to BINANCE_P2P_WARM_TARGETS.'))
+        parser.add_argument(
+            '--interval', type=float,
+            default=settings.BINANCE_P2P_WARM_INTERVAL,
+            help='Seconds between refreshes of every order book.')
+        parser.add_argument(
+            '--workers', type=int,
+            default=settings.BINANCE_P2P_WARM_WORKERS,
+            help='Max number of concurrent requests.')
+        parser.add_argument(
+            '--rate', type=float, default=settings.BINANCE_P2P_WARM_RATE,
+            help='Max number of requests per second.')
+        parser.add_argument(
+            '--jitter', type=float, default=0.5,
+            help='Random delay of request, as fraction of interval.')
+        parser.add_argument(
+            '--popular', type=int, default=settings.BINANCE_P2P_WARM_POPULAR,
+            help='Also warm this number of most popular order books.')
+        parser.add_argument(
+            '--cross-rates', action='store_true',
+            help='Also rebuild cross rates of all currencies every cycle.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Refresh every order book once and exit.')
+
+    def handle(self, *args, **options):
+        targets = [
+            parse_target(target) for target in
+            options['targets'] or settings.BINANCE_P2P_WARM_TARGETS]
+        if (not targets and not options['popular']
+                and not options['cross_rates']):
+            raise CommandError('No warm targets configured.')
+        if 'LocMemCache' in type(get_cache()).__name__:
+            logger.warning(
+                'quote cache is local to process, '
+                'warmed order books are not shared with web workers')
+        self.interval = options['interval']
+        self.jitter = options['jitter']
+        self.budget = TokenBucket(options['rate'])
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                started_at = time.monotonic()
+                try:
+                    self.warm(
+                        executor,
+                        targets + get_popular_targets(options['popular'],
+                                                      exclude=targets),
+                        options['once'])
+                except Exception:
+                    logger.exception('failed to warm order books')
+                if options['cross_rates']:
+                    try:
+                        build_cross_rates()
+                    except Exception:
+                        logger.exception('failed to build cross rates')
+                if options['once']:
+                    return
+                time.sleep(max(
+                    self.interval - (time.monotonic() - started_at), 0))
+
+    def warm(self, executor: ThreadPoolExecutor,
+             targets: List[WarmTarget], once: bool = False) -> None:
+        """Refresh all order books, spreading requests over interval."""
+        jitter = 0 if once else self.jitter * self.interval
+        futures = [
+            executor.submit(
+                self.refresh, target, amount, random.uniform(0, jitter))
+            for target in targets
+            for amount in dict.fromkeys(
+                quantize_amount(amount) for amount in target.amounts)]
+        wait(futures)
+        refreshed = sum(future.result() for future in futures)
+        logger.info(f'refreshed {refreshed} of {len(futures)} order books')
+
+    def refresh(self, target: WarmTarget, amount: float,
+                delay: float) -> bool:
+        """Refresh order book in quote cache.
+
+        Payload is same as in conversion requests, so they read it.
+        Errors are logged, so they don't stop warming of other books.
+        """
+        time.sleep(delay)
+        self.budget.acquire()
+        try:
+            get_p2p_offers_data(
+                **get_book_request(
+                    target.fiat_code, target.payment_method,
+                    target.trade_type, target.is_merchant, amount),
+                force_refresh=True,
+                priority=Priority.BACKGROUND,
+            )
+        except ApiUnavailableError as e:
+            logger.error(f'failed to refresh {target}: {e}')
+            return False
+        except Exception:
+            logger.exception(f'failed to refresh {target}')
+            return False
+        return True
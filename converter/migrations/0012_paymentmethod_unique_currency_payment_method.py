@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def delete_duplicate_payment_methods(apps, schema_editor):
+    """Keep first payment method for every currency and short name."""
+    PaymentMethod = apps.get_model('converter', 'PaymentMethod')
+    seen = set()
+    duplicates = []
+    for payment_method in PaymentMethod.objects.order_by('pk'):
+        key = (payment_method.currency_id, payment_method.short_name)
+        if key in seen:
+            duplicates.append(payment_method.pk)
+        seen.add(key)
+    PaymentMethod.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('converter', '0011_alter_currency_options_alter_paymentmethod_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_duplicate_payment_methods, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='paymentmethod',
+            constraint=models.UniqueConstraint(fields=('currency', 'short_name'), name='unique_currency_payment_method'),
+        ),
+    ]
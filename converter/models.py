@@ -49,6 +49,12 @@ class PaymentMethod(models.Model):
 
         verbose_name: str = 'Payment Method'
         verbose_name_plural: str = 'Payment Methods'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['currency', 'short_name'],
+                name='unique_currency_payment_method',
+            ),
+        ]
 
     def __str__(self) -> str:
         if self.display_name:
@@ -70,8 +76,12 @@ class Seller():
         return self.name
 
 
+# Crypto asset bought and sold for fiat currencies by default.
+DEFAULT_ASSET = 'USDT'
+
+
 class TradeType():
-    """Buy means buy USDT from seller."""
+    """Buy means buy asset (USDT by default) from seller."""
 
     BUY = 'BUY'
     SELL = 'SELL'
@@ -88,6 +98,8 @@ class Offer():
     min_amount: float
     tradable_funds: float
     offer_id: str
+    max_amount: float = None
+    asset: str = None
 
     def __str__(self) -> str:
         return f'{self.trade_type} {self.currency.code} {self.price}'
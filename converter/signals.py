@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Currency
+from .utils.currency_registry import currency_registry
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def invalidate_currency_registry(sender, **kwargs) -> None:
+    """Reload currencies registry after currency changed."""
+    currency_registry.invalidate()
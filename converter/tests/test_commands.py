@@ -0,0 +1,223 @@
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import LiveServerTestCase, TestCase, override_settings
+
+from ..management.commands.benchmark import BENCHMARKS
+from ..management.commands.warm_cache import (WarmTarget,
+                                              get_popular_targets,
+                                              parse_target)
+from ..models import Currency, PaymentMethod
+from ..utils import offers_utils
+from ..utils.binance_api import _get_search_data
+from ..utils.last_known_good import last_known_good
+from ..utils.offers_utils import get_requests_params
+from ..utils.popularity import (amount_popularity, book_popularity,
+                                currency_popularity, record_conversion,
+                                record_payment_methods_request)
+from ..utils.quote_cache import get_cache, make_cache_key
+from ..utils.stub_server import StubOptions, start_stub_server
+from ..models import TradeType
+
+
+class WarmCacheCommandTest(TestCase):
+    def test_parse_target(self):
+        """Warm target parsed from string."""
+        self.assertEqual(
+            parse_target('rub:TinkoffNew:sell:merchant:1000,5000'),
+            WarmTarget(
+                fiat_code='RUB',
+                payment_method='TinkoffNew',
+                trade_type=TradeType.SELL,
+                is_merchant=True,
+                amounts=(1000.0, 5000.0),
+            ))
+        self.assertEqual(parse_target('TRY'), WarmTarget(fiat_code='TRY'))
+        with self.assertRaises(CommandError):
+            parse_target('TRY::HOLD')
+
+    def test_warm_once(self):
+        """Every order book and amount refreshed bypassing cache."""
+        with patch('converter.management.commands.warm_cache'
+                   '.get_p2p_offers_data') as get_p2p_offers_data:
+            call_command(
+                'warm_cache', '--once', '--rate', '100',
+                '--target', 'RUB:TinkoffNew:BUY::1000,5000',
+                '--target', 'TRY')
+        self.assertEqual(get_p2p_offers_data.call_count, 3)
+        for call in get_p2p_offers_data.call_args_list:
+            self.assertTrue(call.kwargs['force_refresh'])
+
+    def test_warm_conversion_keys(self):
+        """Warmed payloads are the ones conversion requests read."""
+        filled_amount_request, price_request, _ = get_requests_params(
+            SimpleNamespace(code='RUB'), SimpleNamespace(code='TRY'),
+            SimpleNamespace(short_name='TinkoffNew'),
+            SimpleNamespace(short_name='Ziraat'), True, 2345, False)
+        with patch('converter.management.commands.warm_cache'
+                   '.get_p2p_offers_data') as get_p2p_offers_data:
+            call_command(
+                'warm_cache', '--once', '--rate', '100',
+                '--target', 'RUB:TinkoffNew:BUY:merchant:2345,2399',
+                '--target', 'TRY:Ziraat:SELL:merchant')
+        self.assertEqual(get_p2p_offers_data.call_count, 2)
+        warmed_keys = set()
+        for call in get_p2p_offers_data.call_args_list:
+            request = dict(call.kwargs)
+            del request['force_refresh'], request['priority']
+            warmed_keys.add(make_cache_key(_get_search_data(**request)))
+        self.assertEqual(warmed_keys, {
+            make_cache_key(_get_search_data(**filled_amount_request)),
+            make_cache_key(_get_search_data(**price_request))})
+
+    def test_popular_targets_amounts(self):
+        """Popular books warmed with price request and popular amounts."""
+        get_cache().clear()
+        record_conversion(
+            SimpleNamespace(code='RUB'), SimpleNamespace(code='TRY'),
+            SimpleNamespace(short_name='TinkoffNew'),
+            SimpleNamespace(short_name='Ziraat'), True, 2345, False)
+        book_popularity.publish()
+        amount_popularity.publish()
+        targets = {target[:4]: target.amounts
+                   for target in get_popular_targets(10)}
+        self.assertEqual(
+            targets[('RUB', 'TinkoffNew', TradeType.BUY, True)],
+            (None, 2300))
+        self.assertEqual(
+            targets[('TRY', 'Ziraat', TradeType.SELL, True)], (None,))
+
+    def test_popular_targets_skip_discovery(self):
+        """Payment methods requests are not warmed as popular books."""
+        get_cache().clear()
+        for _ in range(3):
+            record_payment_methods_request('KZT')
+        book_popularity.publish()
+        currency_popularity.publish()
+        self.assertNotIn(
+            'KZT', [target.fiat_code for target in get_popular_targets(10)])
+        self.assertIn(
+            'KZT',
+            [currency for currency, _ in currency_popularity.get_shared_top()])
+
+    def test_warm_cross_rates(self):
+        """Cross rates rebuilt without order book targets."""
+        with patch('converter.management.commands.warm_cache'
+                   '.build_cross_rates') as build_cross_rates:
+            call_command('warm_cache', '--once', '--cross-rates')
+        build_cross_rates.assert_called_once()
+
+    def test_warm_errors_logged(self):
+        """Failed order book or cross rates don't stop warming."""
+        with patch('converter.management.commands.warm_cache'
+                   '.get_p2p_offers_data',
+                   side_effect=[ValueError('bad json'), '{}']
+                   ) as get_p2p_offers_data, patch(
+                'converter.management.commands.warm_cache'
+                '.build_cross_rates', side_effect=RuntimeError('db error')
+                ) as build_cross_rates, self.assertLogs(
+                'converter.management.commands.warm_cache') as logs:
+            call_command(
+                'warm_cache', '--once', '--rate', '100', '--workers', '1',
+                '--cross-rates', '--target', 'RUB', '--target', 'TRY')
+        self.assertEqual(get_p2p_offers_data.call_count, 2)
+        build_cross_rates.assert_called_once()
+        self.assertIn('refreshed 1 of 2 order books', '\n'.join(logs.output))
+
+
+class BenchmarkCommandTest(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.output = os.path.join(temp_dir.name, 'results.json')
+
+    def test_benchmark_results_saved(self):
+        """Every benchmark measured and saved, benchmark data rolled back."""
+        call_command('benchmark', '--rows', '10', '--min-time', '0',
+                     '--output', self.output, stdout=open(os.devnull, 'w'))
+        with open(self.output) as file:
+            results = json.load(file)['results']
+        self.assertEqual(
+            [result['benchmark'] for result in results], list(BENCHMARKS))
+        for result in results:
+            self.assertEqual(result['rows'], 10)
+            self.assertGreater(result['ops_per_second'], 0)
+        self.assertFalse(Currency.objects.exists())
+
+    def test_benchmark_runs_cold(self):
+        """Every run requests probe price, quotes cache is kept."""
+        get_cache().set('kept', 1)
+        reference_prices = []
+
+        def get_request_reference_price(request):
+            reference_prices.append(original(request))
+            return reference_prices[-1]
+
+        original = offers_utils.get_request_reference_price
+        with patch('converter.utils.offers_utils.get_request_reference_price',
+                   get_request_reference_price):
+            call_command('benchmark', '--rows', '100', '--min-time', '0',
+                         '--benchmark', 'get_best_offers_lists',
+                         '--benchmark', 'get_offers_view',
+                         stdout=open(os.devnull, 'w'))
+        self.assertGreater(len(reference_prices), 2)
+        self.assertEqual(set(reference_prices), {None})
+        self.assertEqual(get_cache().get('kept'), 1)
+
+    def test_benchmark_regression(self):
+        """Run slower than baseline over threshold fails."""
+        call_command('benchmark', '--rows', '10', '--min-time', '0',
+                     '--benchmark', 'get_offers_from_json',
+                     '--output', self.output, stdout=open(os.devnull, 'w'))
+        with open(self.output) as file:
+            baseline = json.load(file)
+        baseline['results'][0]['seconds_per_op'] /= 100
+        with open(self.output, 'w') as file:
+            json.dump(baseline, file)
+        with self.assertRaisesMessage(CommandError, 'seconds_per_op'):
+            call_command('benchmark', '--rows', '10', '--min-time', '0',
+                         '--benchmark', 'get_offers_from_json',
+                         '--baseline', self.output,
+                         stdout=open(os.devnull, 'w'))
+
+
+class LoadTestCommandTest(LiveServerTestCase):
+    def setUp(self):
+        self.stub = start_stub_server(options=StubOptions(depth=500))
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        test_settings = override_settings(
+            BINANCE_P2P_BASE_URL=self.stub.url,
+            BINANCE_P2P_LKG_PATH=os.path.join(temp_dir.name, 'quotes.db'),
+            BINANCE_P2P_RATE_LIMIT=0)
+        test_settings.enable()
+        self.addCleanup(test_settings.disable)
+        self.addCleanup(last_known_good.flush)
+        Currency.objects.create(code='RUB', name='Russia Ruble')
+        Currency.objects.create(code='TRY', name='Turkish Lira')
+        self.output = os.path.join(temp_dir.name, 'report.json')
+
+    def test_load_test_report(self):
+        """Latencies, errors and upstream calls reported for endpoints."""
+        call_command(
+            'load_test', '--url', self.live_server_url,
+            '--stub-url', self.stub.url, '--pair', 'RUB:TRY',
+            '--rate', '50', '--duration', '0.5', '--concurrency', '4',
+            '--output', self.output, stdout=open(os.devnull, 'w'))
+        self.assertTrue(PaymentMethod.objects.exists())
+        with open(self.output) as file:
+            report = json.load(file)
+        self.assertGreater(report['requests'], 0)
+        self.assertGreater(report['upstream_calls'], 0)
+        for stats in report['endpoints'].values():
+            self.assertEqual(stats['errors'], 0)
+            self.assertLess(stats['failed'], stats['requests'])
+            self.assertLessEqual(
+                stats['latency']['p50'], stats['latency']['p99'])
@@ -1,8 +1,8 @@
 from django.core.exceptions import ValidationError
 from django.test import Client, TestCase
 
-from ..forms import ConverterForm
-from ..models import Currency, PaymentMethod
+from ..forms import BEST_ASSET, ConverterForm
+from ..models import DEFAULT_ASSET, Currency, PaymentMethod
 
 
 class ConverterFormTest(TestCase):
@@ -119,3 +119,24 @@ class ConverterFormTest(TestCase):
         form = ConverterForm(negative_amount_filled_data)
         self.assertFalse(form.is_valid())
         self.assertRaises(ValidationError, form.clean)
+
+    def test_asset_choice(self):
+        """USDT is asset by default, unknown asset is not valid."""
+        data = {
+            'from_currency': self.currency_rub.pk,
+            'to_currency': self.currency_try.pk,
+            'from_payment_methods': self.payment_method_rub.pk,
+            'to_payment_methods': self.payment_method_try.pk,
+            'from_amount': self.from_amount,
+            'is_merchant': self.is_merchant,
+        }
+        form = ConverterForm(data)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data.get('asset'), DEFAULT_ASSET)
+
+        form = ConverterForm({**data, 'asset': BEST_ASSET})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data.get('asset'), BEST_ASSET)
+
+        form = ConverterForm({**data, 'asset': 'DOGE'})
+        self.assertFalse(form.is_valid())
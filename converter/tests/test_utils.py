@@ -1,13 +1,51 @@
-from unittest.mock import patch
+import asyncio
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from http import HTTPStatus
+from unittest.mock import MagicMock, patch
 
-from django.test import TestCase
+import requests
+from django.conf import settings
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
 
-from ..exceptions import BinanceApiError, OffersNotFoundError
+from ..exceptions import (ApiUnavailableError, BinanceApiError,
+                          CircuitOpenError, OffersNotFoundError,
+                          RateLimitedError)
 from ..models import Currency, Offer, PaymentMethod, Seller, TradeType
-from ..utils.json_parser import (get_offers_from_json,
-                                 get_payment_methods_from_json)
-from ..utils.offers_utils import (get_amount, get_best_offers_lists,
-                                  get_best_price)
+from ..utils import amount_index, binance_api, quote_cache
+from ..utils.amount_index import AmountIndex
+from ..utils.binance_api import get_p2p_offers_data, get_session
+from ..utils.circuit_breaker import get_circuit_breaker
+from ..utils.currency_registry import currency_registry
+from ..utils.cross_rates import (CrossRates, build_cross_rates,
+                                 get_cross_rates, reset_cross_rates)
+from ..utils.json_parser import (get_offer_book_from_json,
+                                 get_offers_from_json,
+                                 get_payment_methods_from_json,
+                                 get_raw_offers_from_pages, sort_raw_offers)
+from ..utils.last_known_good import last_known_good
+from ..utils.offers_utils import (async_get_best_asset_offers_lists,
+                                  async_get_best_offers_lists, get_amount,
+                                  get_best_asset_offers_lists,
+                                  get_best_offers_lists, get_best_price,
+                                  get_book_request, get_conversion_fill,
+                                  iter_offers_pages, rank_asset_conversions,
+                                  record_reference_prices, run_concurrently)
+from ..utils.popularity import CountMinSketch, PopularityTracker
+from ..utils.quote_cache import StaleResponse
+from ..utils.reference_prices import (get_reference_price,
+                                      update_from_response)
+from ..utils.rate_limiter import (CacheTokenBucket, FileTokenBucket, Priority,
+                                  TokenBucket, reset_rate_limiter)
+from ..utils.routes import find_best_route, solve, trade
+from ..utils.single_flight import SingleFlight
+from ..utils.stub_server import StubOptions, StubServer, start_stub_server
+from ..utils.synthetic_book import generate_offers, make_search_response
 
 
 class JsonParserTests(TestCase):
@@ -100,6 +138,26 @@ class JsonParserTests(TestCase):
             ).exists()
         )
 
+    def test_get_payment_methods_bulk_upsert(self):
+        """Payment methods written in bulk, existing ones updated."""
+        PaymentMethod.objects.create(
+            short_name='Advcash',
+            display_name='Old name',
+            currency=self.currency_rub,
+        )
+        currency_registry.load()
+        with self.assertNumQueries(5):
+            parsed_payment_methods = get_payment_methods_from_json(
+                self.rub_json_response)
+        self.assertIsInstance(parsed_payment_methods, QuerySet)
+        self.assertEqual(
+            [payment_method.pk for payment_method in parsed_payment_methods],
+            list(PaymentMethod.objects.filter(
+                currency=self.currency_rub).values_list('pk', flat=True)))
+        self.assertEqual(
+            PaymentMethod.objects.get(short_name='Advcash').display_name,
+            'Advcash')
+
     def test_parse_offers(self):
         """Offers parsed from JSON successfully."""
         offers = get_offers_from_json(self.rub_json_response, TradeType.SELL)
@@ -122,6 +180,123 @@ class JsonParserTests(TestCase):
         self.assertEqual(offers_sell[0].price, float(self.highest_order_price))
         self.assertEqual(offers_buy[0].price, float(self.lowest_order_price))
 
+    def test_parse_offers_without_queries(self):
+        """Currency resolved from registry, no query per offer."""
+        currency_registry.load()
+        with self.assertNumQueries(0):
+            get_offers_from_json(self.rub_json_response, TradeType.SELL)
+            get_offer_book_from_json(self.rub_json_response, TradeType.SELL)
+
+    def test_parse_offers_top_k(self):
+        """Only top_k best offers returned, in same order as full sort."""
+        offers = get_offers_from_json(
+            self.rub_json_response, TradeType.SELL)
+        top_offers = get_offers_from_json(
+            self.rub_json_response, TradeType.SELL, top_k=3)
+        self.assertEqual([offer.offer_id for offer in top_offers],
+                         [offer.offer_id for offer in offers[:3]])
+        top_book = get_offer_book_from_json(
+            self.rub_json_response, TradeType.SELL, top_k=3)
+        self.assertEqual([offer.offer_id for offer in top_book],
+                         [offer.offer_id for offer in offers[:3]])
+
+    def test_sort_numeric_prices(self):
+        """Prices of different length sorted as numbers."""
+        raw_offers = [{'adv': {'price': price}}
+                      for price in ('9.5', '10.1', '100')]
+        self.assertEqual(
+            [price for price, _ in sort_raw_offers(
+                raw_offers, TradeType.BUY)],
+            [9.5, 10.1, 100.0])
+
+    def test_parse_offer_book(self):
+        """Offer book parsed from JSON, rows materialized as offers."""
+        book = get_offer_book_from_json(self.rub_json_response, TradeType.BUY)
+        self.assertEqual(len(book), 10)
+        self.assertEqual(book.best_price(), float(self.lowest_order_price))
+        self.assert_seller(book[0].seller)
+        self.assert_offer(book[0])
+        self.assertEqual(
+            [offer.price for offer in book],
+            [offer.price for offer in get_offers_from_json(
+                self.rub_json_response, TradeType.BUY)])
+
+    def test_offer_book_filter(self):
+        """Only offers available for amount are kept."""
+        book = get_offer_book_from_json(self.rub_json_response, TradeType.BUY)
+        filtered = book.filter(amount=10000)
+        self.assertTrue(filtered)
+        for offer in filtered:
+            self.assertLessEqual(offer.min_amount, 10000)
+            self.assertGreaterEqual(offer.max_amount, 10000)
+        self.assertFalse(book.filter(amount=0.01))
+
+    def test_offer_book_fill(self):
+        """Fiat amount for USDT calculated walking offers."""
+        book = get_offer_book_from_json(self.rub_json_response, TradeType.BUY)
+        fiat_amount, offers_used = book.fill(200)
+        self.assertAlmostEqual(fiat_amount, 200 * book.best_price())
+        self.assertEqual(offers_used, 1)
+        self.assertEqual(book.fill(sum(book.tradable_funds) + 1),
+                         (None, len(book)))
+
+    def test_fill_simulator(self):
+        """Fills walk offers in order, respecting their limits."""
+        book = get_offer_book_from_json(self.rub_json_response, TradeType.BUY)
+        simulator = book.simulator
+        # 100 USDT is below min amount of best offer.
+        fill = simulator.fiat_for_usdt(100)
+        self.assertEqual(fill.full_rows, 0)
+        self.assertEqual(fill.rate, book.price[fill.last_row])
+        self.assertGreaterEqual(
+            fill.fiat_amount, book.min_amount[fill.last_row])
+
+        fill = simulator.fiat_for_usdt(1000)
+        offers = simulator.get_offers(fill)
+        self.assertGreater(fill.offers_count, 1)
+        self.assertEqual(len(offers), fill.offers_count)
+        self.assertEqual(offers.best_price(), book.best_price())
+        self.assertGreater(fill.rate, book.best_price())
+        self.assertAlmostEqual(fill.usdt_amount, 1000)
+
+        reverse_fill = simulator.usdt_for_fiat(fill.fiat_amount)
+        self.assertAlmostEqual(reverse_fill.usdt_amount, 1000)
+        self.assertAlmostEqual(reverse_fill.rate, fill.rate)
+        self.assertIsNone(simulator.usdt_for_fiat(10 ** 9))
+
+    def test_get_conversion_fill(self):
+        """Conversion amounts filled through USDT in both directions."""
+        from_offers = get_offer_book_from_json(
+            self.rub_json_response, TradeType.BUY)
+        to_offers = get_offer_book_from_json(
+            self.rub_json_response, TradeType.SELL)
+        from_amount, to_amount = get_conversion_fill(
+            from_offers, to_offers, from_amount=50000)
+        self.assertAlmostEqual(from_amount, 50000)
+        self.assertGreater(to_amount, 0)
+        reverse_from_amount, reverse_to_amount = get_conversion_fill(
+            from_offers, to_offers, to_amount=to_amount)
+        self.assertAlmostEqual(reverse_to_amount, to_amount)
+        self.assertAlmostEqual(reverse_from_amount, from_amount, places=2)
+        self.assertIsNone(
+            get_conversion_fill(from_offers, to_offers, from_amount=10 ** 9))
+
+    def test_amount_index(self):
+        """Index selects same offers as filtering book by amount."""
+        book = get_offer_book_from_json(self.rub_json_response, TradeType.BUY)
+        index = AmountIndex(book)
+        for amount in (100, 500, 2000, 5000, 10000, 25000, 10 ** 6):
+            filtered = book.filter(amount)
+            self.assertEqual(index.count(amount), len(filtered))
+            self.assertEqual(index.query(amount).offer_ids,
+                             filtered.offer_ids)
+            self.assertEqual(
+                index.query(amount, is_merchant=True).offer_ids,
+                book.filter(amount, is_merchant=True).offer_ids)
+        self.assertEqual(index.query(2000, rows=2).offer_ids,
+                         book.filter(2000).offer_ids[:2])
+        self.assertEqual(len(index.query()), len(book))
+
     def test_failed_response(self):
         """Raise BinanceApiError if request failed."""
         with self.assertRaises(BinanceApiError,
@@ -215,6 +390,9 @@ class UtilsTest(TestCase):
             )
             cls.test_offers.append(offer)
 
+    def setUp(self):
+        quote_cache.get_cache().clear()
+
     def test_get_best_price(self):
         """Price of top order returned successfully."""
         best_price = get_best_price(self.test_offers)
@@ -240,6 +418,404 @@ class UtilsTest(TestCase):
             self.assertEqual((list_rub[0].trade_type), TradeType.SELL)
             self.assertEqual((list_try[0].trade_type), TradeType.BUY)
 
+    def fake_p2p_offers_data(self, fiat_code, **kwargs):
+        """Return test response for requested currency."""
+        if fiat_code == self.currency_rub.code:
+            return self.rub_json_response
+        return self.try_json_response
+
+    def test_get_best_offers_lists_concurrent(self):
+        """Concurrent mode returns same lists as sequential mode."""
+        with patch('converter.utils.offers_utils.get_p2p_offers_data'
+                   ) as get_p2p_offers_data:
+            get_p2p_offers_data.side_effect = self.fake_p2p_offers_data
+            list_try, list_rub = get_best_offers_lists(
+                self.currency_rub,
+                self.currency_try,
+                self.payment_method_rub,
+                self.payment_method_try,
+                self.is_merchant,
+                self.amount_rub,
+                self.is_to_amount_filled,
+                concurrent=True)
+            self.assertEqual(get_p2p_offers_data.call_count, 3)
+            self.assertEqual((list_rub[0].price), self.best_rub_price)
+            self.assertEqual((list_try[0].price), self.best_try_price)
+
+    def test_get_best_offers_lists_concurrent_failed_leg(self):
+        """Error in one of parallel requests is raised to caller."""
+        with patch('converter.utils.offers_utils.get_p2p_offers_data'
+                   ) as get_p2p_offers_data:
+            get_p2p_offers_data.side_effect = ApiUnavailableError(
+                'Binance P2P Api Unavailable.')
+            with self.assertRaisesMessage(
+                    Exception, 'Binance P2P Api Unavailable.'):
+                get_best_offers_lists(
+                    self.currency_rub,
+                    self.currency_try,
+                    self.payment_method_rub,
+                    self.payment_method_try,
+                    self.is_merchant,
+                    self.amount_rub,
+                    self.is_to_amount_filled,
+                    concurrent=True)
+
+    async def test_async_get_best_offers_lists(self):
+        """Async variant returns same lists as sync variant."""
+        async def fake_p2p_offers_data(**kwargs):
+            return self.fake_p2p_offers_data(**kwargs)
+
+        with patch('converter.utils.offers_utils.async_get_p2p_offers_data',
+                   side_effect=fake_p2p_offers_data):
+            list_try, list_rub = await async_get_best_offers_lists(
+                self.currency_rub,
+                self.currency_try,
+                self.payment_method_rub,
+                self.payment_method_try,
+                self.is_merchant,
+                self.amount_rub,
+                self.is_to_amount_filled)
+        self.assertEqual((list_rub[0].price), self.best_rub_price)
+        self.assertEqual((list_try[0].price), self.best_try_price)
+
+    def fake_asset_offers_data(self, fiat_code, asset, **kwargs):
+        """Return test response for currency, TRY gives more for BTC."""
+        if asset == 'ETH':
+            raise ApiUnavailableError('Binance P2P Api Unavailable.')
+        response = json.loads(self.fake_p2p_offers_data(fiat_code))
+        for raw_offer in response['data']:
+            raw_offer['adv']['asset'] = asset
+            if asset == 'BTC' and fiat_code == self.currency_try.code:
+                raw_offer['adv']['price'] = str(
+                    float(raw_offer['adv']['price']) * 1.1)
+        return json.dumps(response)
+
+    def test_get_best_offers_lists_asset(self):
+        """Both currencies are requested and parsed for set asset."""
+        with patch('converter.utils.offers_utils.get_p2p_offers_data'
+                   ) as get_p2p_offers_data:
+            get_p2p_offers_data.side_effect = self.fake_asset_offers_data
+            list_try, list_rub = get_best_offers_lists(
+                self.currency_rub,
+                self.currency_try,
+                self.payment_method_rub,
+                self.payment_method_try,
+                self.is_merchant,
+                self.amount_rub,
+                self.is_to_amount_filled,
+                asset='BTC')
+        self.assertEqual(
+            {call.kwargs['asset']
+             for call in get_p2p_offers_data.call_args_list}, {'BTC'})
+        self.assertEqual(list_rub.asset, 'BTC')
+        self.assertEqual(list_try[0].asset, 'BTC')
+        self.assertIsNone(get_reference_price(
+            self.currency_try.code, self.payment_method_try.short_name,
+            TradeType.SELL, self.is_merchant))
+        self.assertIsNotNone(get_reference_price(
+            self.currency_try.code, self.payment_method_try.short_name,
+            TradeType.SELL, self.is_merchant, asset='BTC'))
+
+    def test_get_best_asset_offers_lists(self):
+        """Conversions of assets ranked from best, failed ones skipped."""
+        currency_registry.load()
+        with patch('converter.utils.offers_utils.get_p2p_offers_data'
+                   ) as get_p2p_offers_data:
+            get_p2p_offers_data.side_effect = self.fake_asset_offers_data
+            conversions = get_best_asset_offers_lists(
+                self.currency_rub,
+                self.currency_try,
+                self.payment_method_rub,
+                self.payment_method_try,
+                self.is_merchant,
+                self.amount_rub,
+                self.is_to_amount_filled,
+                assets=['USDT', 'BTC', 'ETH'])
+        self.assertEqual(
+            [conversion.asset for conversion in conversions], ['BTC', 'USDT'])
+        self.assertAlmostEqual(
+            conversions[0].amount, conversions[1].amount * 1.1)
+        self.assertEqual(conversions[0].offers_lists[0].asset, 'BTC')
+
+        with patch('converter.utils.offers_utils.get_p2p_offers_data',
+                   side_effect=self.fake_asset_offers_data):
+            with self.assertRaisesMessage(
+                    Exception, 'Binance P2P Api Unavailable.'):
+                get_best_asset_offers_lists(
+                    self.currency_rub,
+                    self.currency_try,
+                    self.payment_method_rub,
+                    self.payment_method_try,
+                    self.is_merchant,
+                    self.amount_rub,
+                    self.is_to_amount_filled,
+                    assets=['ETH'])
+
+    @override_settings(BINANCE_P2P_FETCH_DEADLINE=0.3)
+    def test_asset_conversions_share_deadline(self):
+        """Slow asset is skipped and stops its requests after deadline."""
+        currency_registry.load()
+        calls = []
+
+        def get_p2p_offers_data(asset, **kwargs):
+            calls.append(
+                (asset, threading.current_thread().name, time.monotonic()))
+            if asset == 'BTC':
+                time.sleep(0.5)
+            return self.fake_asset_offers_data(asset=asset, **kwargs)
+
+        for concurrent in (False, True):
+            calls.clear()
+            quote_cache.get_cache().clear()
+            with override_settings(BINANCE_P2P_CONCURRENT_FETCH=concurrent
+                                   ), patch(
+                    'converter.utils.offers_utils.get_p2p_offers_data',
+                    get_p2p_offers_data):
+                conversions = get_best_asset_offers_lists(
+                    self.currency_rub,
+                    self.currency_try,
+                    self.payment_method_rub,
+                    self.payment_method_try,
+                    self.is_merchant,
+                    self.amount_rub,
+                    self.is_to_amount_filled,
+                    assets=['USDT', 'BTC'])
+                time.sleep(0.5)
+            self.assertEqual(
+                [conversion.asset for conversion in conversions], ['USDT'])
+            started = [
+                started_at for asset, _, started_at in calls
+                if asset == 'BTC']
+            self.assertLess(max(started) - min(started), 0.3)
+            self.assertTrue(all(
+                thread.startswith('binance-p2p-')
+                for _, thread, _ in calls))
+
+    def test_unfilled_asset_conversion_ranked_last(self):
+        """Thin book with better best price can't beat filled one."""
+        def get_book(fiat_code, trade_type, depth, base_price):
+            return get_offer_book_from_json(
+                json.dumps(make_search_response(list(generate_offers(
+                    fiat_code, trade_type, depth, base_price=base_price)))),
+                trade_type)
+
+        amount = 1000000
+        results = [
+            (get_book('TRY', TradeType.SELL, 20, 30),
+             get_book('RUB', TradeType.BUY, 20, 90)),
+            (get_book('TRY', TradeType.SELL, 20, 30),
+             get_book('RUB', TradeType.BUY, 1, 45)),
+        ]
+        conversions = rank_asset_conversions(
+            ['USDT', 'BTC'], results, amount, False)
+        self.assertEqual(
+            [(conversion.asset, conversion.filled)
+             for conversion in conversions],
+            [('USDT', True), ('BTC', False)])
+        self.assertGreater(conversions[1].amount, conversions[0].amount)
+
+    async def test_async_get_best_asset_offers_lists(self):
+        """Async variant ranks conversions of assets like sync one."""
+        async def fake_p2p_offers_data(**kwargs):
+            return self.fake_asset_offers_data(**kwargs)
+
+        with patch('converter.utils.offers_utils.async_get_p2p_offers_data',
+                   side_effect=fake_p2p_offers_data):
+            conversions = await async_get_best_asset_offers_lists(
+                self.currency_rub,
+                self.currency_try,
+                self.payment_method_rub,
+                self.payment_method_try,
+                self.is_merchant,
+                self.amount_rub,
+                self.is_to_amount_filled,
+                assets=['USDT', 'BTC', 'ETH'])
+        self.assertEqual(
+            [conversion.asset for conversion in conversions], ['BTC', 'USDT'])
+
+    def test_get_best_offers_lists_amount_index(self):
+        """New amounts are answered from index without requests."""
+        requests = []
+
+        def get_p2p_offers_data(fiat_code, trade_type, rows, page=1,
+                                **kwargs):
+            requests.append((fiat_code, page, kwargs.get('trans_amount')))
+            offers = generate_offers(fiat_code, trade_type, 30)
+            return json.dumps(make_search_response(
+                list(offers[(page - 1) * rows:page * rows]),
+                total=len(offers)))
+
+        amount_index.reset_indexes()
+        requests_count = []
+        with patch('converter.utils.offers_utils.get_p2p_offers_data',
+                   get_p2p_offers_data):
+            for amount in (5000, 20000):
+                list_try, list_rub = get_best_offers_lists(
+                    self.currency_rub,
+                    self.currency_try,
+                    self.payment_method_rub,
+                    self.payment_method_try,
+                    False,
+                    amount,
+                    self.is_to_amount_filled,
+                    use_amount_index=True)
+                self.assertTrue(all(
+                    offer.min_amount <= amount <= offer.max_amount
+                    for offer in list_rub))
+                self.assertEqual(
+                    [offer.price for offer in list_try],
+                    sorted((offer.price for offer in list_try),
+                           reverse=True))
+                requests_count.append(len(requests))
+        amount_index.reset_indexes()
+        self.assertTrue(all(
+            trans_amount is None for _, _, trans_amount in requests))
+        self.assertEqual(len(set(requests)), len(requests))
+        self.assertEqual(requests_count[0], requests_count[1])
+
+    def test_amount_indexes_built_concurrently(self):
+        """Missing indexes of both currencies are built in parallel."""
+        first_pages = threading.Barrier(2, timeout=5)
+
+        def get_p2p_offers_data(fiat_code, trade_type, rows, page=1,
+                                **kwargs):
+            if page == 1:
+                first_pages.wait()
+            offers = generate_offers(fiat_code, trade_type, 30)
+            return json.dumps(make_search_response(
+                list(offers[(page - 1) * rows:page * rows]),
+                total=len(offers)))
+
+        amount_index.reset_indexes()
+        with patch('converter.utils.offers_utils.get_p2p_offers_data',
+                   get_p2p_offers_data):
+            list_try, list_rub = get_best_offers_lists(
+                self.currency_rub,
+                self.currency_try,
+                self.payment_method_rub,
+                self.payment_method_try,
+                False,
+                5000,
+                self.is_to_amount_filled,
+                use_amount_index=True)
+        amount_index.reset_indexes()
+        self.assertTrue(list_try)
+        self.assertTrue(list_rub)
+
+    def test_reference_price_skips_probe(self):
+        """Approximate price request skipped while reference is fresh."""
+        for concurrent in (False, True):
+            quote_cache.get_cache().clear()
+            with patch('converter.utils.offers_utils.get_p2p_offers_data'
+                       ) as get_p2p_offers_data:
+                get_p2p_offers_data.side_effect = self.fake_p2p_offers_data
+                for _ in range(2):
+                    list_try, list_rub = get_best_offers_lists(
+                        self.currency_rub,
+                        self.currency_try,
+                        self.payment_method_rub,
+                        self.payment_method_try,
+                        self.is_merchant,
+                        self.amount_rub,
+                        self.is_to_amount_filled,
+                        concurrent=concurrent)
+                    self.assertEqual((list_try[0].price), self.best_try_price)
+            self.assertEqual(get_p2p_offers_data.call_count, 5)
+            self.assertEqual(
+                [call.kwargs['rows'] for call
+                 in get_p2p_offers_data.call_args_list].count(1), 1)
+        self.assertEqual(
+            get_reference_price('TRY', 'Ziraat', TradeType.SELL, True),
+            self.best_try_price)
+        with override_settings(BINANCE_P2P_REFERENCE_PRICE_TTL=-1):
+            self.assertIsNone(
+                get_reference_price('TRY', 'Ziraat', TradeType.SELL, True))
+
+    def test_reference_price_from_response(self):
+        """Background responses update reference prices."""
+        update_from_response(
+            {'page': 1, 'fiat': 'TRY', 'payTypes': ['Ziraat'],
+             'tradeType': TradeType.BUY, 'publisherType': None},
+            self.try_json_response)
+        self.assertEqual(
+            get_reference_price('TRY', 'Ziraat', TradeType.BUY),
+            self.best_try_price)
+        # Best merchant offer of test book.
+        self.assertEqual(
+            get_reference_price('TRY', 'Ziraat', TradeType.BUY, True), 18.24)
+        self.assertIsNone(get_reference_price('TRY', None, TradeType.BUY))
+
+    def test_reference_price_not_from_amount_filtered_book(self):
+        """Books and responses filtered by amount skip reference prices."""
+        book = get_offer_book_from_json(self.try_json_response, TradeType.BUY)
+        record_reference_prices(get_book_request(
+            'TRY', 'Ziraat', TradeType.BUY, False, 1000), book)
+        update_from_response(
+            {'page': 1, 'fiat': 'TRY', 'payTypes': ['Ziraat'],
+             'tradeType': TradeType.BUY, 'publisherType': None,
+             'transAmount': 1000},
+            self.try_json_response)
+        self.assertIsNone(get_reference_price('TRY', 'Ziraat', TradeType.BUY))
+        record_reference_prices(get_book_request(
+            'TRY', 'Ziraat', TradeType.BUY, False), book)
+        self.assertEqual(
+            get_reference_price('TRY', 'Ziraat', TradeType.BUY),
+            book.best_price())
+
+    def test_run_concurrently_deadline(self):
+        """Raise ApiUnavailableError if deadline exceeded."""
+        with self.assertRaises(ApiUnavailableError):
+            run_concurrently([lambda: time.sleep(0.2)],
+                             time.monotonic() + 0.01)
+
+    def get_pages(self, depth: int, pages: list):
+        """Patch requests to return pages of synthetic book."""
+        offers = generate_offers('RUB', TradeType.BUY, depth)
+
+        def get_p2p_offers_data(rows, page=1, **kwargs):
+            pages.append(page)
+            return json.dumps(make_search_response(
+                list(offers[(page - 1) * rows:page * rows]),
+                total=len(offers)))
+        return patch('converter.utils.offers_utils.get_p2p_offers_data',
+                     get_p2p_offers_data)
+
+    def test_pages_stop_when_amount_covered(self):
+        """Next pages fetched only until offers cover amount."""
+        request = {'fiat_code': 'RUB', 'rows': 10}
+        pages = []
+        with self.get_pages(100, pages):
+            small_offers, _ = get_raw_offers_from_pages(
+                iter_offers_pages(request, max_pages=10), fiat_amount=1)
+        self.assertEqual(len(small_offers), 10)
+        self.assertEqual(pages, [1])
+
+        pages.clear()
+        with self.get_pages(100, pages):
+            large_offers, _ = get_raw_offers_from_pages(
+                iter_offers_pages(request, max_pages=10, concurrency=1),
+                fiat_amount=sum(
+                    float(offer['adv']['surplusAmount'])
+                    * float(offer['adv']['price'])
+                    for offer in generate_offers('RUB', TradeType.BUY, 25)))
+        self.assertEqual(len(large_offers), 30)
+        self.assertEqual(pages, [1, 2, 3])
+
+    def test_pages_stop_out_of_price_band(self):
+        """Stream stops when price leaves tolerance band, or book ends."""
+        request = {'fiat_code': 'RUB', 'rows': 10}
+        pages = []
+        with self.get_pages(100, pages):
+            offers, _ = get_raw_offers_from_pages(
+                iter_offers_pages(request, max_pages=10, concurrency=1),
+                fiat_amount=float('inf'), price_tolerance=0)
+        self.assertEqual(len(offers), 10)
+        with self.get_pages(15, pages):
+            offers, _ = get_raw_offers_from_pages(
+                iter_offers_pages(request, max_pages=10),
+                fiat_amount=float('inf'))
+        self.assertEqual(len(offers), 15)
+
     def test_get_amount(self):
         """Return amount of currency_2 needed to buy currency_1."""
         amount = get_amount(
@@ -248,3 +824,709 @@ class UtilsTest(TestCase):
             self.try_offers_data
         )
         self.assertEqual(amount, self.unknown_amount)
+
+
+class BinanceApiTests(TestCase):
+    def setUp(self):
+        binance_api.close_session()
+        quote_cache.get_cache().clear()
+        quote_cache.reset_stats()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        test_settings = override_settings(
+            BINANCE_P2P_LKG_PATH=os.path.join(temp_dir.name, 'quotes.db'),
+            BINANCE_P2P_RATE_LIMIT_PATH=os.path.join(
+                temp_dir.name, 'rate_limit'),
+            BINANCE_P2P_BACKOFF_FACTOR=0)
+        test_settings.enable()
+        self.addCleanup(test_settings.disable)
+        self.addCleanup(last_known_good.flush)
+        reset_rate_limiter()
+        self.addCleanup(reset_rate_limiter)
+        get_circuit_breaker('search').reset()
+        self.addCleanup(get_circuit_breaker('search').reset)
+        self.response_text = json.dumps(make_search_response(
+            list(generate_offers('RUB', TradeType.BUY, 1))))
+
+    def tearDown(self):
+        binance_api.close_session()
+
+    def test_session_reused(self):
+        """Same pooled session returned for every call in process."""
+        self.assertIs(get_session(), get_session())
+
+    def test_session_headers(self):
+        """Content-Length is computed by requests, not hardcoded."""
+        self.assertNotIn('Content-Length', get_session().headers)
+
+    def test_get_p2p_offers_data_uses_session(self):
+        """Requests are sent through process-wide session."""
+        response = MagicMock(status_code=HTTPStatus.OK, text='{}')
+        with patch.object(get_session(), 'post',
+                          return_value=response) as post:
+            get_p2p_offers_data(fiat_code='RUB')
+            get_p2p_offers_data(fiat_code='TRY')
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(post.call_args.kwargs['json']['fiat'], 'TRY')
+
+    def test_get_p2p_offers_data_unavailable(self):
+        """Raise ApiUnavailableError if status code is not 200."""
+        response = MagicMock(status_code=HTTPStatus.BAD_GATEWAY)
+        with patch.object(get_session(), 'post', return_value=response):
+            with self.assertRaises(ApiUnavailableError):
+                get_p2p_offers_data(fiat_code='RUB')
+
+    def test_get_p2p_offers_data_cached(self):
+        """Nearby amounts share cached response, force_refresh skips it."""
+        response = MagicMock(
+            status_code=HTTPStatus.OK, text=self.response_text)
+        with patch.object(get_session(), 'post',
+                          return_value=response) as post:
+            get_p2p_offers_data(fiat_code='RUB', trans_amount=2345)
+            get_p2p_offers_data(fiat_code='RUB', trans_amount=2399)
+            self.assertEqual(post.call_count, 1)
+            get_p2p_offers_data(fiat_code='RUB', trans_amount=2399,
+                                force_refresh=True)
+            self.assertEqual(post.call_count, 2)
+        self.assertEqual(
+            quote_cache.get_stats(),
+            {'hits': 1, 'stale_hits': 0, 'misses': 1, 'evictions': 0})
+
+    def test_failed_response_not_cached(self):
+        """Unsuccessful or empty responses are requested again."""
+        for text in (json.dumps({'success': False, 'message': 'busy',
+                                 'data': None}),
+                     json.dumps(make_search_response([]))):
+            response = MagicMock(status_code=HTTPStatus.OK, text=text)
+            with patch.object(get_session(), 'post',
+                              return_value=response) as post:
+                self.assertEqual(get_p2p_offers_data(fiat_code='RUB'), text)
+                self.assertEqual(get_p2p_offers_data(fiat_code='RUB'), text)
+            self.assertEqual(post.call_count, 2)
+
+    def test_get_p2p_offers_data_bucket_filtered(self):
+        """Bucket amount requested, offers filtered by amount itself."""
+        def raw_offer(offer_id, min_amount, max_amount):
+            return {'adv': {'advNo': offer_id,
+                            'minSingleTransAmount': str(min_amount),
+                            'maxSingleTransAmount': str(max_amount)}}
+
+        response = MagicMock(status_code=HTTPStatus.OK, text=json.dumps({
+            'success': True,
+            'data': [raw_offer('low', 2000, 2350),
+                     raw_offer('high', 2390, 5000)]}))
+        with patch.object(get_session(), 'post',
+                          return_value=response) as post:
+            low = get_p2p_offers_data(fiat_code='RUB', trans_amount=2345)
+            high = get_p2p_offers_data(fiat_code='RUB', trans_amount=2399)
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(post.call_args.kwargs['json']['transAmount'], 2300)
+        self.assertEqual(
+            [offer['adv']['advNo'] for offer in json.loads(low)['data']],
+            ['low'])
+        self.assertEqual(
+            [offer['adv']['advNo'] for offer in json.loads(high)['data']],
+            ['high'])
+
+    def test_get_p2p_offers_data_retries(self):
+        """Timeouts retried, then ApiUnavailableError raised."""
+        with patch.object(get_session(), 'post',
+                          side_effect=requests.Timeout('timed out')) as post:
+            with self.assertRaises(ApiUnavailableError):
+                get_p2p_offers_data(fiat_code='RUB')
+        self.assertEqual(post.call_count, settings.BINANCE_P2P_MAX_RETRIES + 1)
+        self.assertEqual(
+            post.call_args.kwargs['timeout'],
+            settings.BINANCE_P2P_TIMEOUTS['search'])
+
+    def test_circuit_breaker(self):
+        """Open breaker fails fast, half open breaker closed by probe."""
+        breaker = get_circuit_breaker('search')
+        failed_response = MagicMock(status_code=HTTPStatus.FORBIDDEN)
+        with patch.object(get_session(), 'post',
+                          return_value=failed_response) as post:
+            for i in range(settings.BINANCE_P2P_BREAKER_FAILURE_THRESHOLD):
+                with self.assertRaises(ApiUnavailableError):
+                    get_p2p_offers_data(fiat_code=f'RUB{i}')
+            self.assertEqual(breaker.snapshot()['state'], breaker.OPEN)
+            with self.assertRaises(CircuitOpenError):
+                get_p2p_offers_data(fiat_code='TRY')
+        self.assertEqual(
+            post.call_count, settings.BINANCE_P2P_BREAKER_FAILURE_THRESHOLD)
+
+        breaker.opened_at -= settings.BINANCE_P2P_BREAKER_RECOVERY_TIMEOUT
+        response = MagicMock(status_code=HTTPStatus.OK, text='{}')
+        with patch.object(get_session(), 'post', return_value=response):
+            get_p2p_offers_data(fiat_code='TRY')
+        self.assertEqual(breaker.snapshot()['state'], breaker.CLOSED)
+
+    def test_circuit_breaker_probe_request_error(self):
+        """Probe failed with any request error opens breaker again."""
+        breaker = get_circuit_breaker('search')
+        breaker.opened_at = time.monotonic() - (
+            settings.BINANCE_P2P_BREAKER_RECOVERY_TIMEOUT)
+        breaker.state = breaker.OPEN
+        with patch.object(get_session(), 'post',
+                          side_effect=requests.exceptions.ChunkedEncodingError(
+                              'broken')) as post:
+            with self.assertRaises(ApiUnavailableError):
+                get_p2p_offers_data(fiat_code='RUB')
+        post.assert_called_once()
+        self.assertEqual(breaker.snapshot()['state'], breaker.OPEN)
+
+        breaker.opened_at -= settings.BINANCE_P2P_BREAKER_RECOVERY_TIMEOUT
+        response = MagicMock(status_code=HTTPStatus.OK, text='{}')
+        with patch.object(get_session(), 'post', return_value=response):
+            get_p2p_offers_data(fiat_code='TRY')
+        self.assertEqual(breaker.snapshot()['state'], breaker.CLOSED)
+
+    def test_rate_limited(self):
+        """Request not allowed by rate limiter in time is not sent."""
+        response = MagicMock(status_code=HTTPStatus.OK, text='{}')
+        with override_settings(BINANCE_P2P_RATE_LIMIT=1,
+                               BINANCE_P2P_RATE_LIMIT_BURST=1,
+                               BINANCE_P2P_RATE_LIMIT_WAIT={
+                                   'interactive': 0}):
+            reset_rate_limiter()
+            with patch.object(get_session(), 'post',
+                              return_value=response) as post:
+                get_p2p_offers_data(fiat_code='RUB')
+                with self.assertRaises(RateLimitedError):
+                    get_p2p_offers_data(fiat_code='TRY')
+        post.assert_called_once()
+        self.assertEqual(
+            get_circuit_breaker('search').snapshot()['state'], 'closed')
+
+    def test_record_and_replay(self):
+        """Responses recorded from stub server replayed without it."""
+        server = start_stub_server(options=StubOptions(depth=30))
+        self.addCleanup(server.server_close)
+        fixtures_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(fixtures_dir.cleanup)
+        with override_settings(BINANCE_P2P_BASE_URL=server.url,
+                               BINANCE_P2P_TRANSPORT='record',
+                               BINANCE_P2P_FIXTURES_DIR=fixtures_dir.name):
+            recorded = get_p2p_offers_data(fiat_code='RUB', rows=5)
+        server.shutdown()
+        self.assertEqual(len(json.loads(recorded)['data']), 5)
+        self.assertEqual(server.get_stats(), {'requests': 1})
+
+        with override_settings(BINANCE_P2P_TRANSPORT='replay',
+                               BINANCE_P2P_FIXTURES_DIR=fixtures_dir.name):
+            self.assertEqual(
+                get_p2p_offers_data(fiat_code='RUB', rows=5,
+                                    force_refresh=True),
+                recorded)
+            with self.assertRaises(ApiUnavailableError):
+                get_p2p_offers_data(fiat_code='TRY')
+
+    def test_expired_response_refreshed_in_background(self):
+        """Expired response returned, refresh scheduled."""
+        response = MagicMock(
+            status_code=HTTPStatus.OK, text=self.response_text)
+        with patch.object(get_session(), 'post', return_value=response):
+            get_p2p_offers_data(fiat_code='RUB')
+        fetched_at = time.time() - settings.BINANCE_P2P_CACHE_TTL - 1
+        with patch('converter.utils.quote_cache.time.time',
+                   return_value=fetched_at):
+            with patch.object(get_session(), 'post', return_value=response):
+                get_p2p_offers_data(fiat_code='RUB', force_refresh=True)
+        with patch('converter.utils.binance_api.run_in_background'
+                   ) as run_in_background, patch.object(
+                get_session(), 'post') as post:
+            self.assertEqual(get_p2p_offers_data(fiat_code='RUB'),
+                self.response_text)
+        post.assert_not_called()
+        run_in_background.assert_called_once()
+
+    def test_last_known_good_response(self):
+        """Last known good response returned while api unavailable."""
+        response_text = json.dumps(make_search_response(
+            list(generate_offers('RUB', TradeType.BUY, 1))))
+        response = MagicMock(status_code=HTTPStatus.OK, text=response_text)
+        with patch.object(get_session(), 'post', return_value=response):
+            get_p2p_offers_data(fiat_code='RUB')
+        quote_cache.get_cache().clear()
+        response = MagicMock(status_code=HTTPStatus.BAD_GATEWAY)
+        with patch.object(get_session(), 'post', return_value=response):
+            stale_response = get_p2p_offers_data(fiat_code='RUB')
+            with self.assertRaises(ApiUnavailableError):
+                get_p2p_offers_data(fiat_code='TRY')
+        self.assertEqual(stale_response, response_text)
+        self.assertIsInstance(stale_response, StaleResponse)
+        self.assertGreaterEqual(stale_response.age, 0)
+
+    def test_failed_response_not_last_known_good(self):
+        """Unsuccessful or empty responses keep last known good one."""
+        response_text = json.dumps(make_search_response(
+            list(generate_offers('RUB', TradeType.BUY, 1))))
+        for text in (response_text,
+                     json.dumps({'success': False, 'message': 'busy',
+                                 'data': None}),
+                     json.dumps(make_search_response([])),
+                     'not json'):
+            response = MagicMock(status_code=HTTPStatus.OK, text=text)
+            with patch.object(get_session(), 'post', return_value=response):
+                get_p2p_offers_data(fiat_code='RUB', force_refresh=True)
+        quote_cache.get_cache().clear()
+        response = MagicMock(status_code=HTTPStatus.BAD_GATEWAY)
+        with patch.object(get_session(), 'post', return_value=response):
+            self.assertEqual(
+                get_p2p_offers_data(fiat_code='RUB'), response_text)
+
+    def test_last_known_good_pruned(self):
+        """Old responses and responses above max rows are pruned."""
+        with override_settings(BINANCE_P2P_LKG_MAX_ROWS=2):
+            for key in ('a', 'b', 'c'):
+                last_known_good.put(key, key)
+            last_known_good.flush()
+            self.assertIsNone(last_known_good.get('a'))
+            self.assertEqual(last_known_good.get('c')[0], 'c')
+        with override_settings(BINANCE_P2P_LKG_MAX_AGE=-1):
+            last_known_good.put('d', 'd')
+            last_known_good.flush()
+            self.assertIsNone(last_known_good.get('b'))
+            self.assertIsNone(last_known_good.get('d'))
+
+    def test_quantize_amount(self):
+        """Amount rounded down to significant digits."""
+        self.assertEqual(quote_cache.quantize_amount(2345), 2300)
+        self.assertEqual(quote_cache.quantize_amount(None), None)
+        self.assertAlmostEqual(quote_cache.quantize_amount(0.0567), 0.056)
+
+
+class SingleFlightTests(TestCase):
+    def test_concurrent_threads_share_call(self):
+        """Concurrent calls with same key made once."""
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return 'result'
+
+        leader = threading.Thread(
+            target=lambda: results.append(single_flight.do('key', call)))
+        leader.start()
+        started.wait(1)
+        followers = [
+            threading.Thread(
+                target=lambda: results.append(single_flight.do('key', call)))
+            for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(1)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 4)
+        self.assertEqual(single_flight.in_flight(), 0)
+
+    def test_exception_shared(self):
+        """Failed call raises same exception and is not kept in flight."""
+        single_flight = SingleFlight()
+
+        def call():
+            raise ApiUnavailableError('unavailable')
+
+        with self.assertRaises(ApiUnavailableError):
+            single_flight.do('key', call)
+        self.assertEqual(single_flight.do('key', lambda: 'ok'), 'ok')
+
+    def test_async_calls_share_call(self):
+        """Concurrent coroutines with same key await one call."""
+        single_flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        async def main():
+            return await asyncio.gather(
+                *[single_flight.do_async('key', call) for _ in range(5)])
+
+        self.assertEqual(asyncio.run(main()), ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_async_leader_cancelled(self):
+        """Cancelled first caller doesn't cancel call of others."""
+        single_flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.05)
+            return 'result'
+
+        async def main():
+            leader = asyncio.ensure_future(single_flight.do_async('key', call))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(
+                single_flight.do_async('key', call))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await follower
+
+        self.assertEqual(asyncio.run(main()), 'result')
+        self.assertEqual(single_flight.in_flight(), 0)
+
+
+class StubServerTests(TestCase):
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubOptions(depth=100))
+        self.addCleanup(self.server.server_close)
+
+    def test_generated_book_sorted(self):
+        """Books are reproducible and ordered from best price."""
+        buy = generate_offers('RUB', TradeType.BUY, 50)
+        sell = generate_offers('RUB', TradeType.SELL, 50)
+        buy_prices = [float(offer['adv']['price']) for offer in buy]
+        sell_prices = [float(offer['adv']['price']) for offer in sell]
+        self.assertEqual(len(buy), 50)
+        self.assertEqual(buy_prices, sorted(buy_prices))
+        self.assertEqual(sell_prices, sorted(sell_prices, reverse=True))
+        self.assertGreater(buy_prices[0], sell_prices[0])
+        self.assertEqual(buy[0]['adv']['tradeType'], TradeType.SELL)
+        self.assertNotEqual(
+            buy, generate_offers('RUB', TradeType.BUY, 50, seed=1))
+
+    def test_search_pagination(self):
+        """Pages of filtered book returned with its total."""
+        status, first_page = self.server.search(
+            {'fiat': 'RUB', 'tradeType': 'BUY', 'rows': 10, 'page': 1})
+        _, second_page = self.server.search(
+            {'fiat': 'RUB', 'tradeType': 'BUY', 'rows': 10, 'page': 2})
+        _, large_page = self.server.search(
+            {'fiat': 'RUB', 'tradeType': 'BUY', 'rows': 100})
+        self.assertEqual(status, HTTPStatus.OK)
+        self.assertEqual(first_page['total'], 100)
+        self.assertEqual(len(first_page['data']), 10)
+        self.assertEqual(len(large_page['data']), 20)
+        self.assertEqual(large_page['data'][10:], second_page['data'])
+
+    def test_search_filters(self):
+        """Offers filtered by amount, payment method and merchant."""
+        _, response = self.server.search({
+            'fiat': 'RUB', 'tradeType': 'SELL', 'rows': 20,
+            'transAmount': 5000, 'payTypes': ['TinkoffNew'],
+            'publisherType': 'merchant'})
+        self.assertLess(response['total'], 100)
+        for offer in response['data']:
+            self.assertLessEqual(
+                float(offer['adv']['minSingleTransAmount']), 5000)
+            self.assertGreaterEqual(
+                float(offer['adv']['maxSingleTransAmount']), 5000)
+            self.assertIn('TinkoffNew', [
+                method['identifier']
+                for method in offer['adv']['tradeMethods']])
+            self.assertEqual(offer['advertiser']['userType'], 'merchant')
+
+    def test_error_injection(self):
+        """Share of requests fails with configured status."""
+        self.server.options.error_rate = 1
+        status, _ = self.server.search({'fiat': 'RUB'})
+        self.assertEqual(status, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(
+            self.server.get_stats(), {'requests': 1, 'errors': 1})
+
+
+class RateLimiterTests(TestCase):
+    def test_priority_reserve(self):
+        """Lower priority requests leave reserve for interactive ones."""
+        bucket = TokenBucket(rate=1, capacity=4, reserve=0.5)
+        self.assertEqual(bucket.try_acquire(priority=Priority.BACKGROUND), 0)
+        self.assertEqual(bucket.try_acquire(priority=Priority.DISCOVERY), 0)
+        self.assertGreater(
+            bucket.try_acquire(priority=Priority.BACKGROUND), 0)
+        self.assertEqual(bucket.try_acquire(priority=Priority.DISCOVERY), 0)
+        self.assertGreater(bucket.try_acquire(priority=Priority.DISCOVERY), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+
+    def test_acquire_deadline(self):
+        """Acquire gives up when tokens are not freed before deadline."""
+        bucket = TokenBucket(rate=1, capacity=1)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0.1))
+
+    def test_file_bucket_shared(self):
+        """Buckets with same file share tokens."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'rate_limit')
+            first = FileTokenBucket(path, rate=0.1, capacity=2)
+            second = FileTokenBucket(path, rate=0.1, capacity=2)
+            self.assertEqual(first.try_acquire(), 0)
+            self.assertEqual(second.try_acquire(), 0)
+            self.assertGreater(first.try_acquire(), 0)
+
+    def test_cache_bucket_shared(self):
+        """Buckets with same cache key share tokens."""
+        first = CacheTokenBucket('test:rate_limit', rate=0.1, capacity=1)
+        second = CacheTokenBucket('test:rate_limit', rate=0.1, capacity=1)
+        self.addCleanup(first.cache.delete, first.key)
+        self.assertEqual(first.try_acquire(), 0)
+        self.assertGreater(second.try_acquire(), 0)
+
+
+class CurrencyRegistryTests(TestCase):
+    def test_registry_invalidated_on_save_and_delete(self):
+        """Registry reflects created, renamed and deleted currencies."""
+        currency = Currency.objects.create(code='KZT', name='Tenge')
+        self.assertEqual(currency_registry.get_by_code('KZT'), currency)
+        currency.name = 'Kazakhstan Tenge'
+        currency.save()
+        self.assertEqual(
+            currency_registry.get_by_pk(currency.pk).name,
+            'Kazakhstan Tenge')
+        currency.delete()
+        with self.assertRaises(Currency.DoesNotExist):
+            currency_registry.get_by_code('KZT')
+
+    def test_registry_lookup_without_queries(self):
+        """Loaded registry does not query database."""
+        currency = Currency.objects.create(code='KZT', name='Tenge')
+        currency_registry.load()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                currency_registry.get_by_pk(str(currency.pk)), currency)
+
+    def test_registry_miss_reload_limited(self):
+        """Unknown currencies reload registry at most once per interval."""
+        currency_registry.load()
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                with self.assertRaises(Currency.DoesNotExist):
+                    currency_registry.get_by_code('XXX')
+        with patch('converter.utils.currency_registry.time.monotonic',
+                   return_value=time.monotonic() + 60):
+            with self.assertNumQueries(1):
+                with self.assertRaises(Currency.DoesNotExist):
+                    currency_registry.get_by_code('XXX')
+
+
+class PopularityTests(TestCase):
+    def setUp(self):
+        quote_cache.get_cache().clear()
+
+    def test_count_min_sketch(self):
+        """Estimated counts never below real counts."""
+        sketch = CountMinSketch(width=16, depth=4)
+        for i in range(100):
+            sketch.add(i % 10)
+        for key in range(10):
+            self.assertGreaterEqual(sketch.estimate(key), 10)
+
+    def test_top_keys(self):
+        """Most popular keys returned in order of counts."""
+        tracker = PopularityTracker('test', capacity=2, half_life=3600)
+        for key, hits in (('a', 5), ('b', 1), ('c', 3)):
+            for _ in range(hits):
+                tracker.record(key)
+        self.assertEqual([key for key, _ in tracker.get_top()], ['a', 'c'])
+        self.assertAlmostEqual(tracker.get_top(1)[0][1], 5, places=2)
+
+    def test_counts_decayed(self):
+        """Counts halved after half life."""
+        tracker = PopularityTracker('test', capacity=2, half_life=60)
+        with patch('converter.utils.popularity.time.time',
+                   return_value=tracker._landmark):
+            tracker.record('a')
+            tracker.record('a')
+        with patch('converter.utils.popularity.time.time',
+                   return_value=tracker._landmark + 60):
+            self.assertAlmostEqual(tracker.get_top()[0][1], 1)
+
+    def test_shared_top(self):
+        """Published snapshots merged for other processes."""
+        tracker = PopularityTracker('test', capacity=2, half_life=3600)
+        tracker.record('a')
+        tracker.publish()
+        self.assertEqual(
+            [key for key, _ in tracker.get_shared_top()], ['a'])
+
+
+class CrossRatesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for code in ('RUB', 'TRY', 'KZT'):
+            currency = Currency.objects.create(code=code, name=code)
+            PaymentMethod.objects.create(
+                short_name='BANK', display_name='Bank', currency=currency)
+        Currency.objects.create(code='USD', name='No payment methods')
+
+    def setUp(self):
+        quote_cache.get_cache().clear()
+        reset_cross_rates()
+        self.addCleanup(reset_cross_rates)
+
+    def get_best_prices(self):
+        """Patch requests to return synthetic books, return requests."""
+        requests = []
+
+        def get_p2p_offers_data(fiat_code, trade_type, rows, **kwargs):
+            requests.append((fiat_code, trade_type))
+            return json.dumps(make_search_response(
+                list(generate_offers(fiat_code, trade_type, rows))))
+        return requests, patch(
+            'converter.utils.cross_rates.get_p2p_offers_data',
+            get_p2p_offers_data)
+
+    def test_rates(self):
+        """Rate is SELL price of target over BUY price of source."""
+        cross_rates = CrossRates(
+            ['RUB', 'TRY', 'XXX'], [60, 18, math.nan], [59, 17.5, 1])
+        self.assertAlmostEqual(cross_rates.get_rate('RUB', 'TRY'), 17.5 / 60)
+        self.assertAlmostEqual(cross_rates.get_rate('TRY', 'RUB'), 59 / 18)
+        self.assertAlmostEqual(cross_rates.get_rate('RUB', 'RUB'), 59 / 60)
+        self.assertIsNone(cross_rates.get_rate('XXX', 'RUB'))
+        self.assertIsNone(cross_rates.as_dict()['rates'][2][0])
+        with self.assertRaises(KeyError):
+            cross_rates.get_rate('RUB', 'USD')
+
+    def test_build(self):
+        """Two requests per liquid currency, snapshot versioned."""
+        requests, patch_requests = self.get_best_prices()
+        with patch_requests:
+            first = build_cross_rates()
+        self.assertEqual(first.codes, ['KZT', 'RUB', 'TRY'])
+        self.assertEqual(len(requests), 6)
+        self.assertEqual(len(set(requests)), 6)
+        buy_price = float(generate_offers('RUB', TradeType.BUY, 1)[0]
+                          ['adv']['price'])
+        sell_price = float(generate_offers('TRY', TradeType.SELL, 1)[0]
+                           ['adv']['price'])
+        self.assertAlmostEqual(
+            first.get_rate('RUB', 'TRY'), sell_price / buy_price)
+
+        reset_cross_rates()
+        self.assertEqual(get_cross_rates().version, first.version)
+        with patch_requests:
+            second = build_cross_rates()
+        self.assertEqual(second.version, first.version + 1)
+        self.assertEqual(get_cross_rates().version, second.version)
+
+    def test_missing_price(self):
+        """Pairs using missing price have no rates, others are built."""
+        requests, patch_requests = self.get_best_prices()
+        with patch_requests, patch(
+                'converter.utils.cross_rates.get_raw_offers_from_json',
+                side_effect=[OffersNotFoundError('Offers not found.')]
+                + [[{'adv': {'price': '10'}}]] * 5):
+            cross_rates = build_cross_rates()
+        self.assertEqual(
+            sum(rate is None for row in cross_rates.as_dict()['rates']
+                for rate in row), 3)
+
+    def test_rebuild_scheduled(self):
+        """Missing or old snapshot is rebuilt in background."""
+        with patch('converter.utils.cross_rates.run_in_background'
+                   ) as run_in_background:
+            self.assertIsNone(get_cross_rates())
+            run_in_background.assert_called_once()
+
+
+class RouteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for code in ('RUB', 'TRY', 'KZT'):
+            Currency.objects.create(code=code, name=code)
+
+    def setUp(self):
+        quote_cache.get_cache().clear()
+
+    def get_books(self, requests: list):
+        """Patch requests to return synthetic books of any asset."""
+        def get_p2p_offers_data(fiat_code, trade_type, rows, asset,
+                                **kwargs):
+            requests.append((fiat_code, trade_type, asset))
+            return json.dumps(make_search_response(list(generate_offers(
+                fiat_code, trade_type, rows, asset=asset))))
+        return patch('converter.utils.routes.get_p2p_offers_data',
+                     get_p2p_offers_data)
+
+    def test_best_asset_route(self):
+        """Route through asset giving most of target currency chosen."""
+        requests = []
+        assets = ['USDT', 'BTC', 'ETH']
+        with self.get_books(requests):
+            route = find_best_route(
+                'RUB', 'TRY', 5000, via_codes=[], assets=assets)
+        self.assertEqual(len(requests), 2 * len(assets))
+        self.assertEqual(len(route.path), 3)
+        self.assertEqual(route.path[::2], ['RUB', 'TRY'])
+        self.assertAlmostEqual(route.from_amount, 5000)
+
+        amounts = []
+        for asset in assets:
+            buy_book = get_offer_book_from_json(
+                json.dumps(make_search_response(list(generate_offers(
+                    'RUB', TradeType.BUY, 20, asset=asset)))),
+                TradeType.BUY)
+            sell_book = get_offer_book_from_json(
+                json.dumps(make_search_response(list(generate_offers(
+                    'TRY', TradeType.SELL, 20, asset=asset)))),
+                TradeType.SELL)
+            amounts.append(trade(
+                sell_book, TradeType.SELL,
+                trade(buy_book, TradeType.BUY, 5000)))
+        self.assertAlmostEqual(route.amount, max(amounts))
+        self.assertEqual(route.path[1], assets[amounts.index(max(amounts))])
+
+    def test_hop_limit(self):
+        """Routes through intermediate currency respect hop limit."""
+        requests = []
+        with self.get_books(requests):
+            direct = find_best_route(
+                'RUB', 'TRY', 5000, via_codes=[], assets=['USDT', 'BTC'])
+            route = find_best_route(
+                'RUB', 'TRY', 5000, via_codes=['KZT'],
+                assets=['USDT', 'BTC'], max_hops=4)
+            limited = find_best_route(
+                'RUB', 'TRY', 5000, via_codes=['KZT'],
+                assets=['USDT', 'BTC'], max_hops=2)
+        self.assertGreaterEqual(route.amount, direct.amount)
+        self.assertLessEqual(len(route.hops), 4)
+        self.assertEqual(limited.amount, direct.amount)
+        self.assertEqual(len(route.path), len(set(route.path)))
+
+    def test_no_route(self):
+        """No route if books of target currency are empty."""
+        def get_p2p_offers_data(fiat_code, trade_type, rows, asset,
+                                **kwargs):
+            offers = generate_offers(fiat_code, trade_type, rows, asset=asset)
+            return json.dumps(make_search_response(
+                [] if fiat_code == 'TRY' else list(offers)))
+
+        with patch('converter.utils.routes.get_p2p_offers_data',
+                   get_p2p_offers_data):
+            self.assertIsNone(find_best_route(
+                'RUB', 'TRY', 5000, via_codes=['KZT'], assets=['USDT']))
+        self.assertIsNone(solve({}, 'RUB', 'TRY', 5000, 4))
+
+    def test_failed_books_skipped(self):
+        """Books failed to fetch or parse are dropped from graph."""
+        def get_p2p_offers_data(fiat_code, trade_type, rows, asset,
+                                **kwargs):
+            if asset == 'BTC':
+                raise requests.ConnectionError('connection reset')
+            if asset == 'ETH':
+                return '{"data": [{"adv": {}}]}'
+            return json.dumps(make_search_response(list(generate_offers(
+                fiat_code, trade_type, rows, asset=asset))))
+
+        with patch('converter.utils.routes.get_p2p_offers_data',
+                   get_p2p_offers_data):
+            route = find_best_route(
+                'RUB', 'TRY', 5000, via_codes=[],
+                assets=['USDT', 'BTC', 'ETH'])
+            self.assertEqual(route.path, ['RUB', 'USDT', 'TRY'])
+            with self.assertRaises(ApiUnavailableError):
+                find_best_route(
+                    'RUB', 'TRY', 5000, via_codes=[], assets=['BTC'])
@@ -1,11 +1,19 @@
+import asyncio
+from datetime import timedelta
 from http import HTTPStatus
 from unittest.mock import patch
 
-from django.test import Client, TestCase
+import requests
+from django.conf import settings
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
+from .. import views
 from ..forms import ConverterForm
 from ..models import Currency, PaymentMethod
+from ..utils.cross_rates import build_cross_rates, reset_cross_rates
+from ..utils.quote_cache import StaleResponse, get_cache
 
 
 class ConverterViewsTest(TestCase):
@@ -100,6 +108,71 @@ class ConverterViewsTest(TestCase):
         self.assertEqual(response_try.content.decode(
             'utf-8'), self.test_response_try)
 
+    async def test_async_get_payment_methods_as_select_options(self):
+        """Async view returns same select options HTML."""
+        request = RequestFactory().get(
+            f'/payment_methods/?from_currency={self.currency_rub.pk}')
+        with patch('converter.views.async_get_p2p_offers_data'
+                   ) as async_get_p2p_offers_data:
+            async_get_p2p_offers_data.return_value = self.from_json_response
+            response = await views.async_get_payment_methods(request)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.content.decode('utf-8'), self.test_response_rub)
+
+    async def test_async_get_payment_methods_records_off_loop(self):
+        """Popularity recorded outside of event loop thread."""
+        on_loop = []
+
+        def record_payment_methods_request(fiat_code: str) -> None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                on_loop.append(False)
+            else:
+                on_loop.append(True)
+
+        request = RequestFactory().get(
+            f'/payment_methods/?from_currency={self.currency_rub.pk}')
+        with patch('converter.views.async_get_p2p_offers_data',
+                   return_value=self.from_json_response), patch(
+                'converter.views.record_payment_methods_request',
+                side_effect=record_payment_methods_request) as record:
+            await views.async_get_payment_methods(request)
+        record.assert_called_once_with(self.currency_rub.code)
+        self.assertEqual(on_loop, [False])
+
+    def test_get_payment_methods_fresh_stored(self):
+        """Fresh stored payment methods served without request to binance."""
+        PaymentMethod.objects.create(
+            short_name='Payeer', display_name='Payeer',
+            currency=self.currency_rub)
+        with patch('converter.views.get_p2p_offers_data'
+                   ) as get_p2p_offers_data, patch(
+                'converter.views.run_in_background') as run_in_background:
+            response = self.guest_client.get(
+                f'/payment_methods/?from_currency={self.currency_rub.pk}')
+        get_p2p_offers_data.assert_not_called()
+        run_in_background.assert_not_called()
+        self.assertIn('Payeer', response.content.decode('utf-8'))
+
+    def test_get_payment_methods_stale_stored(self):
+        """Stale stored payment methods served and refreshed in background."""
+        payment_method = PaymentMethod.objects.create(
+            short_name='Payeer', display_name='Payeer',
+            currency=self.currency_rub)
+        PaymentMethod.objects.filter(pk=payment_method.pk).update(
+            date_updated=timezone.now() - timedelta(
+                seconds=settings.PAYMENT_METHODS_TTL + 1))
+        with patch('converter.views.get_p2p_offers_data'
+                   ) as get_p2p_offers_data, patch(
+                'converter.views.run_in_background') as run_in_background:
+            response = self.guest_client.get(
+                f'/payment_methods/?from_currency={self.currency_rub.pk}')
+        get_p2p_offers_data.assert_not_called()
+        run_in_background.assert_called_once()
+        self.assertIn('Payeer', response.content.decode('utf-8'))
+
     def test_get_payment_methods_empty_response(self):
         """Return error message in select option field."""
         with patch(
@@ -175,6 +248,11 @@ class ConverterViewsContextTest(TestCase):
             'from_amount': cls.from_amount,
             'is_merchant': True, }
 
+    def setUp(self):
+        get_cache().clear()
+        reset_cross_rates()
+        self.addCleanup(reset_cross_rates)
+
     def test_index_context(self):
         """Main page initial context."""
         response = self.guest_client.get(reverse('converter:index'))
@@ -199,8 +277,150 @@ class ConverterViewsContextTest(TestCase):
             self.assertEqual(response.context.get(
                 'from_amount'), self.from_amount)
             self.assertEqual(response.context.get(
+                'best_price_to_amount'), self.to_amount)
+            self.assertTrue(response.context.get('is_filled'))
+            self.assertLess(response.context.get(
                 'to_amount'), self.to_amount)
+            self.assertAlmostEqual(
+                response.context.get('effective_rate'),
+                self.from_amount / response.context.get('to_amount'))
+            self.assertIn(
+                f'to {response.context.get("to_amount")} ',
+                [str(message)
+                 for message in response.context['messages']][0])
             self.assertEqual(response.context.get(
                 'from_currency'), self.currency_rub)
             self.assertEqual(response.context.get(
                 'to_currency'), self.currency_try)
+
+    def test_get_offers_not_filled(self):
+        """Amount offers can't fill estimated with best prices."""
+        with patch('converter.utils.offers_utils.get_p2p_offers_data',
+                   side_effect=lambda fiat_code, **kwargs: (
+                       self.from_json_response if fiat_code == 'RUB'
+                       else self.to_json_response)):
+            response = self.guest_client.post(
+                reverse('converter:get_offers'),
+                {**self.data, 'from_amount': 10 ** 9})
+        self.assertFalse(response.context.get('is_filled'))
+        self.assertIsNone(response.context.get('effective_rate'))
+        self.assertEqual(response.context.get('to_amount'),
+                         response.context.get('best_price_to_amount'))
+        self.assertContains(response, 'Not enough offers to fill amount')
+
+    @override_settings(BINANCE_P2P_ASSETS=['USDT', 'BTC'])
+    def test_get_offers_best_asset(self):
+        """Conversions through all assets compared in best of mode."""
+        with patch('converter.utils.offers_utils.get_p2p_offers_data',
+                   side_effect=lambda fiat_code, **kwargs: (
+                       self.from_json_response if fiat_code == 'RUB'
+                       else self.to_json_response)) as get_p2p_offers_data:
+            response = self.guest_client.post(
+                reverse('converter:get_offers'),
+                {**self.data, 'asset': 'BEST'})
+        self.assertEqual(
+            {call.kwargs['asset']
+             for call in get_p2p_offers_data.call_args_list},
+            {'USDT', 'BTC'})
+        asset_conversions = response.context.get('asset_conversions')
+        self.assertEqual(
+            {conversion['asset'] for conversion in asset_conversions},
+            {'USDT', 'BTC'})
+        self.assertEqual(asset_conversions[0]['from_amount'],
+                         self.from_amount)
+        self.assertEqual(response.context.get('asset'), 'USDT')
+        self.assertContains(response, 'Conversions through assets')
+
+    def test_get_offers_stale_data_warning(self):
+        """Stale offers rendered with warning about their age."""
+        with patch('converter.utils.offers_utils.get_p2p_offers_data'
+                   ) as get_p2p_offers_data:
+            get_p2p_offers_data.side_effect = [
+                StaleResponse(self.from_json_response, 600),
+                self.to_json_response,
+                self.to_json_response, ]
+            response = self.guest_client.post(
+                reverse('converter:get_offers'), self.data)
+        self.assertEqual(response.context.get('data_age'), 600)
+        self.assertIn(
+            'showing offers 10 minutes old',
+            [str(message) for message in response.context['messages']][0])
+
+    def test_upstream_status(self):
+        """Circuit breakers and cache counters returned."""
+        response = self.guest_client.get(reverse('converter:upstream_status'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('circuit_breakers', response.json())
+        self.assertIn('hits', response.json()['quote_cache'])
+
+    def test_cross_rates(self):
+        """Matrix of all pairs and single pair rate returned."""
+        with patch('converter.utils.cross_rates.run_in_background'
+                   ) as run_in_background:
+            response = self.guest_client.get(reverse('converter:cross_rates'))
+        self.assertEqual(response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        run_in_background.assert_called_once()
+
+        with patch('converter.utils.cross_rates.get_p2p_offers_data',
+                   side_effect=lambda trade_type, **kwargs: (
+                       self.from_json_response if trade_type == 'BUY'
+                       else self.to_json_response)):
+            build_cross_rates()
+        response = self.guest_client.get(reverse('converter:cross_rates'))
+        self.assertEqual(response.json()['currencies'], ['RUB', 'TRY'])
+        self.assertEqual(len(response.json()['rates']), 2)
+        response = self.guest_client.get(
+            reverse('converter:cross_rate', args=('rub', 'try')))
+        self.assertAlmostEqual(response.json()['rate'], 18.35 / 59.79)
+        response = self.guest_client.get(
+            reverse('converter:cross_rate', args=('RUB', 'XXX')))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_route(self):
+        """Best route and expected amount returned."""
+        with patch('converter.utils.routes.get_p2p_offers_data',
+                   side_effect=lambda trade_type, **kwargs: (
+                       self.from_json_response if trade_type == 'BUY'
+                       else self.to_json_response)) as get_p2p_offers_data:
+            response = self.guest_client.get(reverse('converter:route'), {
+                'from_currency': 'rub', 'to_currency': 'try',
+                'amount': 20000})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        route = response.json()
+        self.assertEqual(route['path'][::2], ['RUB', 'TRY'])
+        self.assertEqual(len(route['hops']), 2)
+        self.assertAlmostEqual(route['from_amount'], 20000)
+        self.assertEqual(
+            get_p2p_offers_data.call_count,
+            2 * len(settings.BINANCE_P2P_ROUTE_ASSETS))
+        response = self.guest_client.get(reverse('converter:route'), {
+            'from_currency': 'RUB', 'to_currency': 'TRY', 'amount': 'x'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_route_books_unavailable(self):
+        """Unavailable route books answered with error, not 500."""
+        with patch('converter.utils.routes.get_p2p_offers_data',
+                   side_effect=requests.ConnectionError('connection reset')):
+            response = self.guest_client.get(reverse('converter:route'), {
+                'from_currency': 'rub', 'to_currency': 'try',
+                'amount': 20000})
+        self.assertEqual(
+            response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertIn('error', response.json())
+
+    def test_popular_pairs(self):
+        """Requested conversion pair returned as popular."""
+        with patch('converter.utils.offers_utils.get_p2p_offers_data'
+                   ) as get_p2p_offers_data:
+            get_p2p_offers_data.side_effect = self.side_effect
+            self.guest_client.post(reverse('converter:get_offers'), self.data)
+        response = self.guest_client.get(reverse('converter:popular'))
+        self.assertIn(
+            {
+                'from_currency': self.currency_rub.code,
+                'from_payment_method': self.payment_method_rub.short_name,
+                'to_currency': self.currency_try.code,
+                'to_payment_method': self.payment_method_try.short_name,
+            },
+            [{key: value for key, value in pair.items() if key != 'count'}
+             for pair in response.json()['pairs']])
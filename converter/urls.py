@@ -1,15 +1,30 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 app_name = 'converter'
 
+if settings.CONVERTER_ASYNC_VIEWS:
+    get_payment_methods = views.async_get_payment_methods
+    get_offers = views.async_get_offers
+else:
+    get_payment_methods = views.get_payment_methods
+    get_offers = views.get_offers
+
 urlpatterns = [
     path('payment_methods/',
-         views.get_payment_methods,
+         get_payment_methods,
          name='payment_methods'),
     path('get_offers/',
-         views.get_offers,
+         get_offers,
          name='get_offers'),
+    path('popular/', views.get_popular, name='popular'),
+    path('status/', views.get_upstream_status, name='upstream_status'),
+    path('route/', views.get_route, name='route'),
+    path('cross_rates/', views.get_cross_rates_matrix, name='cross_rates'),
+    path('cross_rates/<str:from_code>/<str:to_code>/',
+         views.get_cross_rate,
+         name='cross_rate'),
     path('', views.index, name='index'),
 ]
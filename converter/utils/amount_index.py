@@ -0,0 +1,115 @@
+"""Index of offers by their single transaction amount limits."""
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import List, Tuple
+
+from django.conf import settings
+
+from ..models import DEFAULT_ASSET
+from .offer_book import OfferBook
+
+logger = logging.getLogger(__name__)
+
+INDEX_LIMIT = 1000
+
+
+class AmountIndex():
+    """Offers of unfiltered book, answering which accept any fiat amount.
+
+    Offer accepts amount inside its [min_amount, max_amount] interval.
+    Lower ends of intervals are kept sorted with their rows and upper
+    ends are kept sorted, so number of offers accepting amount is found
+    with two binary searches, and only offers with lower end below
+    amount are checked for upper one.
+    """
+
+    def __init__(self, book: OfferBook) -> None:
+        self.book = book
+        self.built_at = time.monotonic()
+        rows = sorted(range(len(book)), key=book.min_amount.__getitem__)
+        self.min_rows = array('l', rows)
+        self.min_amounts = array('d', (book.min_amount[row] for row in rows))
+        self.max_amounts = array('d', sorted(book.max_amount))
+
+    def __len__(self) -> int:
+        return len(self.book)
+
+    @property
+    def age(self) -> float:
+        """Seconds since index was built."""
+        return time.monotonic() - self.built_at
+
+    def count(self, amount: float) -> int:
+        """Number of offers accepting amount."""
+        return (bisect_right(self.min_amounts, amount)
+                - bisect_left(self.max_amounts, amount))
+
+    def get_rows(self, amount: float = None, is_merchant: bool = False,
+                 rows: int = None) -> List[int]:
+        """Get book rows of offers accepting amount, from best one.
+
+        Any amount is accepted if amount is None, only merchant offers
+        are returned if is_merchant set. At most rows rows returned.
+        """
+        book = self.book
+        if amount is None:
+            candidates = range(len(book))
+        elif self.count(amount) <= 0:
+            return []
+        else:
+            candidates = sorted(
+                row for row in self.min_rows[
+                    :bisect_right(self.min_amounts, amount)]
+                if book.max_amount[row] >= amount)
+        if is_merchant:
+            candidates = [row for row in candidates if book.is_merchant[row]]
+        return list(candidates[:rows])
+
+    def query(self, amount: float = None, is_merchant: bool = False,
+              rows: int = None) -> OfferBook:
+        """Get book of offers accepting amount, like binance search."""
+        return self.book.take(self.get_rows(amount, is_merchant, rows))
+
+
+_indexes: 'OrderedDict[Tuple[str, str, str, str], AmountIndex]' = (
+    OrderedDict())
+_indexes_lock = threading.Lock()
+
+
+def get_index(fiat_code: str, payment_method: str, trade_type: str,
+              asset: str = DEFAULT_ASSET) -> AmountIndex:
+    """Return index, if it was built less than TTL seconds ago."""
+    key = (fiat_code, payment_method, trade_type, asset)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            return None
+        if index.age > settings.BINANCE_P2P_AMOUNT_INDEX_TTL:
+            del _indexes[key]
+            return None
+        _indexes.move_to_end(key)
+        return index
+
+
+def set_index(fiat_code: str, payment_method: str, trade_type: str,
+              index: AmountIndex, asset: str = DEFAULT_ASSET) -> None:
+    """Store index, least recently used ones are dropped over limit."""
+    key = (fiat_code, payment_method, trade_type, asset)
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > INDEX_LIMIT:
+            _indexes.popitem(last=False)
+    logger.debug(
+        f'indexed {len(index)} {trade_type} {fiat_code}'
+        f'[{payment_method}] {asset} offers')
+
+
+def reset_indexes() -> None:
+    """Drop all indexes."""
+    with _indexes_lock:
+        _indexes.clear()
@@ -0,0 +1,54 @@
+"""Background tasks running in worker process."""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Hashable, Set
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_executor: ThreadPoolExecutor = None
+_pending: Set[Hashable] = set()
+_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return process-wide thread pool for background tasks."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.BINANCE_P2P_BACKGROUND_WORKERS,
+                    thread_name_prefix='binance-p2p-background')
+    return _executor
+
+
+def run_in_background(key: Hashable, task: Callable[[], None]) -> Future:
+    """Run task in background unless task with same key is pending.
+
+    Task exceptions are logged, database connections of background
+    thread are closed after task. Returns future or None if task with
+    same key is already pending.
+    """
+    with _lock:
+        if key in _pending:
+            logger.debug(f'background task {key} already pending')
+            return None
+        _pending.add(key)
+
+    def run() -> None:
+        close_old_connections()
+        try:
+            task()
+        except Exception:
+            logger.exception(f'background task {key} failed')
+        finally:
+            close_old_connections()
+            with _lock:
+                _pending.discard(key)
+
+    logger.debug(f'scheduling background task {key}')
+    return get_executor().submit(run)
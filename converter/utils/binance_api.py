@@ -1,76 +1,394 @@
 """Methods to work with Binance api."""
 
+import atexit
+import json
 import logging
+import os
+import random
+import threading
+import time
 from http import HTTPStatus
 
 import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 
-from ..exceptions import ApiUnavailableError
-from ..models import TradeType
+from ..exceptions import ApiUnavailableError, RateLimitedError
+from ..models import DEFAULT_ASSET, TradeType
+from .background import run_in_background
+from .circuit_breaker import get_circuit_breaker
+from .last_known_good import last_known_good
+from .quote_cache import (StaleResponse, filter_response_by_amount,
+                          get_cached_response, make_cache_key,
+                          quantize_amount, set_cached_response)
+from .rate_limiter import Priority, get_rate_limiter
+from .reference_prices import update_from_response
+from .single_flight import SingleFlight
+from .transport import RecordingTransport, ReplayTransport
 
 logger = logging.getLogger(__name__)
 
+ENDPOINT_PATHS = {
+    'search': '/bapi/c2c/v2/friendly/c2c/adv/search',
+}
+RETRY_STATUSES = frozenset({
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+})
+
+DEFAULT_HEADERS = {
+    'Accept': '*/*',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'lang': 'en',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'content-type': 'application/json',
+    'Origin': 'https://p2p.binance.com',
+    'Pragma': 'no-cache',
+    'TE': 'trailers',
+    'User-Agent':
+    'Mozilla/5.0 (Windows NT 10.0; rv:102.0) Gecko/20100101 Firefox/102.0',
+}
+
+in_flight_requests = SingleFlight()
+
+_session: requests.Session = None
+_session_pid: int = None
+_session_lock = threading.Lock()
+
+
+def _create_session() -> requests.Session:
+    """Create session with connection pool.
+
+    Retries are made by _post, so they share backoff and circuit breaker.
+    """
+    adapter = HTTPAdapter(
+        pool_connections=settings.BINANCE_P2P_POOL_CONNECTIONS,
+        pool_maxsize=settings.BINANCE_P2P_POOL_MAXSIZE,
+        max_retries=0,
+    )
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return process-wide session, create it on first use.
+
+    Session is bound to process that created it, so every gunicorn
+    worker gets its own connection pool after fork.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            logger.debug(f'creating binance session for process {pid}')
+            _session = _create_session()
+            _session_pid = pid
+    return _session
+
+
+def close_session() -> None:
+    """Close process-wide session and release pooled connections."""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is not None and _session_pid == os.getpid():
+            _session.close()
+        _session = None
+        _session_pid = None
+
+
+def _reset_session_after_fork() -> None:
+    """Drop session inherited from parent process without closing sockets."""
+    global _session, _session_pid, _session_lock
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+
+
+atexit.register(close_session)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_session_after_fork)
+
+
+def get_transport():
+    """Get transport of binance requests selected by settings.
+
+    Live transport is pooled session, record transport saves its
+    responses to fixtures, replay transport serves them offline.
+    """
+    transport = settings.BINANCE_P2P_TRANSPORT
+    if transport == 'replay':
+        return ReplayTransport(settings.BINANCE_P2P_FIXTURES_DIR)
+    if transport == 'record':
+        return RecordingTransport(
+            get_session(), settings.BINANCE_P2P_FIXTURES_DIR)
+    return get_session()
+
+
+def get_endpoint_url(endpoint: str) -> str:
+    """Get url of binance endpoint."""
+    base_url = settings.BINANCE_P2P_BASE_URL.rstrip('/')
+    return base_url + ENDPOINT_PATHS[endpoint]
+
 
 def get_p2p_offers_data(fiat_code: str,
                         is_merchant: bool = False,
                         payment_method: str = None,
                         trans_amount: float = None,
                         trade_type: str = TradeType.BUY,
-                        rows: int = 10) -> str:
+                        rows: int = 10,
+                        page: int = 1,
+                        force_refresh: bool = False,
+                        priority: Priority = Priority.INTERACTIVE,
+                        asset: str = DEFAULT_ASSET) -> str:
     """Make request to binance p2p api.
 
+    Responses are cached for BINANCE_P2P_CACHE_TTL seconds, amounts
+    are bucketed in request and cache key, so nearby amounts share
+    cached response, offers not accepting amount itself are dropped.
+    Expired responses are served while refreshed in background.
+    Concurrent identical requests are coalesced into one upstream call.
+    If binance is unavailable, last known good response is returned as
+    StaleResponse with its age.
+    Requests to binance are rate limited across worker processes,
+    requests of higher priority are sent first.
+
     Args:
         is_merchant (bool): is seller certified merchant
         payment_method (PaymentMethod): Payment method for selected currency
         trans_amount (int): Amount of fiat currency to buy or sell
         fiat (Currency): Fiat currency to buy or sell
         trade_type (str): BUY or SELL, BUY means buy USDT from seller
+        rows (int): offers per page, binance returns at most 20
+        page (int): number of page, starting from 1
+        force_refresh (bool): skip cached response, but store fresh one
+        priority (Priority): priority class of request in rate limiter
+        asset (str): crypto asset to buy or sell for fiat
 
     Returns:
         response text (str): JSON response text
     """
+    data = _get_search_data(fiat_code, is_merchant, payment_method,
+                            trans_amount, trade_type, rows, page, asset)
+    cache_key = make_cache_key(data)
+    if not force_refresh:
+        response_text = _get_cached_response(data, cache_key)
+        if response_text is not None:
+            return filter_response_by_amount(response_text, trans_amount)
+
+    try:
+        response_text = _request_offers_once(data, cache_key, priority)
+    except ApiUnavailableError as e:
+        response_text = _get_last_known_good_response(cache_key, e)
+    return filter_response_by_amount(response_text, trans_amount)
+
+
+async def async_get_p2p_offers_data(fiat_code: str,
+                                    is_merchant: bool = False,
+                                    payment_method: str = None,
+                                    trans_amount: float = None,
+                                    trade_type: str = TradeType.BUY,
+                                    rows: int = 10,
+                                    page: int = 1,
+                                    force_refresh: bool = False,
+                                    priority: Priority = Priority.INTERACTIVE,
+                                    asset: str = DEFAULT_ASSET) -> str:
+    """Make request to binance p2p api without blocking event loop.
+
+    Same as get_p2p_offers_data. Blocking request through pooled
+    session runs in thread pool, identical concurrent requests from
+    coroutines are coalesced into one.
+    """
+    data = _get_search_data(fiat_code, is_merchant, payment_method,
+                            trans_amount, trade_type, rows, page, asset)
+    cache_key = make_cache_key(data)
+    if not force_refresh:
+        response_text = await sync_to_async(
+            _get_cached_response, thread_sensitive=False)(data, cache_key)
+        if response_text is not None:
+            return filter_response_by_amount(response_text, trans_amount)
+
+    try:
+        response_text = await in_flight_requests.do_async(
+            cache_key,
+            lambda: sync_to_async(_request_offers, thread_sensitive=False)(
+                data, cache_key, priority))
+    except ApiUnavailableError as e:
+        response_text = await sync_to_async(
+            _get_last_known_good_response, thread_sensitive=False)(
+                cache_key, e)
+    return filter_response_by_amount(response_text, trans_amount)
+
+
+def _get_cached_response(data: dict, cache_key: str) -> str:
+    """Return cached response text, refresh expired one in background."""
+    cached = get_cached_response(cache_key)
+    if cached is None:
+        return None
+    response_text, age = cached
+    if age > settings.BINANCE_P2P_CACHE_TTL:
+        logger.debug(f'returning expired response ({age:.0f}s old)')
+        run_in_background(
+            ('p2p_search', cache_key),
+            lambda: _request_offers_once(
+                data, cache_key, Priority.BACKGROUND))
+    else:
+        logger.debug('returning cached response')
+    return response_text
+
+
+def _get_last_known_good_response(cache_key: str,
+                                  error: ApiUnavailableError
+                                  ) -> StaleResponse:
+    """Return last known good response or raise error if there is none."""
+    stored = last_known_good.get(cache_key)
+    if stored is None or stored[1] > settings.BINANCE_P2P_LKG_MAX_AGE:
+        raise error
+    response_text, age = stored
+    logger.warning(f'returning last known good response ({age:.0f}s old)')
+    return StaleResponse(response_text, age)
+
+
+def _request_offers_once(data: dict, cache_key: str,
+                         priority: Priority = Priority.INTERACTIVE) -> str:
+    """Request offers, coalescing concurrent identical requests."""
+    return in_flight_requests.do(
+        cache_key, lambda: _request_offers(data, cache_key, priority))
+
+
+# Binance returns at most this many offers per page.
+MAX_ROWS = 20
+
+
+def _get_search_data(fiat_code: str, is_merchant: bool, payment_method: str,
+                     trans_amount: float, trade_type: str,
+                     rows: int, page: int = 1,
+                     asset: str = DEFAULT_ASSET) -> dict:
+    """Make search request payload."""
     logger.debug(
         f'making request for ({trans_amount}){fiat_code}'
-        f'[{payment_method}], trade type {trade_type}'
+        f'[{payment_method}], trade type {trade_type} {asset}'
         f' merchant = {is_merchant}')
-    data = {
-        'page': 1,
+    return {
+        'page': page,
         'rows': rows,
         'payTypes': [payment_method] if payment_method else [],
         'countries': [],
         'publisherType': 'merchant' if is_merchant else None,
-        'transAmount': trans_amount,
-        'asset': 'USDT',
+        'transAmount': quantize_amount(trans_amount),
+        'asset': asset,
         'fiat': fiat_code,
         'tradeType': trade_type,
     }
 
-    headers = {
-        'Accept': '*/*',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'lang': 'en',
-        'Cache-Control': 'no-cache',
-        'Connection': 'keep-alive',
-        'Content-Length': '146',
-        'content-type': 'application/json',
-        'Host': 'p2p.binance.com',
-        'Origin': 'https://p2p.binance.com',
-        'Pragma': 'no-cache',
-        'TE': 'trailers',
-        'User-Agent':
-        'Mozilla/5.0 (Windows NT 10.0; rv:102.0) Gecko/20100101 Firefox/102.0',
-    }
-    response = requests.post(
-        'https://p2p.binance.com/bapi/c2c/v2/friendly/c2c/adv/search',
-        headers=headers,
-        json=data)
-
-    if response.status_code != HTTPStatus.OK:
-        error_message = (
-            f'Binance P2P Api Unavailable. '
-            f'Status code: {response.status_code}')
-        logger.exception(error_message)
-        raise ApiUnavailableError(error_message)
-
-    return response.text
+
+def _has_offers(response_text: str) -> bool:
+    """Check response is successful and has offers."""
+    try:
+        response = json.loads(response_text)
+        return bool(response['success'] and response['data'])
+    except (ValueError, TypeError, KeyError):
+        return False
+
+
+def _request_offers(data: dict, cache_key: str,
+                    priority: Priority = Priority.INTERACTIVE) -> str:
+    """Post search request to binance and store response text.
+
+    Only successful responses with offers are cached and become last
+    known good ones. Background refreshes also update reference prices,
+    responses of other requests update them when parsed.
+    """
+    response_text = _post('search', data, priority)
+    if _has_offers(response_text):
+        set_cached_response(cache_key, response_text)
+        last_known_good.put(cache_key, response_text)
+    if priority == Priority.BACKGROUND:
+        update_from_response(data, response_text)
+    return response_text
+
+
+def _get_backoff(attempt: int) -> float:
+    """Get delay before retry, exponential backoff with full jitter."""
+    return random.uniform(0, min(
+        settings.BINANCE_P2P_BACKOFF_MAX,
+        settings.BINANCE_P2P_BACKOFF_FACTOR * 2 ** attempt))
+
+
+def _wait_for_rate_limit(priority: Priority) -> None:
+    """Wait until request is allowed by rate limiter.
+
+    Raise RateLimitedError if it is not allowed within wait time
+    of its priority.
+    """
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is None:
+        return
+    timeout = settings.BINANCE_P2P_RATE_LIMIT_WAIT[priority.name.lower()]
+    if not rate_limiter.acquire(timeout=timeout, priority=priority):
+        logger.warning(f'{priority.name} request rate limited')
+        raise RateLimitedError(
+            'Binance P2P Api Unavailable. Too many requests.')
+
+
+def _post(endpoint: str, data: dict,
+          priority: Priority = Priority.INTERACTIVE) -> str:
+    """Post data to binance endpoint and return response text.
+
+    Requests have per-endpoint timeouts and are retried with backoff
+    on timeouts, connection errors and retryable statuses. Every
+    attempt waits for rate limiter. Other request errors are not
+    retried. Raise ApiUnavailableError when retries are exhausted or
+    request failed, RateLimitedError if rate limit is not freed in
+    time, or CircuitOpenError without request if endpoint keeps
+    failing.
+    """
+    breaker = get_circuit_breaker(endpoint)
+    breaker.before_request()
+    attempts = settings.BINANCE_P2P_MAX_RETRIES + 1
+    for attempt in range(attempts):
+        try:
+            _wait_for_rate_limit(priority)
+        except RateLimitedError:
+            breaker.release()
+            raise
+        try:
+            response = get_transport().post(
+                get_endpoint_url(endpoint),
+                json=data,
+                timeout=settings.BINANCE_P2P_TIMEOUTS[endpoint])
+        except (requests.Timeout, requests.ConnectionError) as e:
+            error_message = f'Binance P2P Api Unavailable. {e}'
+            is_retryable = True
+        except requests.RequestException as e:
+            error_message = f'Binance P2P Api Unavailable. {e}'
+            is_retryable = False
+        except Exception:
+            breaker.release()
+            raise
+        else:
+            if response.status_code == HTTPStatus.OK:
+                breaker.record_success()
+                return response.text
+            error_message = (
+                f'Binance P2P Api Unavailable. '
+                f'Status code: {response.status_code}')
+            is_retryable = response.status_code in RETRY_STATUSES
+        if not is_retryable or attempt + 1 == attempts:
+            break
+        logger.warning(f'{error_message}, retrying')
+        time.sleep(_get_backoff(attempt))
+
+    breaker.record_failure()
+    logger.error(error_message)
+    raise ApiUnavailableError(error_message)
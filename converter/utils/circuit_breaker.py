@@ -0,0 +1,126 @@
+"""Circuit breaker for upstream endpoints."""
+import logging
+import threading
+import time
+from typing import Dict
+
+from django.conf import settings
+
+from ..exceptions import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker():
+    """Fail fast after consecutive failures of endpoint.
+
+    Closed breaker lets all requests through. After failure_threshold
+    consecutive failures breaker opens and rejects requests for
+    recovery_timeout seconds, then half-opens and lets one probe request
+    through. Successful probe closes breaker, failed one opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int,
+                 recovery_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at: float = None
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(
+                f'circuit breaker {self.name}: {self.state} -> {state}')
+            self.state = state
+
+    def before_request(self) -> None:
+        """Raise CircuitOpenError if request is not allowed."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(
+                        f'Binance P2P Api Unavailable. '
+                        f'Circuit breaker {self.name} is open.')
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(
+                        f'Binance P2P Api Unavailable. '
+                        f'Circuit breaker {self.name} is half open.')
+                self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._probe_in_flight = False
+            self._set_state(self.CLOSED)
+
+    def release(self) -> None:
+        """Give up allowed request without sending it."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if (self.state == self.HALF_OPEN
+                    or self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.rejected = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+            self.state = self.CLOSED
+
+    def snapshot(self) -> dict:
+        """Return current state of breaker."""
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'open_for': (
+                    time.monotonic() - self.opened_at
+                    if self.state != self.CLOSED and self.opened_at
+                    else None),
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Return process-wide circuit breaker of endpoint."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=(
+                    settings.BINANCE_P2P_BREAKER_FAILURE_THRESHOLD),
+                recovery_timeout=(
+                    settings.BINANCE_P2P_BREAKER_RECOVERY_TIMEOUT))
+        return _breakers[name]
+
+
+def get_circuit_breakers_state() -> Dict[str, dict]:
+    """Return state of all circuit breakers in process."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,207 @@
+"""Indicative cross rates of all currency pairs through USDT."""
+import logging
+import math
+import threading
+import time
+from array import array
+from concurrent.futures import TimeoutError, wait
+from typing import Dict, List, Sequence, Tuple
+
+from django.conf import settings
+
+from ..exceptions import (ApiUnavailableError, BinanceApiError,
+                          OffersNotFoundError)
+from ..models import Currency, TradeType
+from .background import run_in_background
+from .binance_api import get_p2p_offers_data
+from .json_parser import get_raw_offers_from_json
+from .offers_utils import get_executor
+from .quote_cache import get_cache
+from .rate_limiter import Priority
+from .reference_prices import get_reference_price
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'cross_rates:version'
+COUNTER_KEY = 'cross_rates:counter'
+SNAPSHOT_KEY = 'cross_rates:snapshot:{}'
+
+
+class CrossRates():
+    """Rates of all pairs of currencies, snapshot of one build.
+
+    Best BUY price of currency is its amount paid for one USDT, best
+    SELL price is its amount got for one USDT, so one unit of currency
+    i converts to sell[j] / buy[i] units of currency j. Matrix is outer
+    product of inverted BUY prices and SELL prices, stored in flat
+    row-major array, so rate of pair is read by index arithmetic.
+    Rates of currencies without price are nan.
+    """
+
+    def __init__(self, codes: Sequence[str], buy_prices: Sequence[float],
+                 sell_prices: Sequence[float], version: int = 0,
+                 created_at: float = None) -> None:
+        self.codes: List[str] = list(codes)
+        self.indexes: Dict[str, int] = {
+            code: index for index, code in enumerate(self.codes)}
+        self.buy_prices = array('d', buy_prices)
+        self.sell_prices = array('d', sell_prices)
+        self.version = version
+        self.created_at = time.time() if created_at is None else created_at
+        inverted_buy_prices = array('d', (
+            1 / price if price > 0 else math.nan
+            for price in self.buy_prices))
+        self.rates = array('d')
+        for inverted_price in inverted_buy_prices:
+            self.rates.extend(
+                inverted_price * price for price in self.sell_prices)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def age(self) -> float:
+        """Seconds since snapshot was built."""
+        return time.time() - self.created_at
+
+    def get_rate(self, from_code: str, to_code: str) -> float:
+        """Get units of to_code currency for one unit of from_code one.
+
+        Raise KeyError for unknown currency, return None if there is no
+        price of currency.
+        """
+        rate = self.rates[
+            self.indexes[from_code] * len(self) + self.indexes[to_code]]
+        return None if math.isnan(rate) else rate
+
+    def get_row(self, index: int) -> List[float]:
+        """Get rates from currency in row index to all currencies."""
+        row = self.rates[index * len(self):(index + 1) * len(self)]
+        return [None if math.isnan(rate) else rate for rate in row]
+
+    def as_dict(self) -> dict:
+        return {
+            'version': self.version,
+            'created_at': self.created_at,
+            'age': self.age,
+            'currencies': self.codes,
+            'buy_prices': [
+                None if math.isnan(price) else price
+                for price in self.buy_prices],
+            'sell_prices': [
+                None if math.isnan(price) else price
+                for price in self.sell_prices],
+            'rates': [self.get_row(index) for index in range(len(self))],
+        }
+
+
+_snapshot: CrossRates = None
+_snapshot_lock = threading.Lock()
+
+
+def get_liquid_currency_codes() -> List[str]:
+    """Get codes of currencies having payment methods."""
+    return list(Currency.objects.filter(
+        payment_methods__isnull=False).distinct().order_by(
+            'code').values_list('code', flat=True))
+
+
+def get_best_price(fiat_code: str, trade_type: str) -> float:
+    """Get best price of order book without filters.
+
+    Fresh reference price is used if there is one, otherwise first
+    offer is requested.
+    """
+    price = get_reference_price(fiat_code, None, trade_type)
+    if price is not None:
+        return price
+    response_text = get_p2p_offers_data(
+        fiat_code=fiat_code, trade_type=trade_type, rows=1,
+        priority=Priority.BACKGROUND)
+    return float(get_raw_offers_from_json(response_text)[0]['adv']['price'])
+
+
+def fetch_best_prices(codes: Sequence[str]
+                      ) -> Dict[Tuple[str, str], float]:
+    """Get best BUY and SELL prices of currencies concurrently.
+
+    Price is nan if it was not fetched in BINANCE_P2P_FETCH_DEADLINE.
+    """
+    futures = {
+        (code, trade_type): get_executor().submit(
+            get_best_price, code, trade_type)
+        for code in codes for trade_type in (TradeType.BUY, TradeType.SELL)}
+    wait(futures.values(), timeout=settings.BINANCE_P2P_FETCH_DEADLINE)
+    prices = {}
+    for key, future in futures.items():
+        try:
+            prices[key] = future.result(timeout=0)
+        except (ApiUnavailableError, BinanceApiError, OffersNotFoundError,
+                TimeoutError) as e:
+            future.cancel()
+            logger.warning(f'no cross rate price of {key}: {e!r}')
+            prices[key] = math.nan
+    return prices
+
+
+def build_cross_rates() -> CrossRates:
+    """Fetch prices of liquid currencies and publish new snapshot.
+
+    Currencies are fetched once per trade type, N currencies cost 2N
+    requests instead of conversion of every pair. Snapshot is stored in
+    quote cache under next version, then version pointer is moved to it.
+    """
+    codes = get_liquid_currency_codes()
+    prices = fetch_best_prices(codes)
+    cache = get_cache()
+    cache.add(COUNTER_KEY, 0, None)
+    version = cache.incr(COUNTER_KEY)
+    snapshot = CrossRates(
+        codes,
+        [prices[code, TradeType.BUY] for code in codes],
+        [prices[code, TradeType.SELL] for code in codes],
+        version=version)
+    timeout = settings.BINANCE_P2P_CROSS_RATES_MAX_AGE
+    cache.set(SNAPSHOT_KEY.format(version), snapshot, timeout)
+    cache.set(VERSION_KEY, version, timeout)
+    _set_local_snapshot(snapshot)
+    logger.info(
+        f'built cross rates version {version} of {len(codes)} currencies')
+    return snapshot
+
+
+def _set_local_snapshot(snapshot: CrossRates) -> None:
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None or snapshot.created_at >= _snapshot.created_at:
+            _snapshot = snapshot
+
+
+def get_cross_rates() -> CrossRates:
+    """Return current snapshot, or None if it was not built yet.
+
+    Snapshot is loaded from quote cache only when its version changes.
+    Rebuild is scheduled in background if snapshot is older than
+    BINANCE_P2P_CROSS_RATES_INTERVAL or missing.
+    """
+    version = get_cache().get(VERSION_KEY)
+    snapshot = _snapshot
+    if version is not None and (
+            snapshot is None or snapshot.version != version):
+        snapshot = get_cache().get(SNAPSHOT_KEY.format(version))
+        if snapshot is not None:
+            _set_local_snapshot(snapshot)
+    if snapshot is not None and (
+            snapshot.age > settings.BINANCE_P2P_CROSS_RATES_MAX_AGE):
+        snapshot = None
+    if snapshot is None or (
+            snapshot.age > settings.BINANCE_P2P_CROSS_RATES_INTERVAL):
+        run_in_background('cross_rates', build_cross_rates)
+    return snapshot
+
+
+def reset_cross_rates() -> None:
+    """Drop snapshot of this process."""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
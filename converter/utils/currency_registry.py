@@ -0,0 +1,112 @@
+"""In-process registry of currencies."""
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+from django.conf import settings
+from django.http import Http404
+
+from ..models import Currency
+
+logger = logging.getLogger(__name__)
+
+# Lookups of unknown currencies reload registry at most once per
+# this many seconds.
+MISS_RELOAD_INTERVAL = 5
+
+
+class CurrencyRegistry():
+    """Currencies by code and pk, loaded from database once.
+
+    Registry is invalidated by Currency save/delete signals, reloaded
+    after BINANCE_P2P_CURRENCY_REGISTRY_TTL seconds to pick up changes
+    made by other processes, and on lookup of unknown currency, at most
+    once per MISS_RELOAD_INTERVAL seconds. Lookups read snapshot of
+    loaded currencies, so concurrent invalidation does not affect them.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._by_code: Dict[str, Currency] = None
+        self._by_pk: Dict[int, Currency] = None
+        self._loaded_at: float = None
+        self._generation = 0
+
+    def load(self) -> Tuple[Dict[str, Currency], Dict[int, Currency]]:
+        """Load all currencies from database, return them by code and pk.
+
+        Currencies loaded before concurrent invalidation are returned,
+        but not kept.
+        """
+        with self._lock:
+            generation = self._generation
+        currencies = list(Currency.objects.all())
+        by_code = {currency.code: currency for currency in currencies}
+        by_pk = {currency.pk: currency for currency in currencies}
+        with self._lock:
+            if generation == self._generation:
+                self._by_code = by_code
+                self._by_pk = by_pk
+                self._loaded_at = time.monotonic()
+        logger.debug(f'loaded {len(currencies)} currencies')
+        return by_code, by_pk
+
+    def invalidate(self) -> None:
+        """Drop loaded currencies, they are reloaded on next lookup."""
+        with self._lock:
+            self._by_code = None
+            self._by_pk = None
+            self._loaded_at = None
+            self._generation += 1
+
+    def _get_loaded(self) -> Tuple[Dict[str, Currency], Dict[int, Currency],
+                                   float]:
+        """Return loaded currencies and time they were loaded.
+
+        Currencies are reloaded if they are stale or missing.
+        """
+        with self._lock:
+            by_code, by_pk, loaded_at = (
+                self._by_code, self._by_pk, self._loaded_at)
+        if (loaded_at is None or time.monotonic() - loaded_at
+                > settings.BINANCE_P2P_CURRENCY_REGISTRY_TTL):
+            by_code, by_pk = self.load()
+            loaded_at = time.monotonic()
+        return by_code, by_pk, loaded_at
+
+    def _lookup(self, by: str, key) -> Currency:
+        by_code, by_pk, loaded_at = self._get_loaded()
+        currency = (by_code if by == 'code' else by_pk).get(key)
+        if (currency is None
+                and time.monotonic() - loaded_at > MISS_RELOAD_INTERVAL):
+            by_code, by_pk = self.load()
+            currency = (by_code if by == 'code' else by_pk).get(key)
+        if currency is None:
+            raise Currency.DoesNotExist(f'Currency {key} does not exist.')
+        return currency
+
+    def get_by_code(self, code: str) -> Currency:
+        """Return currency by code or raise Currency.DoesNotExist."""
+        return self._lookup('code', code)
+
+    def get_by_pk(self, pk) -> Currency:
+        """Return currency by pk or raise Currency.DoesNotExist."""
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise Currency.DoesNotExist(f'Currency {pk} does not exist.')
+        return self._lookup('pk', pk)
+
+
+currency_registry = CurrencyRegistry()
+
+
+def get_currency_or_404(code: str = None, pk=None) -> Currency:
+    """Return currency by code or pk from registry, raise Http404 if missing."""
+    try:
+        if code is not None:
+            return currency_registry.get_by_code(code)
+        return currency_registry.get_by_pk(pk)
+    except Currency.DoesNotExist as e:
+        raise Http404(str(e)) from e
@@ -1,20 +1,28 @@
 """Package for processing offers from JSON."""
+import heapq
 import json
 import logging
-from typing import List
+from operator import itemgetter
+from typing import Dict, Iterable, List, Tuple, Union
 
-from django.db.models.query import QuerySet
-from django.shortcuts import get_object_or_404
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
+from django.utils import timezone
 
 from ..exceptions import BinanceApiError, OffersNotFoundError
 from ..models import Currency, Offer, PaymentMethod, Seller, TradeType
+from .currency_registry import get_currency_or_404
+from .offer_book import OfferBook
 
 logger = logging.getLogger(__name__)
 
 
-def get_payment_methods_from_json(
-        response_text: str) -> QuerySet[PaymentMethod]:
-    """Parse json and create missing payment methods."""
+def get_raw_offers_from_json(response_text: str) -> List[dict]:
+    """Parse json and return raw offers data.
+
+    Raise BinanceApiError if request failed or OffersNotFoundError
+    if there are no offers in response.
+    """
     json_array = json.loads(response_text)
     if not json_array['success']:
         logger.error(json_array['message'])
@@ -25,51 +33,156 @@ def get_payment_methods_from_json(
     if not raw_offers:
         logger.error('response.data is empty')
         raise OffersNotFoundError('Offers not found.')
+    return raw_offers
+
+
+def get_raw_offers_from_pages(pages: Union[str, Iterable[str]],
+                              fiat_amount: float = None,
+                              price_tolerance: float = None
+                              ) -> Tuple[List[dict], float]:
+    """Parse pages of response texts until they give enough offers.
 
-    counter = 0
+    Pages are consumed one by one, stream of pages stops when tradable
+    funds of parsed offers cover fiat_amount, when price of last offer
+    differs from best price by more than price_tolerance share of it,
+    or on empty page. Single response text is one page.
+    Returns raw offers of consumed pages and age of oldest stale page.
+    """
+    if isinstance(pages, str):
+        pages = (pages,)
+    pages = iter(pages)
+    raw_offers: List[dict] = []
+    ages: List[float] = []
+    covered_amount = 0
+    try:
+        for page in pages:
+            try:
+                page_offers = get_raw_offers_from_json(page)
+            except OffersNotFoundError:
+                if not raw_offers:
+                    raise
+                break
+            if getattr(page, 'age', None) is not None:
+                ages.append(page.age)
+            raw_offers.extend(page_offers)
+            for raw_offer in page_offers:
+                covered_amount += (
+                    float(raw_offer['adv']['surplusAmount'])
+                    * float(raw_offer['adv']['price']))
+            best_price = float(raw_offers[0]['adv']['price'])
+            last_price = float(raw_offers[-1]['adv']['price'])
+            if fiat_amount is not None and covered_amount >= fiat_amount:
+                break
+            if (price_tolerance is not None and abs(last_price - best_price)
+                    > best_price * price_tolerance):
+                logger.debug('price left tolerance band')
+                break
+    finally:
+        close = getattr(pages, 'close', None)
+        if close is not None:
+            close()
+    return raw_offers, max(ages) if ages else None
+
+
+def get_payment_methods_from_json(
+        response_text: str) -> QuerySet[PaymentMethod]:
+    """Parse json and create or update payment methods of its currency.
+
+    Methods are deduplicated and written with bulk queries in one
+    transaction. Returns queryset of all payment methods of currency.
+    """
+    raw_offers = get_raw_offers_from_json(response_text)
+
+    currency: Currency = get_currency_or_404(
+        code=raw_offers[0]['adv']['fiatUnit'])
+    display_names: Dict[str, str] = {}
     for raw_offer in raw_offers:
-        offer_data = raw_offer['adv']
-        trade_methods = offer_data['tradeMethods']
-        currency: Currency = get_object_or_404(
-            Currency,
-            code=offer_data['fiatUnit'])
-        for trade_method in trade_methods:
-            short_name = trade_method['identifier']
-            display_name = trade_method['tradeMethodName']
-            PaymentMethod.objects.update_or_create(
-                short_name=short_name,
-                display_name=display_name,
-                currency=currency,
-            )
-            counter += 1
-    logger.debug(f'parsed {counter} payment methods')
-    return PaymentMethod.objects.filter(
-        currency=currency)
-
-
-def get_offers_from_json(response_text: str, offer_type) -> List[Offer]:
-    """Parse json and create offers list sorted by price."""
-    json_array = json.loads(response_text)
-    if not json_array['success']:
-        logger.error(json_array['message'])
-        raise BinanceApiError(json_array['message'])
+        for trade_method in raw_offer['adv']['tradeMethods']:
+            display_names.setdefault(
+                trade_method['identifier'], trade_method['tradeMethodName'])
+    logger.debug(f'parsed {len(display_names)} payment methods')
 
-    raw_offers = json_array['data']
+    try:
+        return save_payment_methods(currency, display_names)
+    except IntegrityError:
+        # Other process created same methods concurrently.
+        logger.debug('payment methods created concurrently, retrying')
+        return save_payment_methods(currency, display_names)
 
-    if not raw_offers:
-        logger.error('response.data is empty')
-        raise OffersNotFoundError('Offers not found.')
 
-    if offer_type == TradeType.BUY:
-        logger.debug('sorting payment methods ascending')
-        raw_offers.sort(key=lambda x: x['adv']['price'])
-    else:
+def save_payment_methods(currency: Currency,
+                         display_names: Dict[str, str]
+                         ) -> QuerySet[PaymentMethod]:
+    """Create missing and update existing payment methods of currency."""
+    now = timezone.now()
+    with transaction.atomic():
+        payment_methods = {
+            payment_method.short_name: payment_method
+            for payment_method in PaymentMethod.objects.select_for_update(
+            ).filter(currency=currency)}
+        updated_methods = []
+        new_methods = []
+        for short_name, display_name in display_names.items():
+            payment_method = payment_methods.get(short_name)
+            if payment_method is None:
+                new_methods.append(PaymentMethod(
+                    short_name=short_name,
+                    display_name=display_name,
+                    currency=currency,
+                    date_updated=now,
+                ))
+                continue
+            payment_method.display_name = display_name
+            payment_method.date_updated = now
+            updated_methods.append(payment_method)
+        PaymentMethod.objects.bulk_update(
+            updated_methods, ['display_name', 'date_updated'])
+        PaymentMethod.objects.bulk_create(new_methods)
+    logger.debug(
+        f'created {len(new_methods)}, updated {len(updated_methods)}'
+        f' payment methods for {currency.code}')
+    return PaymentMethod.objects.filter(currency=currency)
+
+
+def sort_raw_offers(raw_offers: List[dict], offer_type,
+                    top_k: int = None) -> List[Tuple[float, dict]]:
+    """Sort raw offers by numeric price, return (price, raw offer) pairs.
+
+    Prices are parsed once. If top_k set, only top_k best offers are
+    selected with heap instead of sorting whole list.
+    """
+    priced_offers = [
+        (float(raw_offer['adv']['price']), raw_offer)
+        for raw_offer in raw_offers]
+    is_descending = offer_type != TradeType.BUY
+    if top_k is not None and top_k < len(priced_offers):
+        logger.debug(f'selecting {top_k} best offers')
+        select = heapq.nlargest if is_descending else heapq.nsmallest
+        return select(top_k, priced_offers, key=itemgetter(0))
+    if is_descending:
         logger.debug('sorting payment methods descending')
-        raw_offers.sort(key=lambda x: x['adv']['price'], reverse=True)
+    else:
+        logger.debug('sorting payment methods ascending')
+    priced_offers.sort(key=itemgetter(0), reverse=is_descending)
+    return priced_offers
+
+
+def get_offers_from_json(response_text: Union[str, Iterable[str]],
+                         offer_type, top_k: int = None,
+                         fiat_amount: float = None,
+                         price_tolerance: float = None) -> List[Offer]:
+    """Parse json and create offers list sorted by price.
+
+    Response text can be stream of pages, they are consumed until
+    offers cover fiat_amount or price leaves price_tolerance band.
+    If top_k set, only top_k best offers are returned.
+    """
+    raw_offers, _ = get_raw_offers_from_pages(
+        response_text, fiat_amount, price_tolerance)
 
     offers: List[Offer] = []
 
-    for raw_offer in raw_offers:
+    for price, raw_offer in sort_raw_offers(raw_offers, offer_type, top_k):
         seller_data = raw_offer['advertiser']
         seller: Seller = Seller(
             name=seller_data['nickName'],
@@ -84,18 +197,37 @@ def get_offers_from_json(response_text: str, offer_type) -> List[Offer]:
         )
         offer_data = raw_offer['adv']
         offer = Offer(
-            currency=get_object_or_404(
-                Currency,
-                code=offer_data['fiatUnit']),
+            currency=get_currency_or_404(code=offer_data['fiatUnit']),
             seller=seller,
             trade_type=(
                 TradeType.BUY if offer_data['tradeType'] == 'BUY'
                 else TradeType.SELL),
-            price=float(offer_data['price']),
+            price=price,
             min_amount=float(offer_data['minSingleTransAmount']),
             tradable_funds=float(offer_data['surplusAmount']),
             offer_id=offer_data['advNo'],
+            asset=offer_data.get('asset'),
         )
         offers.append(offer)
     logger.debug(f'parsed {len(offers)} offers')
     return offers
+
+
+def get_offer_book_from_json(response_text: Union[str, Iterable[str]],
+                             offer_type, top_k: int = None,
+                             fiat_amount: float = None,
+                             price_tolerance: float = None) -> OfferBook:
+    """Parse json and create offer book sorted by price.
+
+    All offers in response have same fiat currency. Response text can
+    be stream of pages, consumed like in get_offers_from_json.
+    If top_k set, only top_k best offers are kept.
+    """
+    raw_offers, age = get_raw_offers_from_pages(
+        response_text, fiat_amount, price_tolerance)
+    currency = get_currency_or_404(code=raw_offers[0]['adv']['fiatUnit'])
+    book = OfferBook.from_raw_offers(
+        raw_offers, currency, offer_type, top_k)
+    book.age = age
+    logger.debug(f'parsed {len(book)} offers')
+    return book
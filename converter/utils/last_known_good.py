@@ -0,0 +1,120 @@
+"""Persistent store of last successful Binance P2P responses."""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Tuple
+
+from django.conf import settings
+
+from .background import run_in_background
+
+logger = logging.getLogger(__name__)
+
+
+class LastKnownGoodStore():
+    """Last successful response for every search, kept in SQLite file.
+
+    Store survives restarts and is shared by all processes on node.
+    Every thread uses its own connection. Responses are buffered and
+    written in batches by background task, which also prunes responses
+    older than BINANCE_P2P_LKG_MAX_AGE and oldest ones above
+    BINANCE_P2P_LKG_MAX_ROWS.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        # Buffered rows by store path and key.
+        self._buffer: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _get_connection(self, path: str = None) -> sqlite3.Connection:
+        path = path or str(settings.BINANCE_P2P_LKG_PATH)
+        connection_key = (path, os.getpid())
+        if getattr(self._local, 'key', None) != connection_key:
+            connection = sqlite3.connect(path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, '
+                'fetched_at REAL NOT NULL, '
+                'response_text TEXT NOT NULL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS responses_fetched_at '
+                'ON responses (fetched_at)')
+            self._local.connection = connection
+            self._local.key = connection_key
+        return self._local.connection
+
+    def get(self, key: str) -> Tuple[str, float]:
+        """Return stored response text and its age, or None."""
+        path = str(settings.BINANCE_P2P_LKG_PATH)
+        with self._buffer_lock:
+            row = self._buffer.get((path, key))
+        if row is None:
+            try:
+                row = self._get_connection(path).execute(
+                    'SELECT response_text, fetched_at FROM responses '
+                    'WHERE key = ?', (key,)).fetchone()
+            except sqlite3.Error:
+                logger.exception('failed to read last known good response')
+                return None
+        if row is None:
+            return None
+        response_text, fetched_at = row
+        return response_text, time.time() - fetched_at
+
+    def put(self, key: str, response_text: str) -> None:
+        """Buffer response text as last known good one, store it later."""
+        path = str(settings.BINANCE_P2P_LKG_PATH)
+        with self._buffer_lock:
+            self._buffer[path, key] = (response_text, time.time())
+        run_in_background(('last_known_good', id(self)), self.flush)
+
+    def flush(self) -> None:
+        """Write buffered responses until buffer is empty.
+
+        Responses stay readable from buffer until they are written.
+        """
+        with self._flush_lock:
+            while True:
+                with self._buffer_lock:
+                    buffer = dict(self._buffer)
+                if not buffer:
+                    return
+                rows_by_path: Dict[str, list] = {}
+                for (path, key), (response_text, fetched_at) in (
+                        buffer.items()):
+                    rows_by_path.setdefault(path, []).append(
+                        (key, fetched_at, response_text))
+                for path, rows in rows_by_path.items():
+                    self._write(path, rows)
+                with self._buffer_lock:
+                    for key, row in buffer.items():
+                        if self._buffer.get(key) == row:
+                            del self._buffer[key]
+
+    def _write(self, path: str, rows: list) -> None:
+        """Write rows in one transaction and prune table."""
+        try:
+            connection = self._get_connection(path)
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO responses '
+                    '(key, fetched_at, response_text) VALUES (?, ?, ?)',
+                    rows)
+                connection.execute(
+                    'DELETE FROM responses WHERE fetched_at < ?',
+                    (time.time() - settings.BINANCE_P2P_LKG_MAX_AGE,))
+                connection.execute(
+                    'DELETE FROM responses WHERE key IN ('
+                    'SELECT key FROM responses ORDER BY fetched_at DESC '
+                    'LIMIT -1 OFFSET ?)',
+                    (settings.BINANCE_P2P_LKG_MAX_ROWS,))
+        except sqlite3.Error:
+            logger.exception('failed to store last known good responses')
+
+
+last_known_good = LastKnownGoodStore()
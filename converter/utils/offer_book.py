@@ -0,0 +1,307 @@
+"""Compact column oriented storage of parsed offers."""
+import heapq
+import logging
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import compress
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from ..models import Currency, Offer, Seller, TradeType
+
+logger = logging.getLogger(__name__)
+
+
+class OfferBook():
+    """Offers of one currency and trade type, stored as arrays of columns.
+
+    Numeric fields are kept in typed arrays, ids and names are interned
+    strings, Offer and Seller objects are created only when row is
+    accessed. Rows are ordered from best price to worst after sort().
+    Trade type of book is trade type of request, offers have trade type
+    of advertiser, it is opposite to requested one.
+    Age is set for books parsed from stale response, in seconds.
+    Asset is crypto asset traded for currency in offers.
+    """
+
+    COLUMNS = (
+        'price', 'min_amount', 'max_amount', 'tradable_funds',
+        'month_finish_rate', 'month_orders_count', 'is_merchant',
+        'seller_names', 'seller_ids', 'offer_ids',
+    )
+    __slots__ = ('currency', 'trade_type', 'offer_trade_type', 'asset',
+                 'age', '_simulator', *COLUMNS)
+
+    def __init__(self, currency: Currency, trade_type: str,
+                 offer_trade_type: str = None, asset: str = None) -> None:
+        self.currency = currency
+        self.trade_type = trade_type
+        self.offer_trade_type = offer_trade_type or trade_type
+        self.asset = asset
+        self.age: float = None
+        self._simulator: FillSimulator = None
+        self.price = array('d')
+        self.min_amount = array('d')
+        self.max_amount = array('d')
+        self.tradable_funds = array('d')
+        self.month_finish_rate = array('d')
+        self.month_orders_count = array('d')
+        self.is_merchant = array('b')
+        self.seller_names: List[str] = []
+        self.seller_ids: List[str] = []
+        self.offer_ids: List[str] = []
+
+    @classmethod
+    def from_raw_offers(cls, raw_offers: Iterable[dict], currency: Currency,
+                        trade_type: str, top_k: int = None) -> 'OfferBook':
+        """Create sorted book from 'data' items of binance response.
+
+        If top_k set, only top_k best offers are kept.
+        """
+        book = cls(currency, trade_type)
+        for raw_offer in raw_offers:
+            book.offer_trade_type = (
+                TradeType.BUY if raw_offer['adv']['tradeType'] == 'BUY'
+                else TradeType.SELL)
+            seller_data = raw_offer['advertiser']
+            offer_data = raw_offer['adv']
+            book.asset = offer_data.get('asset', book.asset)
+            book.price.append(float(offer_data['price']))
+            book.min_amount.append(
+                float(offer_data['minSingleTransAmount']))
+            book.max_amount.append(
+                float(offer_data.get('dynamicMaxSingleTransAmount')
+                      or offer_data['maxSingleTransAmount']))
+            book.tradable_funds.append(float(offer_data['surplusAmount']))
+            book.month_finish_rate.append(
+                float(seller_data['monthFinishRate'])*100)
+            book.month_orders_count.append(
+                float(seller_data['monthOrderCount']))
+            book.is_merchant.append(seller_data['userType'] == 'merchant')
+            book.seller_names.append(sys.intern(seller_data['nickName']))
+            book.seller_ids.append(sys.intern(seller_data['userNo']))
+            book.offer_ids.append(sys.intern(offer_data['advNo']))
+        book.sort(top_k)
+        return book
+
+    def __len__(self) -> int:
+        return len(self.price)
+
+    def __bool__(self) -> bool:
+        return len(self.price) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get_offer(i)
+                    for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('offer book index out of range')
+        return self.get_offer(index)
+
+    def __iter__(self) -> Iterator[Offer]:
+        return (self.get_offer(i) for i in range(len(self)))
+
+    def __str__(self) -> str:
+        return f'{self.trade_type} {self.currency.code} ({len(self)} offers)'
+
+    def get_offer(self, index: int) -> Offer:
+        """Materialize offer in row index."""
+        seller = Seller(
+            name=self.seller_names[index],
+            is_merchant=bool(self.is_merchant[index]),
+            month_finish_rate=self.month_finish_rate[index],
+            month_orders_count=self.month_orders_count[index],
+            user_id=self.seller_ids[index],
+        )
+        return Offer(
+            currency=self.currency,
+            seller=seller,
+            trade_type=self.offer_trade_type,
+            price=self.price[index],
+            min_amount=self.min_amount[index],
+            tradable_funds=self.tradable_funds[index],
+            offer_id=self.offer_ids[index],
+            max_amount=self.max_amount[index],
+            asset=self.asset,
+        )
+
+    def sort(self, top_k: int = None) -> None:
+        """Order rows by price, ascending for BUY, descending for SELL.
+
+        If top_k set, only top_k best rows are selected with heap
+        and kept in book.
+        """
+        is_descending = self.trade_type != TradeType.BUY
+        if top_k is not None and top_k < len(self):
+            select = heapq.nlargest if is_descending else heapq.nsmallest
+            order = select(top_k, range(len(self)),
+                           key=self.price.__getitem__)
+        else:
+            order = sorted(range(len(self)), key=self.price.__getitem__,
+                           reverse=is_descending)
+        self._reorder(order)
+
+    def _reorder(self, order: List[int]) -> None:
+        self._simulator = None
+        for column in self.COLUMNS:
+            values = getattr(self, column)
+            reordered = [values[i] for i in order]
+            if isinstance(values, array):
+                reordered = array(values.typecode, reordered)
+            setattr(self, column, reordered)
+
+    def take(self, rows: List[int]) -> 'OfferBook':
+        """Return new book with given rows only."""
+        book = OfferBook(
+            self.currency, self.trade_type, self.offer_trade_type, self.asset)
+        book.age = self.age
+        for column in self.COLUMNS:
+            setattr(book, column, getattr(self, column))
+        book._reorder(rows)
+        return book
+
+    def best_price(self) -> float:
+        """Price of best offer."""
+        return self.price[0]
+
+    def filter(self, amount: float = None,
+               is_merchant: bool = None) -> 'OfferBook':
+        """Return offers, available for fiat amount and seller type."""
+        mask = [True] * len(self)
+        if amount is not None:
+            mask = [
+                selected and low <= amount <= high
+                for selected, low, high
+                in zip(mask, self.min_amount, self.max_amount)]
+        if is_merchant is not None:
+            mask = [
+                selected and bool(merchant) == is_merchant
+                for selected, merchant in zip(mask, self.is_merchant)]
+        return self.take(list(compress(range(len(self)), mask)))
+
+    @property
+    def simulator(self) -> 'FillSimulator':
+        """Fill simulator of book, built on first use."""
+        if self._simulator is None:
+            self._simulator = FillSimulator(self)
+        return self._simulator
+
+    def fill(self, usdt_amount: float) -> Tuple[float, int]:
+        """Get fiat amount for usdt_amount, walking offers from best one.
+
+        Returns fiat amount and number of offers used. Fiat amount is
+        None if offers are not enough.
+        """
+        fill = self.simulator.fiat_for_usdt(usdt_amount)
+        if fill is None:
+            return None, len(self)
+        return fill.fiat_amount, fill.offers_count
+
+
+class Fill(NamedTuple):
+    """Result of filling amount in offer book.
+
+    Offers are walked from best one: first full_rows walked offers are
+    traded in full, last_usdt_amount is traded in book row last_row.
+    """
+
+    usdt_amount: float
+    fiat_amount: float
+    full_rows: int
+    last_row: int
+    last_usdt_amount: float
+
+    @property
+    def rate(self) -> float:
+        """Volume-weighted price, fiat per USDT."""
+        return self.fiat_amount / self.usdt_amount
+
+    @property
+    def offers_count(self) -> int:
+        return self.full_rows + 1
+
+
+class FillSimulator():
+    """Answer fill queries over sorted offer book in O(log n).
+
+    Capacity of offer is USDT it can sell in one order: its tradable
+    funds, limited by max amount. Offers with capacity below min amount
+    can not be traded and are skipped. Prefix sums of capacities and
+    their fiat cost are precomputed, so fill of any amount is found
+    with binary search. Remainder, that is below min amount of offer
+    where walk stops, is taken from first next offer accepting it.
+    """
+
+    def __init__(self, book: OfferBook) -> None:
+        self.book = book
+        self.rows = array('l')
+        self.price = array('d')
+        self.capacity = array('d')
+        self.min_usdt = array('d')
+        self.cumulative_funds = array('d', [0.0])
+        self.cumulative_cost = array('d', [0.0])
+        for row in range(len(book)):
+            price = book.price[row]
+            capacity = book.tradable_funds[row]
+            if book.max_amount[row]:
+                capacity = min(capacity, book.max_amount[row] / price)
+            min_usdt = book.min_amount[row] / price
+            if capacity <= 0 or capacity < min_usdt:
+                continue
+            self.rows.append(row)
+            self.price.append(price)
+            self.capacity.append(capacity)
+            self.min_usdt.append(min_usdt)
+            self.cumulative_funds.append(
+                self.cumulative_funds[-1] + capacity)
+            self.cumulative_cost.append(
+                self.cumulative_cost[-1] + capacity * price)
+
+    def fiat_for_usdt(self, usdt_amount: float) -> Optional[Fill]:
+        """Fill usdt_amount: fiat cost of buying it, or fiat got for it.
+
+        Returns None if book can not fill amount.
+        """
+        return self._fill(usdt_amount, self.cumulative_funds, False)
+
+    def usdt_for_fiat(self, fiat_amount: float) -> Optional[Fill]:
+        """Fill fiat_amount: USDT bought for it, or sold to get it.
+
+        Returns None if book can not fill amount.
+        """
+        return self._fill(fiat_amount, self.cumulative_cost, True)
+
+    def get_rows(self, fill: Fill) -> List[int]:
+        """Get book rows of offers used by fill, from best one."""
+        return [*self.rows[:fill.full_rows], fill.last_row]
+
+    def get_offers(self, fill: Fill) -> OfferBook:
+        """Get book of offers used by fill."""
+        return self.book.take(self.get_rows(fill))
+
+    def _fill(self, amount: float, cumulative: array,
+              is_fiat: bool) -> Optional[Fill]:
+        if amount <= 0:
+            return None
+        index = bisect_left(cumulative, amount)
+        if index == len(cumulative):
+            return None
+        full_rows = index - 1
+        remainder = amount - cumulative[full_rows]
+        for walked in range(full_rows, len(self.rows)):
+            usdt_amount = (remainder / self.price[walked] if is_fiat
+                           else remainder)
+            if self.min_usdt[walked] <= usdt_amount <= self.capacity[walked]:
+                break
+        else:
+            return None
+        return Fill(
+            usdt_amount=self.cumulative_funds[full_rows] + usdt_amount,
+            fiat_amount=(self.cumulative_cost[full_rows]
+                         + usdt_amount * self.price[walked]),
+            full_rows=full_rows,
+            last_row=self.rows[walked],
+            last_usdt_amount=usdt_amount,
+        )
@@ -1,116 +1,719 @@
 """Utility methods for processing offers."""
+import asyncio
 import logging
-from typing import List, Tuple
+import threading
+import time
+from collections import deque
+from concurrent.futures import (FIRST_EXCEPTION, Future, ThreadPoolExecutor,
+                                TimeoutError, wait)
+from typing import (Callable, Deque, Dict, Iterator, List, NamedTuple,
+                    Optional, Sequence, Tuple, Union)
 
-from ..models import Offer, TradeType
-from .binance_api import get_p2p_offers_data
-from .json_parser import get_offers_from_json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from ..exceptions import ApiUnavailableError, OffersNotFoundError
+from ..models import DEFAULT_ASSET, Offer, TradeType
+from . import amount_index, reference_prices
+from .amount_index import AmountIndex
+from .binance_api import (MAX_ROWS, async_get_p2p_offers_data,
+                          get_p2p_offers_data)
+from .json_parser import get_offer_book_from_json
+from .offer_book import OfferBook
 
 logger = logging.getLogger(__name__)
 
+# Price request needs only best offer, full requests get one page.
+ROWS_FOR_PRICE_REQUEST = 1
+ROWS_FOR_FULL_REQUEST = 10
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executor_lock = threading.Lock()
+
+
+def _get_named_executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    """Return process-wide thread pool with name, create it once."""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = _executors[name] = ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix=f'binance-p2p-{name}')
+    return executor
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return process-wide thread pool for upstream requests.
+
+    Its tasks may wait only for get_page_executor() tasks.
+    """
+    return _get_named_executor(
+        'fetch', settings.BINANCE_P2P_FETCH_WORKERS)
+
+
+def get_asset_executor() -> ThreadPoolExecutor:
+    """Return process-wide thread pool for conversions through assets.
+
+    Conversion of asset waits for its requests in get_executor() pool,
+    so it runs in own pool to not take workers of its requests.
+    """
+    return _get_named_executor(
+        'assets', settings.BINANCE_P2P_ASSET_WORKERS)
+
+
+def get_page_executor() -> ThreadPoolExecutor:
+    """Return process-wide thread pool for next pages of order books.
+
+    Page requests never wait for other tasks, so tasks running in
+    get_executor() pool may wait for pages without starving it.
+    """
+    return _get_named_executor(
+        'pages', settings.BINANCE_P2P_PAGE_WORKERS)
+
+
+def run_concurrently(calls: List[Callable], deadline: float) -> list:
+    """Run calls in thread pool and return their results in same order.
+
+    Raise first exception if one of the calls failed, or
+    ApiUnavailableError if calls not finished before deadline
+    (time.monotonic() value). Calls not started yet are cancelled.
+    """
+    futures: List[Future] = [get_executor().submit(call) for call in calls]
+    done, not_done = wait(
+        futures,
+        timeout=max(deadline - time.monotonic(), 0),
+        return_when=FIRST_EXCEPTION)
+    for future in not_done:
+        future.cancel()
+    for future in futures:
+        if future in done and future.exception() is not None:
+            raise future.exception()
+    if not_done:
+        raise_deadline_exceeded()
+    return [future.result() for future in futures]
+
+
+def check_deadline(deadline: float) -> None:
+    """Raise ApiUnavailableError if deadline (time.monotonic()) passed."""
+    if time.monotonic() > deadline:
+        raise_deadline_exceeded()
+
+
+def raise_deadline_exceeded() -> None:
+    """Log and raise ApiUnavailableError of exceeded deadline."""
+    error_message = 'Binance P2P Api request deadline exceeded.'
+    logger.error(error_message)
+    raise ApiUnavailableError(error_message)
+
+
+def iter_offers_pages(request: dict, first_page: str = None,
+                      max_pages: int = None, concurrency: int = None,
+                      deadline: float = None) -> Iterator[str]:
+    """Yield response texts of request pages in order.
+
+    First page is requested alone, or taken from first_page. Next
+    pages are requested only when consumer asks for them, up to
+    concurrency pages ahead in parallel, until max_pages. Stream ends
+    early if page request failed or deadline (time.monotonic() value)
+    exceeded. Pending requests are cancelled when consumer stops.
+    """
+    max_pages = max_pages or settings.BINANCE_P2P_MAX_PAGES
+    concurrency = concurrency or settings.BINANCE_P2P_PAGE_CONCURRENCY
+    if first_page is None:
+        first_page = get_p2p_offers_data(**request)
+    yield first_page
+
+    pending: Deque[Future] = deque()
+    next_page = 2
+    try:
+        while pending or next_page <= max_pages:
+            if deadline is not None and time.monotonic() > deadline:
+                logger.warning('deadline exceeded, not all pages fetched')
+                return
+            while len(pending) < concurrency and next_page <= max_pages:
+                pending.append(get_page_executor().submit(
+                    get_p2p_offers_data, **request, page=next_page))
+                next_page += 1
+            timeout = (None if deadline is None
+                       else max(deadline - time.monotonic(), 0))
+            try:
+                page = pending.popleft().result(timeout=timeout)
+            except TimeoutError:
+                logger.warning('deadline exceeded, not all pages fetched')
+                return
+            except ApiUnavailableError as e:
+                logger.warning(f'failed to fetch next page: {e}')
+                return
+            yield page
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def get_amount_index(fiat_code: str, payment_method: str, trade_type: str,
+                     deadline: float = None,
+                     asset: str = DEFAULT_ASSET) -> AmountIndex:
+    """Get amount index of offers, build it if there is no fresh one.
+
+    Index is built from one deep fetch without amount and merchant
+    filters: pages of max rows, up to BINANCE_P2P_AMOUNT_INDEX_PAGES.
+    """
+    index = amount_index.get_index(
+        fiat_code, payment_method, trade_type, asset)
+    if index is not None:
+        return index
+    request = {
+        'fiat_code': fiat_code,
+        'payment_method': payment_method,
+        'trade_type': trade_type,
+        'rows': MAX_ROWS,
+        'asset': asset,
+    }
+    book = get_offer_book_from_json(
+        iter_offers_pages(
+            request, max_pages=settings.BINANCE_P2P_AMOUNT_INDEX_PAGES,
+            deadline=deadline),
+        offer_type=trade_type)
+    reference_prices.update_from_book(
+        fiat_code, payment_method, trade_type, book)
+    index = AmountIndex(book)
+    amount_index.set_index(
+        fiat_code, payment_method, trade_type, index, asset)
+    return index
 
-def get_best_price(offers: List[Offer]) -> float:
+
+def query_amount_index(index: AmountIndex, amount: float = None,
+                       is_merchant: bool = False,
+                       rows: int = None) -> OfferBook:
+    """Get offers of index accepting amount.
+
+    Raise OffersNotFoundError if there are no such offers.
+    """
+    offers = index.query(amount, is_merchant, rows)
+    if not offers:
+        logger.error(f'no offers for amount {amount} in index')
+        raise OffersNotFoundError('Offers not found.')
+    return offers
+
+
+def record_reference_prices(request: dict, book: OfferBook) -> None:
+    """Update reference prices with book parsed for request.
+
+    Books filtered by amount are skipped, their best price is not best
+    price of whole book.
+    """
+    if request.get('trans_amount') is not None:
+        return
+    reference_prices.update_from_book(
+        request['fiat_code'], request['payment_method'],
+        request['trade_type'], book, request['is_merchant'])
+
+
+def get_request_reference_price(request: dict) -> float:
+    """Get fresh reference price of request order book, or None."""
+    return reference_prices.get_reference_price(
+        request['fiat_code'], request['payment_method'],
+        request['trade_type'], request['is_merchant'],
+        request.get('asset', DEFAULT_ASSET))
+
+
+def get_best_price(offers: Union[List[Offer], OfferBook]) -> float:
     """Get best price of currency in list of orders.
 
     Orders already sorted properly after parsing.
     """
     logger.debug('getting best price from list of offers')
+    if isinstance(offers, OfferBook):
+        return offers.best_price()
     return offers[0].price
 
 
+def get_fill_price(offers: Union[List[Offer], OfferBook],
+                   fiat_amount: float) -> float:
+    """Get effective price of trading USDT for fiat amount.
+
+    Whole amount is filled walking offers of book, best price is
+    returned for lists and for books not deep enough to fill it.
+    """
+    if isinstance(offers, OfferBook):
+        fill = offers.simulator.usdt_for_fiat(fiat_amount)
+        if fill is not None:
+            return fill.rate
+    return get_best_price(offers)
+
+
+def get_conversion_fill(from_offers: OfferBook, to_offers: OfferBook,
+                        from_amount: float = None,
+                        to_amount: float = None
+                        ) -> Optional[Tuple[float, float]]:
+    """Get from and to amounts of conversion, filled across offers.
+
+    Asset is bought for from currency with from_offers and sold for to
+    currency with to_offers, one of amounts is set. Returns None if
+    offers are not enough to fill conversion.
+    """
+    if not (isinstance(from_offers, OfferBook)
+            and isinstance(to_offers, OfferBook)):
+        return None
+    if to_amount:
+        sold = to_offers.simulator.usdt_for_fiat(to_amount)
+        bought = sold and from_offers.simulator.fiat_for_usdt(
+            sold.usdt_amount)
+    else:
+        bought = from_offers.simulator.usdt_for_fiat(from_amount)
+        sold = bought and to_offers.simulator.fiat_for_usdt(
+            bought.usdt_amount)
+    if not (bought and sold):
+        return None
+    return bought.fiat_amount, sold.fiat_amount
+
+
+def get_book_request(fiat_code: str, payment_method: str, trade_type: str,
+                     is_merchant: bool, trans_amount: float = None,
+                     asset: str = DEFAULT_ASSET) -> dict:
+    """Get get_p2p_offers_data params of order book request.
+
+    Request without amount is price request of best offer, request with
+    amount is full request of offers accepting it.
+    """
+    return {
+        'fiat_code': fiat_code,
+        'is_merchant': is_merchant,
+        'payment_method': payment_method,
+        'trans_amount': trans_amount,
+        'trade_type': trade_type,
+        'rows': (ROWS_FOR_FULL_REQUEST if trans_amount
+                 else ROWS_FOR_PRICE_REQUEST),
+        'asset': asset,
+    }
+
+
+def get_requests_params(currency_1, currency_2, payment_method_1,
+                        payment_method_2, is_merchant, filled_amount,
+                        is_to_amount_filled, asset: str = DEFAULT_ASSET
+                        ) -> Tuple[dict, dict, dict]:
+    """Get get_p2p_offers_data params for all requests of conversion.
+
+    Returns params of full request for currency with filled amount,
+    price request for second currency and full request for second
+    currency without trans_amount, it is known only after price request.
+    Both currencies are traded for same asset.
+    """
+    trade_type_1 = (
+        TradeType.SELL if is_to_amount_filled else TradeType.BUY)
+    trade_type_2 = (
+        TradeType.SELL if not is_to_amount_filled else TradeType.BUY)
+
+    filled_amount_request = get_book_request(
+        currency_1.code, payment_method_1.short_name, trade_type_1,
+        is_merchant, filled_amount, asset)
+    price_request = get_book_request(
+        currency_2.code, payment_method_2.short_name, trade_type_2,
+        is_merchant, asset=asset)
+    unfilled_amount_request = {
+        **price_request, 'rows': ROWS_FOR_FULL_REQUEST}
+    return filled_amount_request, price_request, unfilled_amount_request
+
+
+def get_indexed_offers_lists(currency_1, currency_2, payment_method_1,
+                             payment_method_2, is_merchant, filled_amount,
+                             is_to_amount_filled, asset: str = DEFAULT_ASSET,
+                             deadline: float = None
+                             ) -> Tuple[OfferBook, OfferBook]:
+    """Get 2 lists of best offers for both currencies from amount indexes.
+
+    Same as get_best_offers_lists, but offers of both currencies are
+    selected from amount indexes, built concurrently when missing,
+    approximate price of second currency is its best indexed price.
+    Indexes are built once per BINANCE_P2P_AMOUNT_INDEX_TTL, so other
+    amounts of same conversion are answered without upstream requests.
+    """
+    filled_amount_request, _, unfilled_amount_request = (
+        get_requests_params(
+            currency_1, currency_2, payment_method_1, payment_method_2,
+            is_merchant, filled_amount, is_to_amount_filled, asset))
+    if deadline is None:
+        deadline = time.monotonic() + settings.BINANCE_P2P_FETCH_DEADLINE
+    rows = settings.BINANCE_P2P_MAX_PAGES * filled_amount_request['rows']
+    try:
+        index_1, index_2 = run_concurrently([
+            lambda: get_amount_index(
+                currency_1.code, payment_method_1.short_name,
+                filled_amount_request['trade_type'], deadline=deadline,
+                asset=asset),
+            lambda: get_amount_index(
+                currency_2.code, payment_method_2.short_name,
+                unfilled_amount_request['trade_type'], deadline=deadline,
+                asset=asset),
+        ], deadline)
+        offers_filled_amount_currency = query_amount_index(
+            index_1, filled_amount, is_merchant, rows)
+        required_amount_of_unfilled_currency = get_amount(
+            filled_amount,
+            get_fill_price(offers_filled_amount_currency, filled_amount),
+            query_amount_index(index_2, None, is_merchant, 1))
+
+        logger.debug(
+            f'selecting best offers for'
+            f' ({required_amount_of_unfilled_currency})'
+            f'{currency_2.code}[{payment_method_2.display_name}]')
+
+        offers_unfilled_amount_currency = query_amount_index(
+            index_2, required_amount_of_unfilled_currency, is_merchant, rows)
+    except Exception as e:
+        raise Exception(e) from e
+    return offers_unfilled_amount_currency, offers_filled_amount_currency
+
+
 def get_best_offers_lists(currency_1, currency_2, payment_method_1,
                           payment_method_2, is_merchant, filled_amount,
-                          is_to_amount_filled
-                          ) -> Tuple[List[Offer], List[Offer]]:
+                          is_to_amount_filled, concurrent: bool = None,
+                          use_amount_index: bool = None,
+                          asset: str = DEFAULT_ASSET, deadline: float = None
+                          ) -> Tuple[OfferBook, OfferBook]:
     """Get 2 lists of best offers for both currencies.
 
     Currency 1 have amount filled. Currency 2 amount need to be found.
+    Both currencies are traded for asset, USDT by default.
     Process:
     First request: gets best offers for currency with filled amount.
-    Second request: gets approximate price of second currency.
-    Than, based of amount of USDT needed, find amount of second currency,
-    needed to make request.
+    Second request: gets approximate price of second currency, it is
+    made only if there is no fresh reference price of it.
+    Than, based of amount of USDT bought or sold for filled amount across
+    offers, find amount of second currency, needed to make request.
     Final request: gets best offers for second currency with correct amount.
+    Parsed books update reference prices.
+
+    First and second requests are independent, in concurrent mode they
+    are made in parallel, and all requests share one deadline
+    (time.monotonic() value), BINANCE_P2P_FETCH_DEADLINE from now by
+    default.
+    If first page of full request does not cover amount, next pages
+    are fetched until they do, up to BINANCE_P2P_MAX_PAGES.
+    Concurrent mode is set by BINANCE_P2P_CONCURRENT_FETCH by default.
+    With BINANCE_P2P_AMOUNT_INDEX offers are selected from amount
+    indexes by get_indexed_offers_lists instead.
     """
     logger.debug(
         f'getting best offers pair for {currency_1.code} '
         f'and {currency_2.code}')
+    if use_amount_index is None:
+        use_amount_index = settings.BINANCE_P2P_AMOUNT_INDEX
+    if use_amount_index:
+        return get_indexed_offers_lists(
+            currency_1, currency_2, payment_method_1, payment_method_2,
+            is_merchant, filled_amount, is_to_amount_filled, asset,
+            deadline)
 
-    rows_for_price_request = 1
-    rows_for_full_request = 10
-    trade_type_1 = (
-        TradeType.SELL if is_to_amount_filled else TradeType.BUY)
-    trade_type_2 = (
-        TradeType.SELL if not is_to_amount_filled else TradeType.BUY)
+    filled_amount_request, price_request, unfilled_amount_request = (
+        get_requests_params(
+            currency_1, currency_2, payment_method_1, payment_method_2,
+            is_merchant, filled_amount, is_to_amount_filled, asset))
 
     logger.debug(
         f'requesting best offers for ({filled_amount})'
-        f'{currency_1.code}[{payment_method_1.display_name}]')
+        f'{currency_1.code}[{payment_method_1.display_name}] {asset}')
+
+    if concurrent is None:
+        concurrent = settings.BINANCE_P2P_CONCURRENT_FETCH
+    if deadline is None:
+        deadline = time.monotonic() + settings.BINANCE_P2P_FETCH_DEADLINE
+    price_unfilled_amount_currency = get_request_reference_price(
+        price_request)
 
     try:
-        offers_filled_amount_currency = (
-            get_offers_from_json(
-                get_p2p_offers_data(
-                    fiat_code=currency_1.code,
-                    is_merchant=is_merchant,
-                    payment_method=payment_method_1.short_name,
-                    trans_amount=filled_amount,
-                    trade_type=trade_type_1,
-                    rows=rows_for_full_request
-                ), offer_type=trade_type_1
-            )
-        )
-        price_filled_amount_currency = get_best_price(
-            offers_filled_amount_currency)
+        if concurrent and price_unfilled_amount_currency is None:
+            filled_amount_json, price_json = run_concurrently(
+                [lambda: get_p2p_offers_data(**filled_amount_request),
+                 lambda: get_p2p_offers_data(**price_request)],
+                deadline)
+        elif concurrent:
+            filled_amount_json, = run_concurrently(
+                [lambda: get_p2p_offers_data(**filled_amount_request)],
+                deadline)
+        else:
+            filled_amount_json = get_p2p_offers_data(**filled_amount_request)
+        offers_filled_amount_currency = get_offer_book_from_json(
+            iter_offers_pages(filled_amount_request,
+                              first_page=filled_amount_json,
+                              deadline=deadline),
+            offer_type=filled_amount_request['trade_type'],
+            fiat_amount=filled_amount,
+            price_tolerance=settings.BINANCE_P2P_PRICE_TOLERANCE)
+        record_reference_prices(
+            filled_amount_request, offers_filled_amount_currency)
+        price_filled_amount_currency = get_fill_price(
+            offers_filled_amount_currency, filled_amount)
 
-        logger.debug(
-            f'requesting approx price for {currency_2.code}'
-            f'[{payment_method_2.display_name}]')
-
-        single_offer_data_unfilled_amount_currency = (
-            get_offers_from_json(
-                get_p2p_offers_data(
-                    fiat_code=currency_2.code,
-                    is_merchant=is_merchant,
-                    payment_method=payment_method_2.short_name,
-                    trans_amount=None,
-                    trade_type=trade_type_2,
-                    rows=rows_for_price_request
-                ), offer_type=trade_type_2
-            )
-        )
-        required_amount_of_unfilled_currency = get_amount(
+        if price_unfilled_amount_currency is None:
+            logger.debug(
+                f'requesting approx price for {currency_2.code}'
+                f'[{payment_method_2.display_name}]')
+
+            if not concurrent:
+                check_deadline(deadline)
+                price_json = get_p2p_offers_data(**price_request)
+            single_offer_data_unfilled_amount_currency = (
+                get_offer_book_from_json(
+                    price_json, offer_type=price_request['trade_type']))
+            record_reference_prices(
+                price_request, single_offer_data_unfilled_amount_currency)
+            price_unfilled_amount_currency = get_best_price(
+                single_offer_data_unfilled_amount_currency)
+        required_amount_of_unfilled_currency = convert_amount(
             filled_amount,
             price_filled_amount_currency,
-            single_offer_data_unfilled_amount_currency)
+            price_unfilled_amount_currency)
 
         logger.debug(
             f'requesting best offers for'
             f' ({required_amount_of_unfilled_currency})'
             f'{currency_2.code}[{payment_method_2.display_name}]')
 
-        offers_unfilled_amount_currency = (
-            get_offers_from_json(
-                get_p2p_offers_data(
-                    fiat_code=currency_2.code,
-                    is_merchant=is_merchant,
-                    payment_method=payment_method_2.short_name,
-                    trans_amount=required_amount_of_unfilled_currency,
-                    trade_type=trade_type_2,
-                    rows=rows_for_full_request,
-                ), offer_type=trade_type_2
-            )
-        )
+        unfilled_amount_request['trans_amount'] = (
+            required_amount_of_unfilled_currency)
+        if concurrent:
+            unfilled_amount_json, = run_concurrently(
+                [lambda: get_p2p_offers_data(**unfilled_amount_request)],
+                deadline)
+        else:
+            check_deadline(deadline)
+            unfilled_amount_json = get_p2p_offers_data(
+                **unfilled_amount_request)
+        offers_unfilled_amount_currency = get_offer_book_from_json(
+            iter_offers_pages(unfilled_amount_request,
+                              first_page=unfilled_amount_json,
+                              deadline=deadline),
+            offer_type=unfilled_amount_request['trade_type'],
+            fiat_amount=required_amount_of_unfilled_currency,
+            price_tolerance=settings.BINANCE_P2P_PRICE_TOLERANCE)
+        record_reference_prices(
+            unfilled_amount_request, offers_unfilled_amount_currency)
     except Exception as e:
         raise Exception(e) from e
     return offers_unfilled_amount_currency, offers_filled_amount_currency
 
 
+async def async_get_best_offers_lists(currency_1, currency_2,
+                                      payment_method_1, payment_method_2,
+                                      is_merchant, filled_amount,
+                                      is_to_amount_filled,
+                                      asset: str = DEFAULT_ASSET
+                                      ) -> Tuple[OfferBook, OfferBook]:
+    """Get 2 lists of best offers for both currencies without blocking.
+
+    Same process as get_best_offers_lists, first and second requests
+    are always made concurrently, pending request is cancelled if
+    other one failed or BINANCE_P2P_FETCH_DEADLINE exceeded. Second
+    request is skipped if there is fresh reference price.
+    Amount indexes are queried in own thread, like in sync variant,
+    so slow index builds don't block other sync code of the process.
+    """
+    logger.debug(
+        f'getting best offers pair for {currency_1.code} '
+        f'and {currency_2.code}')
+    if settings.BINANCE_P2P_AMOUNT_INDEX:
+        return await sync_to_async(
+            get_indexed_offers_lists, thread_sensitive=False)(
+            currency_1, currency_2, payment_method_1, payment_method_2,
+            is_merchant, filled_amount, is_to_amount_filled, asset)
+
+    filled_amount_request, price_request, unfilled_amount_request = (
+        get_requests_params(
+            currency_1, currency_2, payment_method_1, payment_method_2,
+            is_merchant, filled_amount, is_to_amount_filled, asset))
+    parse_offers = sync_to_async(get_offer_book_from_json)
+    record_prices = sync_to_async(record_reference_prices)
+
+    async def get_probe_price() -> float:
+        price = await sync_to_async(get_request_reference_price)(
+            price_request)
+        if price is not None:
+            return price
+        single_offer_data_unfilled_amount_currency = await parse_offers(
+            await async_get_p2p_offers_data(**price_request),
+            offer_type=price_request['trade_type'])
+        await record_prices(
+            price_request, single_offer_data_unfilled_amount_currency)
+        return get_best_price(single_offer_data_unfilled_amount_currency)
+
+    async def get_offers() -> Tuple[OfferBook, OfferBook]:
+        filled_amount_json, price_unfilled_amount_currency = (
+            await asyncio.gather(
+                async_get_p2p_offers_data(**filled_amount_request),
+                get_probe_price()))
+        offers_filled_amount_currency = await parse_offers(
+            filled_amount_json,
+            offer_type=filled_amount_request['trade_type'])
+        await record_prices(
+            filled_amount_request, offers_filled_amount_currency)
+        unfilled_amount_request['trans_amount'] = convert_amount(
+            filled_amount,
+            get_fill_price(offers_filled_amount_currency, filled_amount),
+            price_unfilled_amount_currency)
+
+        logger.debug(
+            f'requesting best offers for'
+            f' ({unfilled_amount_request["trans_amount"]})'
+            f'{currency_2.code}[{payment_method_2.display_name}]')
+
+        offers_unfilled_amount_currency = await parse_offers(
+            await async_get_p2p_offers_data(**unfilled_amount_request),
+            offer_type=unfilled_amount_request['trade_type'])
+        await record_prices(
+            unfilled_amount_request, offers_unfilled_amount_currency)
+        return offers_unfilled_amount_currency, offers_filled_amount_currency
+
+    try:
+        return await asyncio.wait_for(
+            get_offers(), timeout=settings.BINANCE_P2P_FETCH_DEADLINE)
+    except asyncio.TimeoutError as e:
+        error_message = 'Binance P2P Api request deadline exceeded.'
+        logger.error(error_message)
+        raise Exception(error_message) from e
+    except Exception as e:
+        raise Exception(e) from e
+
+
+class AssetConversion(NamedTuple):
+    """Offers lists of conversion through asset.
+
+    Amount is amount of currency 2 converted with filled amount of
+    currency 1, estimated with best prices if it is not filled.
+    """
+
+    asset: str
+    offers_lists: Tuple[OfferBook, OfferBook]
+    amount: float
+    filled: bool = True
+
+
+def get_unfilled_amount(offers_lists: Tuple[OfferBook, OfferBook],
+                        filled_amount: float) -> Tuple[float, bool]:
+    """Get amount of currency 2 for filled amount of currency 1.
+
+    Asset traded for filled amount is filled across offers of currency
+    1 and traded for currency 2 across its offers. Amount is estimated
+    with best prices if offers are not enough, then it is returned with
+    False as not filled.
+    """
+    offers_unfilled, offers_filled = offers_lists
+    if (isinstance(offers_filled, OfferBook)
+            and isinstance(offers_unfilled, OfferBook)):
+        traded = offers_filled.simulator.usdt_for_fiat(filled_amount)
+        got = traded and offers_unfilled.simulator.fiat_for_usdt(
+            traded.usdt_amount)
+        if got:
+            return got.fiat_amount, True
+    return convert_amount(
+        filled_amount, get_best_price(offers_filled),
+        get_best_price(offers_unfilled)), False
+
+
+def rank_asset_conversions(assets: Sequence[str], results: list,
+                           filled_amount: float, is_to_amount_filled: bool
+                           ) -> List[AssetConversion]:
+    """Get conversions of assets from best one.
+
+    Results are offers lists or exceptions of assets. Best conversion
+    gives most of to currency for filled from amount, or costs least
+    of from currency for filled to amount. Conversions offers can't
+    fill go after filled ones, their amounts are only estimates. Raise
+    first exception if there is no conversion.
+    """
+    conversions = []
+    for asset, result in zip(assets, results):
+        if isinstance(result, BaseException):
+            logger.warning(f'no conversion through {asset}: {result!r}')
+            continue
+        conversions.append(AssetConversion(
+            asset, result, *get_unfilled_amount(result, filled_amount)))
+    if not conversions:
+        raise Exception(next(
+            (result for result in results
+             if not isinstance(result, TimeoutError)),
+            'Binance P2P Api request deadline exceeded.'))
+    conversions.sort(key=lambda conversion: conversion.amount,
+                     reverse=not is_to_amount_filled)
+    conversions.sort(key=lambda conversion: not conversion.filled)
+    logger.debug(
+        'conversion through assets: ' + ', '.join(
+            f'{conversion.asset} {conversion.amount}'
+            f'{"" if conversion.filled else " (not filled)"}'
+            for conversion in conversions))
+    return conversions
+
+
+def get_best_asset_offers_lists(currency_1, currency_2, payment_method_1,
+                                payment_method_2, is_merchant, filled_amount,
+                                is_to_amount_filled,
+                                assets: Sequence[str] = None
+                                ) -> List[AssetConversion]:
+    """Get conversions through every asset, from best one.
+
+    Conversions of assets are made in parallel, each one like in
+    get_best_offers_lists, so they take about as long as conversion
+    through one asset. All of them share BINANCE_P2P_FETCH_DEADLINE,
+    assets not converted in time are skipped and stop their requests.
+    Assets are set by BINANCE_P2P_ASSETS by default.
+    """
+    assets = assets or settings.BINANCE_P2P_ASSETS
+    conversion_args = (currency_1, currency_2, payment_method_1,
+                       payment_method_2, is_merchant, filled_amount,
+                       is_to_amount_filled)
+    deadline = time.monotonic() + settings.BINANCE_P2P_FETCH_DEADLINE
+    futures: List[Future] = [
+        get_asset_executor().submit(
+            get_best_offers_lists, *conversion_args, asset=asset,
+            deadline=deadline)
+        for asset in assets]
+    wait(futures, timeout=max(deadline - time.monotonic(), 0))
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=0))
+        except Exception as e:
+            future.cancel()
+            results.append(e)
+    return rank_asset_conversions(
+        assets, results, filled_amount, is_to_amount_filled)
+
+
+async def async_get_best_asset_offers_lists(currency_1, currency_2,
+                                            payment_method_1,
+                                            payment_method_2, is_merchant,
+                                            filled_amount,
+                                            is_to_amount_filled,
+                                            assets: Sequence[str] = None
+                                            ) -> List[AssetConversion]:
+    """Get conversions through every asset without blocking.
+
+    Same as get_best_asset_offers_lists, conversions of assets are
+    gathered concurrently, each within BINANCE_P2P_FETCH_DEADLINE.
+    """
+    assets = assets or settings.BINANCE_P2P_ASSETS
+    results = await asyncio.gather(
+        *(async_get_best_offers_lists(
+            currency_1, currency_2, payment_method_1, payment_method_2,
+            is_merchant, filled_amount, is_to_amount_filled, asset)
+          for asset in assets),
+        return_exceptions=True)
+    return rank_asset_conversions(
+        assets, results, filled_amount, is_to_amount_filled)
+
+
 def get_amount(filled_amount_1, price_1, offers_data_2) -> float:
     """Get max amount of currency 2 can be traded for set amount of currency 1.
 
     Buy USDT for set amount of currency 1. Than sell USDT for currency 2.
     """
+    return convert_amount(
+        filled_amount_1, price_1, get_best_price(offers_data_2))
+
+
+def convert_amount(filled_amount_1, price_1, price_2) -> float:
+    """Get amount of currency 2 for set amount of currency 1 and prices."""
     usdt_to_sell = filled_amount_1/price_1
-    price_2 = get_best_price(offers_data_2)
     return price_2 * usdt_to_sell
@@ -0,0 +1,213 @@
+"""Tracking of popular currency pairs and order books."""
+import hashlib
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from array import array
+from typing import Dict, Hashable, List, Tuple
+
+from django.conf import settings
+
+from .offers_utils import get_requests_params
+from .quote_cache import get_cache, quantize_amount
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_KEY = 'popularity:snapshots'
+
+
+class CountMinSketch():
+    """Approximate counts of keys in fixed memory.
+
+    Counts never underestimate, overestimate is bounded by width.
+    """
+
+    def __init__(self, width: int, depth: int) -> None:
+        self.width = width
+        self.depth = depth
+        self.rows = [array('d', [0.0]) * width for _ in range(depth)]
+
+    def _indexes(self, key: Hashable) -> List[int]:
+        digest = hashlib.blake2b(
+            repr(key).encode(), digest_size=8 * self.depth).digest()
+        return [
+            int.from_bytes(digest[8 * row:8 * (row + 1)], 'little')
+            % self.width
+            for row in range(self.depth)]
+
+    def add(self, key: Hashable, weight: float = 1.0) -> float:
+        """Add weight to key, return new estimated count."""
+        estimate = math.inf
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += weight
+            estimate = min(estimate, row[index])
+        return estimate
+
+    def estimate(self, key: Hashable) -> float:
+        """Return estimated count of key."""
+        return min(row[index]
+                   for row, index in zip(self.rows, self._indexes(key)))
+
+    def scale(self, factor: float) -> None:
+        """Multiply all counts by factor."""
+        for row in self.rows:
+            for index in range(self.width):
+                row[index] *= factor
+
+
+class PopularityTracker():
+    """Heavy hitters with exponentially time-decayed counts.
+
+    Counts are kept in count-min sketch, top keys are tracked in
+    bounded candidates table. Decay uses forward weights: later hits get
+    larger weight, so stored counts never need to be decayed one by one.
+    """
+
+    def __init__(self, name: str, capacity: int, half_life: float,
+                 width: int = 2048, depth: int = 4) -> None:
+        self.name = name
+        self.capacity = capacity
+        self.decay_rate = math.log(2) / half_life
+        self.sketch = CountMinSketch(width, depth)
+        self.top: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+        self._landmark = time.time()
+        self._published_at = 0.0
+
+    def _weight(self, now: float) -> float:
+        return math.exp(self.decay_rate * (now - self._landmark))
+
+    def _rescale(self, now: float) -> None:
+        """Move landmark to now to keep weights small."""
+        factor = 1 / self._weight(now)
+        self.sketch.scale(factor)
+        for key in self.top:
+            self.top[key] *= factor
+        self._landmark = now
+
+    def record(self, key: Hashable) -> None:
+        """Count hit of key."""
+        now = time.time()
+        with self._lock:
+            weight = self._weight(now)
+            if weight > 1e100:
+                self._rescale(now)
+                weight = 1.0
+            estimate = self.sketch.add(key, weight)
+            if key in self.top or len(self.top) < self.capacity:
+                self.top[key] = estimate
+            else:
+                min_key = min(self.top, key=self.top.__getitem__)
+                if estimate > self.top[min_key]:
+                    del self.top[min_key]
+                    self.top[key] = estimate
+            should_publish = (
+                now - self._published_at
+                > settings.POPULARITY_PUBLISH_INTERVAL)
+            if should_publish:
+                self._published_at = now
+        if should_publish:
+            self.publish()
+
+    def get_top(self, n: int = None) -> List[Tuple[Hashable, float]]:
+        """Return n most popular keys with counts decayed to now."""
+        with self._lock:
+            weight = self._weight(time.time())
+            items = sorted(self.top.items(), key=lambda item: item[1],
+                           reverse=True)
+        return [(key, count / weight) for key, count in items[:n]]
+
+    def publish(self) -> None:
+        """Store snapshot of top keys in shared cache for other processes."""
+        snapshot_key = (
+            f'popularity:{self.name}:{socket.gethostname()}:{os.getpid()}')
+        timeout = settings.POPULARITY_SNAPSHOT_TIMEOUT
+        cache = get_cache()
+        cache.set(snapshot_key, (time.time(), self.get_top()), timeout)
+        snapshot_keys = cache.get(SNAPSHOTS_KEY, set())
+        if snapshot_key not in snapshot_keys:
+            # Forget snapshots of stopped processes.
+            snapshot_keys = set(cache.get_many(snapshot_keys))
+            snapshot_keys.add(snapshot_key)
+            cache.set(SNAPSHOTS_KEY, snapshot_keys, None)
+
+    def get_shared_top(self, n: int = None) -> List[Tuple[Hashable, float]]:
+        """Return n most popular keys, merged from snapshots of processes."""
+        cache = get_cache()
+        prefix = f'popularity:{self.name}:'
+        snapshot_keys = [
+            key for key in cache.get(SNAPSHOTS_KEY, set())
+            if key.startswith(prefix)]
+        now = time.time()
+        counts: Dict[Hashable, float] = {}
+        for published_at, top in cache.get_many(snapshot_keys).values():
+            decay = math.exp(-self.decay_rate * (now - published_at))
+            for key, count in top:
+                counts[key] = counts.get(key, 0.0) + count * decay
+        return sorted(counts.items(), key=lambda item: item[1],
+                      reverse=True)[:n]
+
+
+pair_popularity = PopularityTracker(
+    'pairs',
+    capacity=settings.POPULARITY_CAPACITY,
+    half_life=settings.POPULARITY_HALF_LIFE)
+book_popularity = PopularityTracker(
+    'books',
+    capacity=settings.POPULARITY_CAPACITY,
+    half_life=settings.POPULARITY_HALF_LIFE)
+amount_popularity = PopularityTracker(
+    'amounts',
+    capacity=settings.POPULARITY_CAPACITY,
+    half_life=settings.POPULARITY_HALF_LIFE)
+currency_popularity = PopularityTracker(
+    'currencies',
+    capacity=settings.POPULARITY_CAPACITY,
+    half_life=settings.POPULARITY_HALF_LIFE)
+
+
+def record_conversion(*conversion_args) -> None:
+    """Count conversion pair and both order books it uses.
+
+    Takes same args as get_best_offers_lists. Pair is counted in
+    (from currency, from method, to currency, to method) order. Amount
+    bucket of filled amount is counted for its order book.
+    """
+    filled_amount_request, price_request, _ = get_requests_params(
+        *conversion_args)
+    is_to_amount_filled = conversion_args[-1]
+    from_request, to_request = (
+        (price_request, filled_amount_request) if is_to_amount_filled
+        else (filled_amount_request, price_request))
+    pair_popularity.record((
+        from_request['fiat_code'],
+        from_request['payment_method'],
+        to_request['fiat_code'],
+        to_request['payment_method'],
+    ))
+    for request in (from_request, to_request):
+        book_popularity.record((
+            request['fiat_code'],
+            request['payment_method'],
+            request['trade_type'],
+            request['is_merchant'],
+        ))
+    amount_popularity.record((
+        filled_amount_request['fiat_code'],
+        filled_amount_request['payment_method'],
+        filled_amount_request['trade_type'],
+        filled_amount_request['is_merchant'],
+        quantize_amount(filled_amount_request['trans_amount']),
+    ))
+
+
+def record_payment_methods_request(fiat_code: str) -> None:
+    """Count payment methods request of currency.
+
+    Discovery requests are not conversion order books, so they are
+    counted apart and not warmed as popular books.
+    """
+    currency_popularity.record(fiat_code)
@@ -0,0 +1,151 @@
+"""Cache for Binance P2P search responses."""
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'p2p_search'
+TRACKED_KEYS_LIMIT = 10000
+
+
+@dataclass
+class CacheStats():
+    """Counters of quote cache usage in current process."""
+
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class StaleResponse(str):
+    """Response text served while binance unavailable, age in seconds."""
+
+    def __new__(cls, response_text: str, age: float) -> 'StaleResponse':
+        stale_response = super().__new__(cls, response_text)
+        stale_response.age = age
+        return stale_response
+
+
+stats = CacheStats()
+_stats_lock = threading.Lock()
+# Keys stored by this process with their expiration time. Miss on a key
+# that should still be alive means backend evicted it.
+_stored_keys: 'OrderedDict[str, float]' = OrderedDict()
+
+
+def get_cache():
+    """Return cache backend configured for quotes."""
+    return caches[settings.BINANCE_P2P_CACHE_ALIAS]
+
+
+def quantize_amount(amount: float) -> float:
+    """Round amount down to configured number of significant digits.
+
+    Nearby amounts share cache entry, e.g. 2345 and 2399 become 2300
+    with precision 2. Precision None disables bucketing.
+    """
+    precision = settings.BINANCE_P2P_CACHE_AMOUNT_PRECISION
+    if not amount or precision is None:
+        return amount
+    exponent = math.floor(math.log10(abs(amount))) - precision + 1
+    step = 10 ** exponent
+    return math.floor(amount / step) * step
+
+
+def filter_response_by_amount(response_text: str, amount: float) -> str:
+    """Drop offers of response not accepting amount.
+
+    Response is requested for amount bucket, so its offers accept bucket
+    amount, but not always amount itself. Stale responses keep age.
+    """
+    if not amount or quantize_amount(amount) == amount:
+        return response_text
+    try:
+        response = json.loads(response_text)
+        raw_offers = response.get('data')
+        if not raw_offers:
+            return response_text
+        response['data'] = [
+            raw_offer for raw_offer in raw_offers
+            if float(raw_offer['adv']['minSingleTransAmount']) <= amount
+            <= float(raw_offer['adv'].get('dynamicMaxSingleTransAmount')
+                     or raw_offer['adv']['maxSingleTransAmount'])]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning(f'failed to filter offers by amount: {e}')
+        return response_text
+    filtered_text = json.dumps(response)
+    age = getattr(response_text, 'age', None)
+    if age is not None:
+        return StaleResponse(filtered_text, age)
+    return filtered_text
+
+
+def make_cache_key(data: dict) -> str:
+    """Make cache key from normalized search payload."""
+    normalized = dict(data)
+    normalized['transAmount'] = quantize_amount(data.get('transAmount'))
+    normalized['payTypes'] = sorted(data.get('payTypes') or [])
+    payload = json.dumps(normalized, sort_keys=True)
+    return f'{KEY_PREFIX}:{hashlib.md5(payload.encode()).hexdigest()}'
+
+
+def get_cached_response(key: str) -> Tuple[str, float]:
+    """Return cached response text and its age or None, update counters.
+
+    Responses older than BINANCE_P2P_CACHE_TTL are returned until
+    BINANCE_P2P_CACHE_STALE_TTL passes, caller should refresh them.
+    """
+    cached = get_cache().get(key)
+    with _stats_lock:
+        if cached is None:
+            stats.misses += 1
+            expires = _stored_keys.pop(key, None)
+            if expires is not None and time.monotonic() < expires:
+                stats.evictions += 1
+            return None
+        fetched_at, response_text = cached
+        age = time.time() - fetched_at
+        if age > settings.BINANCE_P2P_CACHE_TTL:
+            stats.stale_hits += 1
+        else:
+            stats.hits += 1
+    return response_text, age
+
+
+def set_cached_response(key: str, response_text: str) -> None:
+    """Store response text with time it was fetched."""
+    timeout = (settings.BINANCE_P2P_CACHE_TTL
+               + settings.BINANCE_P2P_CACHE_STALE_TTL)
+    get_cache().set(key, (time.time(), response_text), timeout)
+    with _stats_lock:
+        _stored_keys.pop(key, None)
+        _stored_keys[key] = time.monotonic() + timeout
+        while len(_stored_keys) > TRACKED_KEYS_LIMIT:
+            _stored_keys.popitem(last=False)
+
+
+def get_stats() -> dict:
+    """Return copy of cache counters."""
+    with _stats_lock:
+        return stats.as_dict()
+
+
+def reset_stats() -> None:
+    """Reset cache counters."""
+    with _stats_lock:
+        stats.hits = stats.stale_hits = stats.misses = stats.evictions = 0
+        _stored_keys.clear()
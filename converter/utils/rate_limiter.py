@@ -0,0 +1,228 @@
+"""Rate limiting of outgoing requests."""
+import enum
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LOCK_TIMEOUT = 1
+LOCK_POLL_INTERVAL = 0.005
+
+
+class Priority(enum.IntEnum):
+    """Priority classes of outgoing requests, lower value goes first."""
+
+    INTERACTIVE = 0
+    DISCOVERY = 1
+    BACKGROUND = 2
+
+
+class TokenBucket():
+    """Token bucket, refilled with rate tokens per second up to capacity.
+
+    Share reserve of capacity is kept for interactive requests:
+    requests of lower priority only take tokens while bucket holds more
+    than their part of reserve, so interactive requests preempt them
+    when bucket runs low. State is kept in memory of process.
+    """
+
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, rate: float, capacity: float = None,
+                 reserve: float = 0) -> None:
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.reserve = reserve
+        self._tokens = self.capacity
+        self._updated_at = self.clock()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            yield
+
+    def _load(self) -> Optional[Tuple[float, float]]:
+        """Return stored (tokens, updated_at) or None."""
+        return self._tokens, self._updated_at
+
+    def _store(self, tokens: float, updated_at: float) -> None:
+        self._tokens, self._updated_at = tokens, updated_at
+
+    def get_floor(self, tokens: float, priority: Priority) -> float:
+        """Get tokens left in bucket, below which priority is not served."""
+        share = priority / max(Priority)
+        return min(self.capacity * self.reserve * share,
+                   max(self.capacity - tokens, 0))
+
+    def try_acquire(self, tokens: float = 1,
+                    priority: Priority = Priority.INTERACTIVE) -> float:
+        """Take tokens if available.
+
+        Returns 0 if tokens taken, otherwise seconds to wait for them.
+        """
+        floor = self.get_floor(tokens, priority)
+        with self._locked():
+            now = self.clock()
+            stored = self._load()
+            if stored is None:
+                available = self.capacity
+            else:
+                available = min(
+                    self.capacity,
+                    stored[0] + max(now - stored[1], 0) * self.rate)
+            if available - tokens >= floor:
+                self._store(available - tokens, now)
+                return 0
+            self._store(available, now)
+        return (tokens + floor - available) / self.rate
+
+    def acquire(self, tokens: float = 1, timeout: float = None,
+                priority: Priority = Priority.INTERACTIVE) -> bool:
+        """Wait for tokens, return False if not acquired within timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_time = self.try_acquire(tokens, priority)
+            if not wait_time:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining < wait_time:
+                    return False
+            time.sleep(wait_time)
+
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket kept in file, shared by processes of one node.
+
+    Access is serialized with exclusive lock of file.
+    """
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, path: str, rate: float, capacity: float = None,
+                 reserve: float = 0) -> None:
+        super().__init__(rate, capacity, reserve)
+        self.path = path
+        self._file = None
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock, open(self.path, 'a+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            self._file = file
+            try:
+                yield
+            finally:
+                self._file = None
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _load(self) -> Optional[Tuple[float, float]]:
+        self._file.seek(0)
+        try:
+            tokens, updated_at = self._file.read().split()
+            return float(tokens), float(updated_at)
+        except ValueError:
+            return None
+
+    def _store(self, tokens: float, updated_at: float) -> None:
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(f'{tokens!r} {updated_at!r}')
+        self._file.flush()
+
+
+class CacheTokenBucket(TokenBucket):
+    """Token bucket kept in Django cache.
+
+    Shared by all processes using same cache backend, access is
+    serialized with lock key added to cache.
+    """
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, key: str, rate: float, capacity: float = None,
+                 reserve: float = 0, alias: str = 'default') -> None:
+        super().__init__(rate, capacity, reserve)
+        self.key = key
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        lock_key = f'{self.key}:lock'
+        with self._lock:
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while not self.cache.add(lock_key, os.getpid(), LOCK_TIMEOUT):
+                if time.monotonic() > deadline:
+                    logger.warning(f'taking over stale lock {lock_key}')
+                    break
+                time.sleep(LOCK_POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                self.cache.delete(lock_key)
+
+    def _load(self) -> Optional[Tuple[float, float]]:
+        return self.cache.get(self.key)
+
+    def _store(self, tokens: float, updated_at: float) -> None:
+        self.cache.set(self.key, (tokens, updated_at), None)
+
+
+_rate_limiter: TokenBucket = None
+_rate_limiter_lock = threading.Lock()
+
+
+def _create_rate_limiter() -> TokenBucket:
+    """Create rate limiter of outgoing binance requests from settings."""
+    backend = settings.BINANCE_P2P_RATE_LIMIT_BACKEND
+    options = {
+        'rate': settings.BINANCE_P2P_RATE_LIMIT,
+        'capacity': settings.BINANCE_P2P_RATE_LIMIT_BURST,
+        'reserve': settings.BINANCE_P2P_RATE_LIMIT_RESERVE,
+    }
+    if backend == 'file' and fcntl is None:
+        logger.warning('file locks unavailable, rate limit is per process')
+        backend = 'local'
+    if backend == 'file':
+        return FileTokenBucket(settings.BINANCE_P2P_RATE_LIMIT_PATH,
+                               **options)
+    if backend == 'cache':
+        return CacheTokenBucket('binance_p2p:rate_limit',
+                                alias=settings.BINANCE_P2P_CACHE_ALIAS,
+                                **options)
+    return TokenBucket(**options)
+
+
+def get_rate_limiter() -> Optional[TokenBucket]:
+    """Get rate limiter of outgoing binance requests, None if disabled."""
+    global _rate_limiter
+    if not settings.BINANCE_P2P_RATE_LIMIT:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = _create_rate_limiter()
+        return _rate_limiter
+
+
+def reset_rate_limiter() -> None:
+    """Drop rate limiter, so it is created again from settings."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        _rate_limiter = None
@@ -0,0 +1,99 @@
+"""Reference prices of order books, used to estimate conversion amounts."""
+import json
+import logging
+import time
+from typing import Dict, Iterable, Tuple
+
+from django.conf import settings
+
+from ..models import DEFAULT_ASSET
+from .offer_book import OfferBook
+from .quote_cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'reference_price'
+
+
+def make_key(fiat_code: str, payment_method: str, trade_type: str,
+             is_merchant: bool, asset: str = DEFAULT_ASSET) -> str:
+    publisher = 'merchant' if is_merchant else 'any'
+    return (f'{KEY_PREFIX}:{fiat_code}:{payment_method or ""}:'
+            f'{trade_type}:{publisher}:{asset}')
+
+
+def get_reference_price(fiat_code: str, payment_method: str,
+                        trade_type: str, is_merchant: bool = False,
+                        asset: str = DEFAULT_ASSET) -> float:
+    """Return best price seen less than TTL seconds ago, or None."""
+    stored = get_cache().get(
+        make_key(fiat_code, payment_method, trade_type, is_merchant, asset))
+    if stored is None:
+        return None
+    updated_at, price = stored
+    if time.time() - updated_at > settings.BINANCE_P2P_REFERENCE_PRICE_TTL:
+        return None
+    return price
+
+
+def set_reference_prices(fiat_code: str, payment_method: str,
+                         trade_type: str,
+                         prices: Iterable[Tuple[bool, float]],
+                         asset: str = DEFAULT_ASSET) -> None:
+    """Store best prices of order book, for every merchant filter."""
+    now = time.time()
+    values: Dict[str, tuple] = {
+        make_key(fiat_code, payment_method, trade_type, is_merchant, asset):
+        (now, price)
+        for is_merchant, price in prices if price is not None}
+    if values:
+        get_cache().set_many(
+            values, settings.BINANCE_P2P_REFERENCE_PRICE_TTL)
+
+
+def update_from_book(fiat_code: str, payment_method: str, trade_type: str,
+                     book: OfferBook, is_merchant: bool = False) -> None:
+    """Update reference prices with best prices of parsed book.
+
+    Book requested without merchant filter also gives best price of
+    merchant offers. Stale books are ignored. Prices are stored for
+    asset of book offers.
+    """
+    if not book or book.age is not None:
+        return
+    prices = [(is_merchant, book.best_price())]
+    if not is_merchant:
+        prices.append((True, next(
+            (price for price, merchant in zip(book.price, book.is_merchant)
+             if merchant), None)))
+    set_reference_prices(fiat_code, payment_method, trade_type, prices,
+                         book.asset or DEFAULT_ASSET)
+
+
+def update_from_response(data: dict, response_text: str) -> None:
+    """Update reference prices with first page of search response.
+
+    Offers of response are sorted from best price by binance. Responses
+    filtered by amount are skipped.
+    """
+    if (data.get('page', 1) != 1 or len(data.get('payTypes') or []) > 1
+            or data.get('transAmount') is not None):
+        return
+    try:
+        raw_offers = json.loads(response_text).get('data') or []
+        is_merchant = data.get('publisherType') == 'merchant'
+        prices = []
+        if raw_offers:
+            prices.append(
+                (is_merchant, float(raw_offers[0]['adv']['price'])))
+        if raw_offers and not is_merchant:
+            prices.append((True, next(
+                (float(raw_offer['adv']['price']) for raw_offer in raw_offers
+                 if raw_offer['advertiser']['userType'] == 'merchant'),
+                None)))
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f'failed to read reference price: {e}')
+        return
+    set_reference_prices(
+        data['fiat'], (data.get('payTypes') or [None])[0],
+        data['tradeType'], prices, data.get('asset', DEFAULT_ASSET))
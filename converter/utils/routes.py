@@ -0,0 +1,235 @@
+"""Best conversion routes through fiats and P2P assets."""
+import logging
+import time
+from concurrent.futures import wait
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from ..exceptions import ApiUnavailableError
+from ..models import TradeType
+from .binance_api import MAX_ROWS, get_p2p_offers_data
+from .json_parser import get_offer_book_from_json
+from .offer_book import OfferBook
+from .offers_utils import get_executor
+
+logger = logging.getLogger(__name__)
+
+
+class BookKey(NamedTuple):
+    """Order book of fiat and asset, edge of route graph.
+
+    BUY book trades fiat for asset, SELL book trades asset for fiat.
+    """
+
+    fiat_code: str
+    asset: str
+    trade_type: str
+    payment_method: str = None
+
+    @property
+    def source(self) -> str:
+        if self.trade_type == TradeType.BUY:
+            return self.fiat_code
+        return self.asset
+
+    @property
+    def target(self) -> str:
+        if self.trade_type == TradeType.BUY:
+            return self.asset
+        return self.fiat_code
+
+
+class RouteHop(NamedTuple):
+    """Trade of amount_in of source for amount_out of target."""
+
+    book: BookKey
+    amount_in: float
+    amount_out: float
+
+    @property
+    def rate(self) -> float:
+        return self.amount_out / self.amount_in
+
+
+class Route(NamedTuple):
+    """Path from fiat to fiat and amount expected at its end."""
+
+    hops: Tuple[RouteHop, ...]
+
+    @property
+    def path(self) -> List[str]:
+        return [self.hops[0].book.source,
+                *(hop.book.target for hop in self.hops)]
+
+    @property
+    def from_amount(self) -> float:
+        return self.hops[0].amount_in
+
+    @property
+    def amount(self) -> float:
+        return self.hops[-1].amount_out
+
+    @property
+    def rate(self) -> float:
+        return self.amount / self.from_amount
+
+    def as_dict(self) -> dict:
+        return {
+            'path': self.path,
+            'from_amount': self.from_amount,
+            'amount': self.amount,
+            'rate': self.rate,
+            'hops': [
+                {
+                    'from': hop.book.source,
+                    'to': hop.book.target,
+                    'trade_type': hop.book.trade_type,
+                    'payment_method': hop.book.payment_method,
+                    'amount_in': hop.amount_in,
+                    'amount_out': hop.amount_out,
+                    'rate': hop.rate,
+                }
+                for hop in self.hops],
+        }
+
+
+def trade(book: OfferBook, trade_type: str, amount: float) -> Optional[float]:
+    """Get amount got for amount walking book, None if it is too thin.
+
+    Fiat amount buys asset in BUY book, asset amount is sold for fiat
+    in SELL book.
+    """
+    if trade_type == TradeType.BUY:
+        fill = book.simulator.usdt_for_fiat(amount)
+        return fill and fill.usdt_amount
+    fill = book.simulator.fiat_for_usdt(amount)
+    return fill and fill.fiat_amount
+
+
+def solve(books: Dict[BookKey, OfferBook], from_code: str, to_code: str,
+          amount: float, max_hops: int) -> Optional[Route]:
+    """Find route giving most of to_code for amount of from_code.
+
+    Bellman-Ford over amounts with hop limit: after k rounds every
+    node holds best amount reachable in at most k trades. Amount got
+    from book grows with amount given, so best amount at node always
+    gives best amounts further, like shortest paths with -log(rate)
+    weights, but rates of every edge are effective rates of walking
+    book with amount actually reaching it. Routes do not visit node
+    twice.
+    """
+    best: Dict[str, Tuple[float, Tuple[RouteHop, ...]]] = {
+        from_code: (amount, ())}
+    for _ in range(max_hops):
+        relaxed = dict(best)
+        for key, book in books.items():
+            source, target = key.source, key.target
+            if (source not in best or source == to_code
+                    or target == from_code):
+                continue
+            amount_in, hops = best[source]
+            if any(hop.book.source == target for hop in hops):
+                continue
+            amount_out = trade(book, key.trade_type, amount_in)
+            if amount_out and amount_out > relaxed.get(target, (0,))[0]:
+                relaxed[target] = (
+                    amount_out, (*hops, RouteHop(key, amount_in, amount_out)))
+        if relaxed == best:
+            break
+        best = relaxed
+    if to_code not in best or not best[to_code][1]:
+        return None
+    return Route(best[to_code][1])
+
+
+def get_route_book_keys(from_code: str, to_code: str,
+                        from_payment_method: str = None,
+                        to_payment_method: str = None,
+                        via_codes: Sequence[str] = (),
+                        assets: Sequence[str] = ()) -> List[BookKey]:
+    """Get books of route graph.
+
+    From currency is only sold and to currency only bought with their
+    payment methods, via currencies are traded both ways with any one.
+    """
+    keys = []
+    for asset in assets:
+        keys.append(BookKey(
+            from_code, asset, TradeType.BUY, from_payment_method))
+        keys.append(BookKey(
+            to_code, asset, TradeType.SELL, to_payment_method))
+        for via_code in via_codes:
+            if via_code in (from_code, to_code):
+                continue
+            keys.append(BookKey(via_code, asset, TradeType.BUY))
+            keys.append(BookKey(via_code, asset, TradeType.SELL))
+    return keys
+
+
+def fetch_book(key: BookKey, is_merchant: bool = False) -> str:
+    """Get response text of first page of book, cached like others."""
+    return get_p2p_offers_data(
+        fiat_code=key.fiat_code,
+        is_merchant=is_merchant,
+        payment_method=key.payment_method,
+        trade_type=key.trade_type,
+        rows=MAX_ROWS,
+        asset=key.asset)
+
+
+def fetch_books(keys: Sequence[BookKey], is_merchant: bool = False,
+                deadline: float = None) -> Dict[BookKey, OfferBook]:
+    """Get books concurrently, books not fetched in time are skipped.
+
+    Responses are parsed in calling thread. Books failed to fetch or
+    parse are skipped too, so one bad edge doesn't fail whole graph.
+    """
+    futures = {
+        key: get_executor().submit(fetch_book, key, is_merchant)
+        for key in keys}
+    wait(futures.values(), timeout=(
+        None if deadline is None else max(deadline - time.monotonic(), 0)))
+    books = {}
+    for key, future in futures.items():
+        try:
+            books[key] = get_offer_book_from_json(
+                future.result(timeout=0), offer_type=key.trade_type)
+        except Exception as e:
+            future.cancel()
+            logger.warning(f'no route book {key}: {e!r}')
+    return books
+
+
+def find_best_route(from_code: str, to_code: str, amount: float,
+                    from_payment_method: str = None,
+                    to_payment_method: str = None,
+                    is_merchant: bool = False,
+                    via_codes: Sequence[str] = None,
+                    assets: Sequence[str] = None,
+                    max_hops: int = None) -> Optional[Route]:
+    """Find best route of converting amount of from_code to to_code.
+
+    Books of every asset are fetched concurrently, with shared
+    BINANCE_P2P_FETCH_DEADLINE. Intermediate assets, currencies and
+    hop limit are set by BINANCE_P2P_ROUTE_* settings by default.
+    Returns None if there is no route, raises ApiUnavailableError if
+    no book was fetched.
+    """
+    if via_codes is None:
+        via_codes = settings.BINANCE_P2P_ROUTE_VIA
+    assets = assets or settings.BINANCE_P2P_ROUTE_ASSETS
+    max_hops = max_hops or settings.BINANCE_P2P_ROUTE_MAX_HOPS
+    keys = get_route_book_keys(from_code, to_code, from_payment_method,
+                               to_payment_method, via_codes, assets)
+    books = fetch_books(
+        keys, is_merchant,
+        deadline=time.monotonic() + settings.BINANCE_P2P_FETCH_DEADLINE)
+    if keys and not books:
+        raise ApiUnavailableError('Route books are unavailable.')
+    started_at = time.perf_counter()
+    route = solve(books, from_code, to_code, amount, max_hops)
+    logger.debug(
+        f'solved route {from_code} to {to_code} over {len(books)} books '
+        f'in {(time.perf_counter() - started_at) * 1000:.1f}ms')
+    return route
@@ -0,0 +1,89 @@
+"""Coalescing of identical concurrent calls."""
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Call():
+    """Call in flight, waited by duplicate callers."""
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.duplicates = 0
+
+
+class SingleFlight():
+    """Run only one call per key at a time, share result with duplicates.
+
+    Threads use do(), coroutines use do_async(). Callers arriving while
+    call with same key is in flight wait for it and get its result or
+    its exception, instead of making own call.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Call fn or wait for in flight call with same key."""
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.duplicates += 1
+        if not is_leader:
+            logger.debug(f'waiting for in flight call {key}')
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def do_async(self, key: Hashable,
+                       fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() or in flight awaitable with same key.
+
+        Call runs in own task, so cancelled caller doesn't cancel it
+        for others.
+        """
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        task = self._async_calls.get(loop_key)
+        if task is not None:
+            logger.debug(f'waiting for in flight call {key}')
+        else:
+            task = asyncio.ensure_future(fn())
+            self._async_calls[loop_key] = task
+
+            def done(task: asyncio.Future) -> None:
+                if self._async_calls.get(loop_key) is task:
+                    del self._async_calls[loop_key]
+                # Retrieve exception, so unawaited task is not reported.
+                if not task.cancelled():
+                    task.exception()
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        """Return number of calls currently in flight."""
+        with self._lock:
+            return len(self._calls) + len(self._async_calls)
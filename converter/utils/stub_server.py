@@ -0,0 +1,151 @@
+"""Local HTTP server mimicking Binance P2P search endpoint."""
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+from .binance_api import MAX_ROWS
+from .synthetic_book import (filter_offers, generate_offers,
+                             make_search_response)
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PATH = '/bapi/c2c/v2/friendly/c2c/adv/search'
+STATS_PATH = '/stats'
+
+
+@dataclass
+class StubOptions:
+    """Behaviour of stub server.
+
+    Latency and jitter are in seconds, share of error_rate requests
+    fails with error_status.
+    """
+
+    depth: int = 200
+    latency: float = 0
+    jitter: float = 0
+    error_rate: float = 0
+    error_status: int = HTTPStatus.SERVICE_UNAVAILABLE
+    seed: int = 0
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    server: 'StubServer'
+
+    def do_POST(self) -> None:
+        if self.path != SEARCH_PATH:
+            self.send_json(HTTPStatus.NOT_FOUND, {'success': False})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'success': False})
+            return
+        status, response = self.server.search(payload)
+        self.send_json(status, response)
+
+    def do_GET(self) -> None:
+        if self.path != STATS_PATH:
+            self.send_json(HTTPStatus.NOT_FOUND, {'success': False})
+            return
+        self.send_json(HTTPStatus.OK, self.server.get_stats())
+
+    def do_DELETE(self) -> None:
+        if self.path != STATS_PATH:
+            self.send_json(HTTPStatus.NOT_FOUND, {'success': False})
+            return
+        self.server.reset_stats()
+        self.send_json(HTTPStatus.OK, self.server.get_stats())
+
+    def send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+
+class StubServer(ThreadingHTTPServer):
+    """Serve synthetic order books on binance search path.
+
+    Books are generated from seed, so every run serves same offers.
+    Pagination, payment method, amount and merchant filters work like
+    in binance. Requests are counted, counters are served on /stats and
+    reset by DELETE request to it.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int],
+                 options: StubOptions = None) -> None:
+        super().__init__(address, StubRequestHandler)
+        self.options = options or StubOptions()
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._random = random.Random(self.options.seed)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name: str) -> None:
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self.stats.clear()
+
+    def search(self, payload: dict) -> Tuple[int, dict]:
+        """Return status and response of search request."""
+        self.count('requests')
+        options = self.options
+        with self._stats_lock:
+            delay = options.latency + self._random.uniform(
+                0, options.jitter)
+            is_failed = self._random.random() < options.error_rate
+        if delay:
+            time.sleep(delay)
+        if is_failed:
+            self.count('errors')
+            return options.error_status, {'success': False}
+        offers = filter_offers(
+            generate_offers(
+                payload.get('fiat', ''), payload.get('tradeType', 'BUY'),
+                options.depth, asset=payload.get('asset', 'USDT'),
+                seed=options.seed),
+            payment_methods=payload.get('payTypes'),
+            trans_amount=(
+                float(payload['transAmount'])
+                if payload.get('transAmount') else None),
+            is_merchant=payload.get('publisherType') == 'merchant')
+        rows = min(int(payload.get('rows') or 10), MAX_ROWS)
+        start = (max(int(payload.get('page') or 1), 1) - 1) * rows
+        return HTTPStatus.OK, make_search_response(
+            offers[start:start + rows], total=len(offers))
+
+
+def start_stub_server(host: str = '127.0.0.1', port: int = 0,
+                      options: StubOptions = None) -> StubServer:
+    """Start stub server in daemon thread, port 0 picks free port."""
+    server = StubServer((host, port), options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'binance stub server started on {server.url}')
+    return server
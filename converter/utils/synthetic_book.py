@@ -0,0 +1,114 @@
+"""Synthetic Binance P2P order books for stub server and benchmarks."""
+import random
+from functools import lru_cache
+from typing import List, Tuple
+
+from ..models import TradeType
+
+PAYMENT_METHODS = (
+    ('TinkoffNew', 'Tinkoff'),
+    ('RosBankNew', 'Rosbank'),
+    ('QIWI', 'QIWI'),
+    ('YandexMoneyNew', 'Yandex.Money'),
+    ('Payeer', 'Payeer'),
+    ('Advcash', 'AdvCash'),
+    ('BANK', 'Bank Transfer'),
+    ('Ziraat', 'Ziraat'),
+    ('Papara', 'Papara'),
+    ('KaspiBank', 'Kaspi Bank'),
+)
+MIN_ORDER_USDT = (10, 20, 50, 100, 500)
+MERCHANT_SHARE = 0.3
+# Price step between neighbour offers, share of base price.
+PRICE_STEP = 0.0005
+
+
+def get_base_price(fiat_code: str, asset: str = 'USDT',
+                   seed: int = 0) -> float:
+    """Get price of asset in fiat, fixed for seed."""
+    return round(random.Random(f'{seed}:{fiat_code}:{asset}').uniform(
+        1, 100), 2)
+
+
+@lru_cache(maxsize=256)
+def generate_offers(fiat_code: str, trade_type: str, depth: int,
+                    asset: str = 'USDT', seed: int = 0,
+                    base_price: float = None) -> Tuple[dict]:
+    """Generate book of depth offers, as 'data' items of search response.
+
+    Offers are ordered from best price to worst for trade type of
+    request: ascending for BUY, descending for SELL. Same arguments
+    always give same book. Returned offers are shared, do not modify.
+    """
+    rng = random.Random(f'{seed}:{fiat_code}:{asset}:{trade_type}')
+    base_price = base_price or get_base_price(fiat_code, asset, seed)
+    is_buy = trade_type == TradeType.BUY
+    direction = 1 if is_buy else -1
+    offer_trade_type = TradeType.SELL if is_buy else TradeType.BUY
+    price = base_price * (1 + direction * PRICE_STEP)
+    offers = []
+    for _ in range(depth):
+        price += direction * rng.uniform(0, base_price * PRICE_STEP)
+        funds = rng.uniform(50, 20000)
+        max_amount = funds * price
+        min_amount = min(rng.choice(MIN_ORDER_USDT) * price, max_amount)
+        trade_methods = rng.sample(PAYMENT_METHODS, rng.randint(1, 3))
+        is_merchant = rng.random() < MERCHANT_SHARE
+        offers.append({
+            'adv': {
+                'advNo': str(rng.getrandbits(64)),
+                'tradeType': offer_trade_type,
+                'asset': asset,
+                'fiatUnit': fiat_code,
+                'price': f'{price:.2f}',
+                'surplusAmount': f'{funds:.2f}',
+                'maxSingleTransAmount': f'{max_amount:.2f}',
+                'minSingleTransAmount': f'{min_amount:.2f}',
+                'dynamicMaxSingleTransAmount': f'{max_amount:.2f}',
+                'tradeMethods': [
+                    {
+                        'identifier': identifier,
+                        'tradeMethodName': name,
+                        'tradeMethodShortName': name,
+                    }
+                    for identifier, name in trade_methods],
+                'isTradable': True,
+            },
+            'advertiser': {
+                'userNo': f's{rng.getrandbits(128):032x}',
+                'nickName': f'Trader{rng.randint(1, 10 ** 6)}',
+                'monthOrderCount': rng.randint(0, 3000),
+                'monthFinishRate': round(rng.uniform(0.8, 1), 3),
+                'userType': 'merchant' if is_merchant else 'user',
+            },
+        })
+    return tuple(offers)
+
+
+def filter_offers(offers: Tuple[dict], payment_methods: List[str] = None,
+                  trans_amount: float = None,
+                  is_merchant: bool = False) -> List[dict]:
+    """Filter offers like binance search does."""
+    return [
+        offer for offer in offers
+        if (not payment_methods or any(
+            method['identifier'] in payment_methods
+            for method in offer['adv']['tradeMethods']))
+        and (trans_amount is None or (
+            float(offer['adv']['minSingleTransAmount'])
+            <= trans_amount
+            <= float(offer['adv']['dynamicMaxSingleTransAmount'])))
+        and (not is_merchant
+             or offer['advertiser']['userType'] == 'merchant')]
+
+
+def make_search_response(offers: List[dict], total: int = None) -> dict:
+    """Make successful search response with offers."""
+    return {
+        'code': '000000',
+        'message': None,
+        'messageDetail': None,
+        'data': offers,
+        'total': len(offers) if total is None else total,
+        'success': True,
+    }
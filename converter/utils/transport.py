@@ -0,0 +1,87 @@
+"""Transports recording binance responses to fixtures and replaying them."""
+import hashlib
+import json
+import logging
+import os
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+def get_fixture_path(fixtures_dir: str, url: str, payload: dict) -> str:
+    """Get fixture file of request, same for same endpoint and payload."""
+    request = {'path': urlsplit(url).path, 'payload': payload}
+    name = hashlib.md5(
+        json.dumps(request, sort_keys=True).encode()).hexdigest()
+    return os.path.join(fixtures_dir, f'{name}.json')
+
+
+def save_fixture(fixtures_dir: str, url: str, payload: dict,
+                 response_text: str) -> str:
+    """Save response of request to fixture file and return its path."""
+    os.makedirs(fixtures_dir, exist_ok=True)
+    path = get_fixture_path(fixtures_dir, url, payload)
+    fixture = {
+        'path': urlsplit(url).path,
+        'request': payload,
+        'response': response_text,
+    }
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(fixture, file, ensure_ascii=False, indent=1)
+    os.replace(temp_path, path)
+    return path
+
+
+def load_fixture(fixtures_dir: str, url: str, payload: dict) -> str:
+    """Load response text of request, None if it was not recorded."""
+    path = get_fixture_path(fixtures_dir, url, payload)
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)['response']
+    except FileNotFoundError:
+        return None
+
+
+class RecordingTransport():
+    """Send requests with session and save successful responses."""
+
+    def __init__(self, session: requests.Session, fixtures_dir: str) -> None:
+        self.session = session
+        self.fixtures_dir = fixtures_dir
+
+    def post(self, url: str, json: dict = None,
+             **kwargs) -> requests.Response:
+        response = self.session.post(url, json=json, **kwargs)
+        if response.status_code == HTTPStatus.OK:
+            path = save_fixture(self.fixtures_dir, url, json, response.text)
+            logger.debug(f'recorded response to {path}')
+        return response
+
+
+class ReplayTransport():
+    """Return recorded responses without sending requests.
+
+    Requests that were not recorded get 404 response.
+    """
+
+    def __init__(self, fixtures_dir: str) -> None:
+        self.fixtures_dir = fixtures_dir
+
+    def post(self, url: str, json: dict = None,
+             **kwargs) -> requests.Response:
+        response = requests.Response()
+        response.url = url
+        response.encoding = 'utf-8'
+        response_text = load_fixture(self.fixtures_dir, url, json)
+        if response_text is None:
+            logger.warning(f'no recorded response for {json}')
+            response.status_code = HTTPStatus.NOT_FOUND
+            response._content = b''
+        else:
+            response.status_code = HTTPStatus.OK
+            response._content = response_text.encode('utf-8')
+        return response
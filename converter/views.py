@@ -1,19 +1,48 @@
+import asyncio
 import logging
+from typing import List
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404, render
+from django.db.models import Max
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import render
+from django.utils import timezone
 
 from .exceptions import (ApiUnavailableError, BinanceApiError,
                          OffersNotFoundError)
-from .forms import ConverterForm
-from .models import Currency, TradeType
-from .utils.binance_api import get_p2p_offers_data
+from .forms import BEST_ASSET, ConverterForm
+from .models import DEFAULT_ASSET, PaymentMethod, TradeType
+from .utils.background import run_in_background
+from .utils.binance_api import async_get_p2p_offers_data, get_p2p_offers_data
+from .utils.circuit_breaker import get_circuit_breakers_state
+from .utils.cross_rates import get_cross_rates
+from .utils.currency_registry import get_currency_or_404
 from .utils.json_parser import get_payment_methods_from_json
-from .utils.offers_utils import get_best_offers_lists, get_best_price
+from .utils.offers_utils import (AssetConversion,
+                                 async_get_best_asset_offers_lists,
+                                 async_get_best_offers_lists,
+                                 get_best_asset_offers_lists,
+                                 get_best_offers_lists, get_best_price,
+                                 get_conversion_fill)
+from .utils.popularity import (book_popularity, currency_popularity,
+                               pair_popularity, record_conversion,
+                               record_payment_methods_request)
+from .utils.quote_cache import get_stats as get_cache_stats
+from .utils.rate_limiter import Priority
+from .utils.routes import find_best_route
 
 logger = logging.getLogger(__name__)
 
+CURRENCY_PAYMENT_METHOD_FIELD = {
+    'from_currency': 'from_payment_methods',
+    'to_currency': 'to_payment_methods',
+}
+PAYMENT_METHODS_NOT_FOUND_MESSAGE = (
+    '<option>Payment methods for {0} does not exist.</option>')
+EMPTY_PAYMENT_METHODS_RESPONSE = '<option value="">---------</option>'
+
 
 def index(request) -> HttpResponse:
     """Handle requests to main converter page."""
@@ -33,38 +62,266 @@ def get_payment_methods(request) -> HttpResponse:
     will trigger forms method to fetch payment methods for this currency,
     and assign resulting queryset to choicefield queryset, that will be
     returned as HTML.
+    Stored payment methods are served without request to binance,
+    stale ones are refreshed in background.
     """
     form: ConverterForm = ConverterForm(request.GET)
-    currency_payment_method_field = {
-        'from_currency': 'from_payment_methods',
-        'to_currency': 'to_payment_methods',
-    }
-    error_message = (
-        '<option>Payment methods for {0} does not exist.</option>')
-    for currency_type, payment_method in currency_payment_method_field.items():
+    for currency_type, payment_method in CURRENCY_PAYMENT_METHOD_FIELD.items():
         if currency_type in request.GET.keys():
-            currency = get_object_or_404(
-                Currency, pk=request.GET.get(currency_type))
+            currency = get_currency_or_404(pk=request.GET.get(currency_type))
             logger.info(f'requested payment methods for {currency.code}')
-            try:
-                json_buy = get_p2p_offers_data(
-                    fiat_code=currency.code, is_merchant=True, trade_type=TradeType.BUY, rows=10)
-                json_sell = get_p2p_offers_data(
-                    fiat_code=currency.code, is_merchant=True, trade_type=TradeType.SELL, rows=10)
-            except ApiUnavailableError as e:
-                return HttpResponse(f'<option>{e}</option>')
-            try:
-                get_payment_methods_from_json(json_buy)
-                get_payment_methods_from_json(json_sell)
-            except OffersNotFoundError:
-                logger.info(f'no payment methods found for {currency.code}')
-                return HttpResponse(error_message.format(currency.code))
-            except BinanceApiError as e:
-                logger.error(e)
-                return HttpResponse(f'<option>{e}</option>')
+            record_payment_methods_request(currency.code)
+            if not check_stored_payment_methods(currency):
+                error_response = refresh_payment_methods(currency)
+                if error_response:
+                    return HttpResponse(error_response)
             return HttpResponse(form[payment_method])
     logger.error('HTMX created empty request.')
-    return HttpResponse('<option value="">---------</option>')
+    return HttpResponse(EMPTY_PAYMENT_METHODS_RESPONSE)
+
+
+async def async_get_payment_methods(request) -> HttpResponse:
+    """Return payment method options for requested currency.
+
+    Same as get_payment_methods, BUY and SELL requests are made
+    concurrently without blocking worker.
+    """
+    form: ConverterForm = await sync_to_async(ConverterForm)(request.GET)
+    for currency_type, payment_method in CURRENCY_PAYMENT_METHOD_FIELD.items():
+        if currency_type in request.GET.keys():
+            currency = await sync_to_async(get_currency_or_404)(
+                pk=request.GET.get(currency_type))
+            logger.info(f'requested payment methods for {currency.code}')
+            await sync_to_async(record_payment_methods_request)(
+                currency.code)
+            if not await sync_to_async(check_stored_payment_methods)(
+                    currency):
+                error_response = await async_refresh_payment_methods(
+                    currency)
+                if error_response:
+                    return HttpResponse(error_response)
+            return await sync_to_async(HttpResponse)(form[payment_method])
+    logger.error('HTMX created empty request.')
+    return HttpResponse(EMPTY_PAYMENT_METHODS_RESPONSE)
+
+
+def check_stored_payment_methods(currency) -> bool:
+    """Check if currency has stored payment methods.
+
+    Stored payment methods older than PAYMENT_METHODS_TTL are
+    refreshed in background.
+    """
+    latest_update = PaymentMethod.objects.filter(
+        currency=currency).aggregate(
+            latest_update=Max('date_updated'))['latest_update']
+    if latest_update is None:
+        return False
+    age = (timezone.now() - latest_update).total_seconds()
+    if age > settings.PAYMENT_METHODS_TTL:
+        logger.info(f'payment methods for {currency.code} are stale')
+        run_in_background(
+            ('payment_methods', currency.code),
+            lambda: refresh_payment_methods(currency, Priority.BACKGROUND))
+    return True
+
+
+def refresh_payment_methods(currency,
+                            priority: Priority = Priority.DISCOVERY) -> str:
+    """Request payment methods of currency from binance and store them.
+
+    Returns error select option or None if updated successfully.
+    """
+    try:
+        json_buy = get_p2p_offers_data(
+            fiat_code=currency.code, is_merchant=True, trade_type=TradeType.BUY, rows=10,
+            priority=priority)
+        json_sell = get_p2p_offers_data(
+            fiat_code=currency.code, is_merchant=True, trade_type=TradeType.SELL, rows=10,
+            priority=priority)
+    except ApiUnavailableError as e:
+        return f'<option>{e}</option>'
+    return update_payment_methods(currency, json_buy, json_sell)
+
+
+async def async_refresh_payment_methods(currency) -> str:
+    """Request payment methods of currency and store them without blocking.
+
+    BUY and SELL requests are made concurrently.
+    """
+    try:
+        json_buy, json_sell = await asyncio.gather(
+            async_get_p2p_offers_data(
+                fiat_code=currency.code, is_merchant=True,
+                trade_type=TradeType.BUY, rows=10,
+                priority=Priority.DISCOVERY),
+            async_get_p2p_offers_data(
+                fiat_code=currency.code, is_merchant=True,
+                trade_type=TradeType.SELL, rows=10,
+                priority=Priority.DISCOVERY))
+    except ApiUnavailableError as e:
+        return f'<option>{e}</option>'
+    return await sync_to_async(update_payment_methods)(
+        currency, json_buy, json_sell)
+
+
+def update_payment_methods(currency, json_buy, json_sell) -> str:
+    """Parse payment methods from responses.
+
+    Returns error select option or None if parsed successfully.
+    """
+    try:
+        get_payment_methods_from_json(json_buy)
+        get_payment_methods_from_json(json_sell)
+    except OffersNotFoundError:
+        logger.info(f'no payment methods found for {currency.code}')
+        return PAYMENT_METHODS_NOT_FOUND_MESSAGE.format(currency.code)
+    except BinanceApiError as e:
+        logger.error(e)
+        return f'<option>{e}</option>'
+    return None
+
+
+def get_conversion_args(form: ConverterForm) -> tuple:
+    """Get get_best_offers_lists args for valid converter form."""
+    to_amount_filled = True if form.cleaned_data.get(
+        'to_amount') else False
+    from_currency = form.cleaned_data.get('from_currency')
+    to_currency = form.cleaned_data.get('to_currency')
+    from_payment_method = form.cleaned_data.get('from_payment_methods')
+    to_payment_method = form.cleaned_data.get('to_payment_methods')
+    is_merchant = form.cleaned_data.get('is_merchant')
+    filled_amount = (form.cleaned_data.get('to_amount') if to_amount_filled
+                     else form.cleaned_data.get('from_amount'))
+    if to_amount_filled:
+        logger.info(
+            f'requested conversion '
+            f'{from_currency.code}'
+            f'[{from_payment_method.display_name}] -> '
+            f'({filled_amount}){to_currency.code}'
+            f'[{to_payment_method.display_name}]')
+        return (to_currency, from_currency, to_payment_method,
+                from_payment_method, is_merchant, filled_amount,
+                to_amount_filled)
+    logger.info(
+        f'requested conversion '
+        f'({filled_amount}){from_currency.code}'
+        f'[{from_payment_method.display_name}] -> '
+        f'{to_currency.code}[{to_payment_method.display_name}]')
+    return (from_currency, to_currency, from_payment_method,
+            to_payment_method, is_merchant, filled_amount,
+            to_amount_filled)
+
+
+def get_conversion_offers_lists(form: ConverterForm, conversion_args: tuple):
+    """Get best offers lists for asset of valid converter form.
+
+    In best of mode conversions through all assets are compared, returns
+    offers lists of best one and all conversions, from best one.
+    """
+    asset = form.cleaned_data.get('asset')
+    if asset == BEST_ASSET:
+        asset_conversions = get_best_asset_offers_lists(*conversion_args)
+        return asset_conversions[0].offers_lists, asset_conversions
+    return get_best_offers_lists(*conversion_args, asset=asset), None
+
+
+async def async_get_conversion_offers_lists(form: ConverterForm,
+                                            conversion_args: tuple):
+    """Get best offers lists for asset of form without blocking."""
+    asset = form.cleaned_data.get('asset')
+    if asset == BEST_ASSET:
+        asset_conversions = await async_get_best_asset_offers_lists(
+            *conversion_args)
+        return asset_conversions[0].offers_lists, asset_conversions
+    return (await async_get_best_offers_lists(*conversion_args, asset=asset),
+            None)
+
+
+def get_conversion_context(form: ConverterForm, offers_lists,
+                           asset_conversions: List[AssetConversion] = None
+                           ) -> dict:
+    """Calculate conversion for best offers lists of valid converter form.
+
+    Amount of not filled currency is simulated filling across offers,
+    it is estimated with best prices only if offers are not enough.
+    Best prices conversion is kept as extra information. Conversions
+    through other assets compared in best of mode are listed with
+    their amounts.
+    """
+    to_amount_filled = True if form.cleaned_data.get(
+        'to_amount') else False
+    if to_amount_filled:
+        from_offers, to_offers = offers_lists
+        to_amount = form.cleaned_data.get('to_amount')
+        best_from_price = get_best_price(from_offers)
+        best_to_price = get_best_price(to_offers)
+        conversion_rate = best_from_price/best_to_price
+        best_price_from_amount = to_amount*conversion_rate
+        best_price_to_amount = to_amount
+    else:
+        to_offers, from_offers = offers_lists
+        from_amount = form.cleaned_data.get('from_amount')
+        best_from_price = get_best_price(from_offers)
+        best_to_price = get_best_price(to_offers)
+        conversion_rate = best_from_price/best_to_price
+        best_price_from_amount = from_amount
+        best_price_to_amount = from_amount/conversion_rate
+    ages = [offers.age for offers in (from_offers, to_offers)
+            if getattr(offers, 'age', None) is not None]
+    conversion_fill = get_conversion_fill(
+        from_offers, to_offers,
+        from_amount=None if to_amount_filled else best_price_from_amount,
+        to_amount=best_price_to_amount if to_amount_filled else None)
+    if conversion_fill is None:
+        from_amount, to_amount = best_price_from_amount, best_price_to_amount
+    elif to_amount_filled:
+        from_amount = conversion_fill[0]
+    else:
+        to_amount = conversion_fill[1]
+    return {
+        'form': form,
+        'data_age': max(ages) if ages else None,
+        'offers': zip(from_offers, to_offers),
+        'from_offers': from_offers,
+        'to_offers': to_offers,
+        'conversion_rate': conversion_rate,
+        'effective_rate': (from_amount / to_amount
+                           if conversion_fill else None),
+        'is_filled': conversion_fill is not None,
+        'best_price_from_amount': best_price_from_amount,
+        'best_price_to_amount': best_price_to_amount,
+        'to_amount': to_amount,
+        'from_amount': from_amount,
+        'to_currency': form.cleaned_data.get('to_currency'),
+        'from_currency': form.cleaned_data.get('from_currency'),
+        'asset': getattr(from_offers, 'asset', None) or DEFAULT_ASSET,
+        'asset_conversions': [
+            {
+                'asset': conversion.asset,
+                'from_amount': (conversion.amount if to_amount_filled
+                                else from_amount),
+                'to_amount': (to_amount if to_amount_filled
+                              else conversion.amount),
+                'filled': conversion.filled,
+            }
+            for conversion in asset_conversions or ()],
+    }
+
+
+def add_conversion_message(request, context: dict) -> None:
+    """Add successful conversion message.
+
+    Warn if conversion is based on stale offers.
+    """
+    if context['data_age'] is not None:
+        messages.warning(
+            request,
+            f'Binance P2P is unavailable, showing offers '
+            f'{context["data_age"] / 60:.0f} minutes old.')
+    messages.success(request,
+                     f'Successfully converted {context["from_amount"]:.3f} '
+                     f'{context["from_currency"]} to {context["to_amount"]} '
+                     f'{context["to_currency"]}')
 
 
 def get_offers(request):
@@ -77,73 +334,167 @@ def get_offers(request):
     }
 
     if form.is_valid():
-        to_amount_filled = True if form.cleaned_data.get(
-            'to_amount') else False
-        from_currency = form.cleaned_data.get('from_currency')
-        to_currency = form.cleaned_data.get('to_currency')
-        from_payment_method = form.cleaned_data.get('from_payment_methods')
-        to_payment_method = form.cleaned_data.get('to_payment_methods')
-        is_merchant = form.cleaned_data.get('is_merchant')
-        filled_amount = (form.cleaned_data.get('to_amount') if to_amount_filled
-                         else form.cleaned_data.get('from_amount'))
+        conversion_args = get_conversion_args(form)
+        record_conversion(*conversion_args)
         try:
-            if to_amount_filled:
-                to_amount = filled_amount
-                logger.info(
-                    f'requested conversion '
-                    f'{from_currency.code}'
-                    f'[{from_payment_method.display_name}] -> '
-                    f'({to_amount}){to_currency.code}'
-                    f'[{to_payment_method.display_name}]')
-
-                from_offers, to_offers = get_best_offers_lists(
-                    to_currency, from_currency, to_payment_method,
-                    from_payment_method, is_merchant, to_amount,
-                    to_amount_filled)
-
-                best_from_price = get_best_price(from_offers)
-                best_to_price = get_best_price(to_offers)
-                conversion_rate = best_from_price/best_to_price
-                from_amount = to_amount*conversion_rate
-            else:
-                from_amount = filled_amount
-                logger.info(
-                    f'requested conversion '
-                    f'({from_amount}){from_currency.code}'
-                    f'[{from_payment_method.display_name}] -> '
-                    f'{to_currency.code}[{to_payment_method.display_name}]')
-
-                to_offers, from_offers = get_best_offers_lists(
-                    from_currency, to_currency, from_payment_method,
-                    to_payment_method, is_merchant, from_amount,
-                    to_amount_filled)
-
-                best_from_price = get_best_price(from_offers)
-                best_to_price = get_best_price(to_offers)
-                conversion_rate = best_from_price/best_to_price
-                to_amount = from_amount/conversion_rate
+            context = get_conversion_context(
+                form, *get_conversion_offers_lists(form, conversion_args))
         except Exception as e:
             messages.error(request, str(e))
             return render(request, template, context)
 
-        context = {
-            'form': form,
-            'offers': zip(from_offers, to_offers),
-            'from_offers': from_offers,
-            'to_offers': to_offers,
-            'conversion_rate': conversion_rate,
-            'to_amount': to_amount,
-            'from_amount': from_amount,
-            'to_currency': to_currency,
-            'from_currency': from_currency,
-        }
-        messages.success(request,
-                         f'Successfully converted {from_amount:.3f} '
-                         f'{from_currency} to {to_amount} {to_currency}')
-
+        add_conversion_message(request, context)
         logger.info('offers rendered on index page.')
         return render(request, template, context)
     else:
         messages.error(request, form.errors)
         logger.error(form.errors)
         return render(request, template, context)
+
+
+async def async_get_offers(request):
+    """Handle currency conversion requests without blocking worker."""
+    template = 'converter/index.html'
+    form = await sync_to_async(ConverterForm)(
+        request.POST or None)
+    context = {
+        'form': form,
+    }
+
+    if await sync_to_async(form.is_valid)():
+        conversion_args = get_conversion_args(form)
+        await sync_to_async(record_conversion)(*conversion_args)
+        try:
+            context = get_conversion_context(
+                form, *await async_get_conversion_offers_lists(
+                    form, conversion_args))
+        except Exception as e:
+            await sync_to_async(messages.error)(request, str(e))
+            return await sync_to_async(render)(request, template, context)
+
+        await sync_to_async(add_conversion_message)(request, context)
+        logger.info('offers rendered on index page.')
+        return await sync_to_async(render)(request, template, context)
+    else:
+        await sync_to_async(messages.error)(request, form.errors)
+        logger.error(form.errors)
+        return await sync_to_async(render)(request, template, context)
+
+
+def get_popular(request) -> JsonResponse:
+    """Return most popular conversion pairs and order books of all workers.
+
+    Currencies of payment methods requests are counted apart. Counts
+    are time-decayed, number of items is set by 'n' parameter.
+    """
+    try:
+        n = int(request.GET.get('n', 10))
+    except ValueError:
+        n = 10
+    pair_popularity.publish()
+    book_popularity.publish()
+    currency_popularity.publish()
+    return JsonResponse({
+        'pairs': [
+            {
+                'from_currency': from_currency,
+                'from_payment_method': from_payment_method,
+                'to_currency': to_currency,
+                'to_payment_method': to_payment_method,
+                'count': count,
+            }
+            for (from_currency, from_payment_method, to_currency,
+                 to_payment_method), count
+            in pair_popularity.get_shared_top(n)],
+        'books': [
+            {
+                'currency': currency,
+                'payment_method': payment_method,
+                'trade_type': trade_type,
+                'is_merchant': is_merchant,
+                'count': count,
+            }
+            for (currency, payment_method, trade_type, is_merchant), count
+            in book_popularity.get_shared_top(n)],
+        'currencies': [
+            {'currency': currency, 'count': count}
+            for currency, count in currency_popularity.get_shared_top(n)],
+    })
+
+
+def get_cross_rates_matrix(request) -> JsonResponse:
+    """Return rates of all pairs of currencies from current snapshot."""
+    cross_rates = get_cross_rates()
+    if cross_rates is None:
+        return JsonResponse(
+            {'error': 'Cross rates are not built yet.'}, status=503)
+    return JsonResponse(cross_rates.as_dict())
+
+
+def get_cross_rate(request, from_code: str, to_code: str) -> JsonResponse:
+    """Return rate of one currency pair from current snapshot."""
+    cross_rates = get_cross_rates()
+    if cross_rates is None:
+        return JsonResponse(
+            {'error': 'Cross rates are not built yet.'}, status=503)
+    from_code, to_code = from_code.upper(), to_code.upper()
+    try:
+        rate = cross_rates.get_rate(from_code, to_code)
+    except KeyError:
+        return JsonResponse(
+            {'error': f'No cross rate of {from_code} to {to_code}.'},
+            status=404)
+    return JsonResponse({
+        'from_currency': from_code,
+        'to_currency': to_code,
+        'rate': rate,
+        'version': cross_rates.version,
+        'age': cross_rates.age,
+    })
+
+
+def get_route(request) -> JsonResponse:
+    """Return best route of converting amount between two currencies.
+
+    Currencies are set by codes, intermediate currencies by comma
+    separated 'via' codes. Returns 503 if route books are unavailable.
+    """
+    from_currency = get_currency_or_404(
+        code=request.GET.get('from_currency', '').upper())
+    to_currency = get_currency_or_404(
+        code=request.GET.get('to_currency', '').upper())
+    try:
+        amount = float(request.GET.get('amount', ''))
+    except ValueError:
+        amount = 0
+    if not amount > 0:
+        return JsonResponse({'error': 'Amount must be positive.'}, status=400)
+    via_codes = None
+    if request.GET.get('via'):
+        via_codes = [
+            get_currency_or_404(code=code.strip().upper()).code
+            for code in request.GET['via'].split(',')]
+    try:
+        route = find_best_route(
+            from_currency.code, to_currency.code, amount,
+            from_payment_method=(
+                request.GET.get('from_payment_method') or None),
+            to_payment_method=request.GET.get('to_payment_method') or None,
+            is_merchant=request.GET.get('is_merchant') == 'true',
+            via_codes=via_codes)
+    except ApiUnavailableError as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    if route is None:
+        return JsonResponse(
+            {'error': f'No route from {from_currency.code} '
+                      f'to {to_currency.code}.'},
+            status=404)
+    return JsonResponse(route.as_dict())
+
+
+def get_upstream_status(request) -> JsonResponse:
+    """Return state of circuit breakers and quote cache of this worker."""
+    return JsonResponse({
+        'circuit_breakers': get_circuit_breakers_state(),
+        'quote_cache': get_cache_stats(),
+    })